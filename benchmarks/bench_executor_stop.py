@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Local stress benchmark for util.lock and util.executor.Executor.
+# Boots many executors, and lets one thread per executor wait() on it.
+# Then, one thread per executor calls stop() at the same time.
+# Every child takes --exit-delay seconds to exit after being terminated,
+# so if executors serialize each other, stopping them all takes
+# about amount*exit-delay seconds. Without serialization, it takes
+# about exit-delay seconds.
+#
+# Usage: python3 benchmarks/bench_executor_stop.py [--amounts 10 50 200] [--exit-delay 0.2]
+
+import argparse
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))), 'src'))
+from util.executor import Executor
+from util.printer import *
+
+
+# Stop given amount of executors concurrently.
+# Returns time taken to stop them all, and True if all waiters returned
+def bench(amount, exit_delay):
+    command = ['bash', '-c', 'trap "sleep {}; kill \\$!; exit 0" TERM; sleep 600 & wait'.format(exit_delay)]
+    executors = [Executor(command) for x in range(amount)]
+    for x in executors:
+        x.run()
+    while any(x.get_pid() == -1 for x in executors): # Wait until all processes exist
+        time.sleep(0.01)
+    time.sleep(0.2) # Give bash some time to install its trap
+
+    # wait() blocks until the process exits, and must not keep stop() from running
+    waiters = [threading.Thread(target=x.wait) for x in executors]
+    for x in waiters:
+        x.start()
+
+    barrier = threading.Barrier(amount+1)
+    def stopper(executor):
+        barrier.wait()
+        executor.stop()
+    stoppers = [threading.Thread(target=stopper, args=(x,)) for x in executors]
+    for x in stoppers:
+        x.start()
+    barrier.wait()
+    start = time.monotonic()
+    for x in stoppers:
+        x.join()
+    elapsed = time.monotonic() - start
+    for x in waiters:
+        x.join(timeout=10)
+    return elapsed, not any(x.is_alive() for x in waiters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrently stopping many Executors')
+    parser.add_argument('--amounts', nargs='+', type=int, default=[10, 50, 200], help='Amounts of executors to stop at the same time')
+    parser.add_argument('--exit-delay', dest='exit_delay', type=float, default=0.2, help='Seconds every child takes to exit after being terminated')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print('{:>8} {:>12} {:>16} {:>10}'.format('amount', 'stop (s)', 'serialized (s)', 'waiters'))
+    for amount in args.amounts:
+        elapsed, waited = bench(amount, args.exit_delay)
+        print('{:>8} {:>12.3f} {:>16.3f} {:>10}'.format(amount, elapsed, amount*args.exit_delay, 'ok' if waited else 'STUCK'))
+
+if __name__ == '__main__':
+    main()
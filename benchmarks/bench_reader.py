@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# Local benchmark for util.reader.
+# Writes a rolled log set (spark.log, spark.log.1, ...) with rare matching lines,
+# and compares the chunked text reverse reader MetaSpark used before
+# with the mmap-backed readers, for finding the last matches of a pattern,
+# tailing, and reading in reverse. For reading forward, the baseline
+# is plain iteration over a text file.
+#
+# Usage: python3 benchmarks/bench_reader.py [--files 3] [--size-mb 100] [--matches 20]
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))), 'src'))
+import util.reader as reader
+from util.printer import *
+
+
+# The reverse reader as it was, reading 8KB text chunks and joining split lines in Python
+def legacy_reverse_readline(filename, buf_size=8192):
+    with open(filename) as fh:
+        segment = None
+        offset = 0
+        fh.seek(0, os.SEEK_END)
+        file_size = remaining_size = fh.tell()
+        while remaining_size > 0:
+            offset = min(file_size, offset + buf_size)
+            fh.seek(file_size - offset)
+            buffer = fh.read(min(remaining_size, buf_size))
+            remaining_size -= buf_size
+            lines = buffer.split('\n')
+            if segment is not None:
+                if buffer[-1] != '\n':
+                    lines[-1] += segment
+                else:
+                    yield segment
+            segment = lines[0]
+            for index in range(len(lines) - 1, 0, -1):
+                if lines[index]:
+                    yield lines[index]
+        if segment is not None:
+            yield segment
+
+
+def legacy_grep_last(path, pattern, amount):
+    regex = re.compile(pattern)
+    found = []
+    for logpath in reader.rolled_logs(path):
+        for line in legacy_reverse_readline(logpath):
+            if regex.search(line):
+                found.append((logpath, line))
+                if len(found) >= amount:
+                    return list(reversed(found))
+    return list(reversed(found))
+
+
+def legacy_tail(path, amount):
+    found = []
+    for logpath in reader.rolled_logs(path):
+        for line in legacy_reverse_readline(logpath):
+            found.append((logpath, line))
+            if len(found) >= amount:
+                return list(reversed(found))
+    return list(reversed(found))
+
+
+# Write a rolled log set in given directory. Returns path of the newest log
+def generate(directory, files, size_mb, every):
+    path = os.path.join(directory, 'spark.log')
+    line_nr = 0
+    for idx in reversed(range(files)):
+        name = path if idx == 0 else '{}.{}'.format(path, idx)
+        with open(name, 'w') as fh:
+            written = 0
+            while written < size_mb*1024*1024:
+                level = 'ERROR' if line_nr % every == 0 else 'INFO'
+                line = '20/11/02 12:{:02d}:{:02d} {} TaskSetManager: Finished task {}.0 in stage 3.0 (TID {}) in 42 ms on node{:03d} (executor {})\n'.format(
+                    (line_nr // 60) % 60, line_nr % 60, level, line_nr % 997, line_nr, line_nr % 64, line_nr % 16)
+                fh.write(line)
+                written += len(line)
+                line_nr += 1
+    return path
+
+
+# Returns result of func and the best time it took in seconds, out of given amount of repeats
+def timed(func, repeat):
+    best = float('inf')
+    for x in range(repeat):
+        start = time.monotonic()
+        result = func()
+        best = min(best, time.monotonic() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark log readers on a rolled log set')
+    parser.add_argument('--files', type=int, default=3, help='Amount of files in the rolled log set')
+    parser.add_argument('--size-mb', dest='size_mb', type=int, default=100, help='Size of every file in MB')
+    parser.add_argument('--every', type=int, default=200000, help='Write a matching (ERROR) line every this many lines')
+    parser.add_argument('--matches', type=int, default=20, help='Amount of last matches to find')
+    parser.add_argument('--tail', type=int, default=1000, help='Amount of last lines to tail')
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best time out of this many runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print('Writing {} files of {} MB...'.format(args.files, args.size_mb))
+        path = generate(directory, args.files, args.size_mb, args.every)
+
+        print('{:>28} {:>12} {:>12} {:>10}'.format('operation', 'baseline (s)', 'mmap (s)', 'speedup'))
+        rows = [
+            ('grep last {}'.format(args.matches), lambda: legacy_grep_last(path, 'ERROR', args.matches), lambda: reader.grep_last(path, 'ERROR', args.matches)),
+            ('tail {}'.format(args.tail), lambda: legacy_tail(path, args.tail), lambda: reader.tail(path, args.tail)),
+            ('reverse read {}'.format(os.path.basename(path)), lambda: sum(1 for x in legacy_reverse_readline(path)), lambda: sum(1 for x in reader.reverse_readline_bytes(path))),
+            ('forward read {}'.format(os.path.basename(path)), lambda: sum(1 for x in open(path)), lambda: sum(1 for x in reader.forward_readline_bytes(path))),
+        ]
+        for name, legacy, new in rows:
+            legacy_result, legacy_time = timed(legacy, args.repeat)
+            new_result, new_time = timed(new, args.repeat)
+            if legacy_result != new_result:
+                printw('Results of "{}" differ between readers'.format(name))
+            print('{:>28} {:>12.3f} {:>12.3f} {:>9.1f}x'.format(name, legacy_time, new_time, legacy_time / new_time if new_time > 0 else float('inf')))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# Local benchmark for the startup time of main.py on the --exec_internal path.
+# prun starts main.py once per process of a cluster, so every millisecond
+# spent importing is paid on every process of every node.
+#
+# Every measurement runs in a fresh interpreter, which runs main.main() with --exec_internal,
+# like processes spawned by --exec do: It builds the argument parser, imports everything --exec_internal needs,
+# and reads the cluster config from the environment. We stop right before booting a daemon,
+# by replacing remote.remote.run. We report the best and median time of those steps,
+# the plain interpreter startup for reference, and how many subprocesses
+# were started while importing (e.g. "which java"), which should be 0.
+# We also warn if the path imported the deploy.deploy module, which only deployments need.
+# With --importtime, we also list the modules taking longest to import (Python 3.7+).
+#
+# Usage: python3 benchmarks/bench_startup.py [--repeat 20] [--importtime 15]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_root = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.append(os.path.join(_root, 'src'))
+import config.snapshot as snapshot
+from util.printer import *
+
+# Executed by every measured interpreter. Prints seconds taken and amount of subprocesses started
+_child = '''
+import subprocess, sys, time
+start = time.perf_counter()
+started = []
+_init = subprocess.Popen.__init__
+def _counting_init(self, *args, **kwargs):
+    started.append(args[0] if len(args) > 0 else kwargs.get('args'))
+    _init(self, *args, **kwargs)
+subprocess.Popen.__init__ = _counting_init
+
+sys.argv = [{main!r}, '--exec_internal', 'bench.cfg']
+sys.path[:0] = [{root!r}, {src!r}]
+import main
+def _run(configname, debug_mode): # Stand-in for remote.remote.run, which boots a daemon
+    import config.snapshot as snapshot
+    assert snapshot.cluster_from_env(configname) != None
+def _exec_internal(config_filename, debug_mode):
+    import remote.remote as rmt
+    rmt.run = _run
+    return _real_exec_internal(config_filename, debug_mode)
+_real_exec_internal = main._exec_internal
+main._exec_internal = _exec_internal
+main.main()
+print(time.perf_counter() - start, len(started), int('deploy.deploy' in sys.modules))
+'''
+
+
+# Run given code in a fresh interpreter in given directory. Returns wall clock seconds it took, and its output
+def _run(code, cwd, env, args=[]):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable]+args+['-c', code], cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark startup of main.py for --exec_internal')
+    parser.add_argument('--repeat', type=int, default=20, help='Amount of fresh interpreters to measure')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='List the N modules taking longest to import (Python 3.7+)')
+    args = parser.parse_args()
+
+    cfg = snapshot.ClusterSnapshot(path='bench.cfg', nodes=16, coallocation_affinity=16, infiniband=True, worker_cores='auto',
+        worker_memory='auto', profile='stock', spark_version='3.0.1', spark_build='hadoop2.7', stage_local=False)
+    env = snapshot.env_with_cluster(cfg)
+    code = _child.format(main=os.path.join(_root, 'main.py'), root=_root, src=os.path.join(_root, 'src'))
+
+    # Run from an empty directory: Startup must not need (or ask for) any configuration files
+    with tempfile.TemporaryDirectory() as cwd:
+        baseline = [_run('pass', cwd, env)[0] for x in range(args.repeat)]
+        walls, imports, spawned = [], [], 0
+        for x in range(args.repeat):
+            wall, out = _run(code, cwd, env)
+            seconds, started, deploy = out.stdout.decode('utf-8').split()
+            walls.append(wall)
+            imports.append(float(seconds))
+            spawned = max(spawned, int(started))
+            deploy_imported = deploy == '1'
+
+        print('{:>36} {:>10} {:>10}'.format('measurement', 'best (ms)', 'median (ms)'))
+        for name, values in (('interpreter startup', baseline), ('main() until boot (in process)', imports), ('total (wall clock)', walls)):
+            print('{:>36} {:>10.1f} {:>10.1f}'.format(name, 1000*min(values), 1000*statistics.median(values)))
+        if spawned > 0:
+            printw('Importing started {} subprocess(es)'.format(spawned))
+        else:
+            print('Importing started no subprocesses')
+        if deploy_imported:
+            printw('--exec_internal imported deploy.deploy')
+
+        if args.importtime > 0:
+            if sys.version_info < (3, 7):
+                printw('--importtime needs Python 3.7 or newer')
+                return
+            out = _run(code, cwd, env, args=['-X', 'importtime'])[1]
+            rows = []
+            for line in out.stderr.decode('utf-8').splitlines():
+                parts = line.split('|')
+                if len(parts) == 3 and parts[1].strip().isdigit():
+                    rows.append((int(parts[1]), parts[2].rstrip()))
+            print('\nSlowest imports (cumulative, us):')
+            for cumulative, name in sorted(rows, reverse=True)[:args.importtime]:
+                print('{:>10} {}'.format(cumulative, name))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# Local multi-process benchmark for remote.util.syncer.Syncer.
+# Spawns a number of participants on this machine, lets them pass
+# a series of barriers, and reports barrier latency percentiles.
+# Barrier latency of a round is the time between the last participant
+# entering sync() and the last participant leaving it.
+# Time-to-connected is the time between the first participant starting
+# to build its Syncer and the last participant being done with it.
+# Release skew of a round is the time between the first and the last
+# participant leaving sync(). With --lead, participants estimate
+# clock offsets first, and prime releases everyone lead seconds later.
+#
+# Usage: python3 benchmarks/bench_syncer.py [--sizes 8 16 ...] [--modes flat tree:2 tree:8] [--rendezvous announce file] [--rounds 50]
+
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))), 'src'))
+from remote.util.syncer import Syncer
+from util.printer import *
+
+
+# Body of a single participant.
+# Puts (rank, start time, connected time, entry times, exit times of every round) on the queue
+def _participant(rank, size, mode, fanout, rendezvous, lead, rounds, warmup, sync_dir, start, queue):
+    config = SimpleNamespace(gid=0 if rank == 0 else rank-1, hosts=[socket.gethostname()], nodes=[])
+    experiment = SimpleNamespace(num_servers=1, num_clients=size-1)
+    start.wait()
+    started = time.monotonic()
+    syncer = Syncer(config, experiment, 'server' if rank == 0 else 'client', mode=mode, fanout=fanout, sync_dir=sync_dir, rendezvous=rendezvous, reservation=sync_dir)
+    connected = time.monotonic()
+    if lead != None:
+        syncer.estimate_offsets()
+    entries = []
+    exits = []
+    for x in range(warmup+rounds):
+        entered = time.monotonic()
+        syncer.sync(lead=lead)
+        left = time.monotonic()
+        if x >= warmup:
+            entries.append(entered)
+            exits.append(left)
+    syncer.close()
+    queue.put((rank, started, connected, entries, exits))
+
+
+# Returns given percentile (0-100) of a sorted list of values
+def percentile(values, pct):
+    if len(values) == 0:
+        return float('nan')
+    idx = min(len(values)-1, max(0, int(round(pct / 100.0 * (len(values)-1)))))
+    return values[idx]
+
+
+# Run one benchmark configuration.
+# Returns time-to-connected in seconds, and sorted lists of per-round barrier latencies and release skews in seconds
+def bench(size, mode, fanout, rendezvous, lead, rounds, warmup):
+    queue = multiprocessing.Queue()
+    start = multiprocessing.Event()
+    with tempfile.TemporaryDirectory() as sync_dir:
+        procs = [multiprocessing.Process(target=_participant, args=(rank, size, mode, fanout, rendezvous, lead, rounds, warmup, sync_dir, start, queue)) for rank in range(size)]
+        for p in procs:
+            p.start()
+        start.set()
+        results = [queue.get() for x in range(size)]
+        for p in procs:
+            p.join()
+    connect_time = max(x[2] for x in results) - min(x[1] for x in results)
+    latencies = []
+    skews = []
+    for idx in range(rounds):
+        last_entry = max(x[3][idx] for x in results)
+        first_exit = min(x[4][idx] for x in results)
+        last_exit = max(x[4][idx] for x in results)
+        latencies.append(last_exit - last_entry)
+        skews.append(last_exit - first_exit)
+    return connect_time, sorted(latencies), sorted(skews)
+
+
+# Parse a mode like "flat", "tree" or "tree:8" into (mode, fanout)
+def parse_mode(string):
+    if ':' in string:
+        mode, fanout = string.split(':', 1)
+        return mode, int(fanout)
+    return string, 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Syncer barrier latency using local processes')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[8, 16, 32, 64, 128, 256, 512, 1024], help='Amounts of participants to benchmark')
+    parser.add_argument('--modes', nargs='+', type=str, default=['flat', 'tree:2', 'tree:8'], help='Barrier modes to benchmark, as "flat" or "tree:<fanout>"')
+    parser.add_argument('--rendezvous', nargs='+', type=str, default=['announce'], help='Rendezvous methods to benchmark ("announce" and/or "file")')
+    parser.add_argument('--lead', type=float, default=None, help='Release all participants this many seconds after the barrier completes, on the clock of prime')
+    parser.add_argument('--rounds', type=int, default=50, help='Amount of measured barrier rounds')
+    parser.add_argument('--warmup', type=int, default=5, help='Amount of unmeasured barrier rounds before measuring')
+    args = parser.parse_args()
+
+    # Every participant holds a few sockets, so we need many file descriptors
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print('{:>6} {:>8} {:>10} {:>14} {:>10} {:>10} {:>10} {:>10} {:>14}'.format('nodes', 'mode', 'rendezvous', 'connect (ms)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)', 'skew p50 (ms)'))
+    for size in args.sizes:
+        for mode_string in args.modes:
+            mode, fanout = parse_mode(mode_string)
+            for rendezvous in args.rendezvous:
+                connect_time, latencies, skews = bench(size, mode, fanout, rendezvous, args.lead, args.rounds, args.warmup)
+                print('{:>6} {:>8} {:>10} {:>14.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>14.3f}'.format(
+                    size,
+                    mode_string,
+                    rendezvous,
+                    connect_time*1000,
+                    percentile(latencies, 50)*1000,
+                    percentile(latencies, 90)*1000,
+                    percentile(latencies, 99)*1000,
+                    latencies[-1]*1000,
+                    percentile(skews, 50)*1000))
+
+if __name__ == '__main__':
+    main()
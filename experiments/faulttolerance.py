@@ -55,6 +55,10 @@ class FaultToleranceExperiment(ExperimentInterface):
         '''Period in seconds for servers to clean their crawlspaces. 0 means no cleaning'''
         return 8
 
+    def sync_timeout(self):
+        '''Seconds nodes may take to arrive at a barrier before the others continue without them. None means wait forever'''
+        return 30 # Killed servers must not hang the cluster
+
 
     # Constructs symlinks in zookeeper-client directory, so classpath resolves to required jars 
     def _prepare_classpath_symlinks(self):
@@ -67,6 +67,19 @@ class ExperimentInterface(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 
+    def sync_mode(self):
+        '''Barrier used to synchronise nodes between runs: "flat" (all nodes wait on prime) or "tree" (k-ary tree of nodes)'''
+        return 'flat'
+
+    def sync_fanout(self):
+        '''Amount of children per node when sync_mode() is "tree"'''
+        return 2
+
+    def sync_timeout(self):
+        '''Seconds nodes may take to arrive at a barrier before the others continue without them. None means wait forever'''
+        return None
+
+
     @abc.abstractmethod
     def pre_experiment(self, metaspark):
         '''Execution before experiment starts. Executed on the remote once.'''
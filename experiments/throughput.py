@@ -44,6 +44,14 @@ class ThroughputExperiment(ExperimentInterface):
         '''Period in seconds for servers to clean their crawlspaces. 0 means no cleaning'''
         return 8
 
+    def sync_mode(self):
+        '''Barrier used to synchronise nodes between runs: "flat" (all nodes wait on prime) or "tree" (k-ary tree of nodes)'''
+        return 'tree'
+
+    def sync_fanout(self):
+        '''Amount of children per node when sync_mode() is "tree"'''
+        return 8
+
     def get_read_ratios(self):
         return ['0', '25', '50', '75', '90', '100']    
 
@@ -2,28 +2,26 @@
 # The main file of MetaSpark.
 # This file handles main argument parsing, 
 # initial command processing and command redirection
+#
+# Every command imports the modules it needs itself, when it runs.
+# prun starts this file on every process of a cluster (--exec_internal),
+# so anything we import here slows down booting every node.
 
 import argparse
 import os
 import sys
-import time
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), 'src'))
-from config.meta import cfg_meta_instance as metacfg
-import config.cluster as clr
-import deploy.deploy as deploy
-import remote.remote as rmt
-import supplier.spark as spk
-import supplier.java as jv
-from util.executor import Executor
+from config.meta import cfg_meta_instance as metacfg # Loads settings on first use, not on import
 import util.location as loc
 import util.fs as fs
-import util.ui as ui
 from util.printer import *
 
 
 # Check if required tools (Java11, Scala12) are available
 def check(silent=False):
+    import supplier.java as jv
+    import supplier.spark as spk
     a = spk.spark_available()
     b = jv.check_version(minVersion=11, maxVersion=11)
     if a and b:
@@ -45,13 +43,35 @@ def clean():
 
 # Redirects server node control to dedicated code
 def _exec_internal(config_filename, debug_mode):
+    import remote.remote as rmt
     return rmt.run(config_filename, debug_mode)
 
 # Handles execution on the remote main node, before booting the cluster
 def exec(time_to_reserve, config_filename, debug_mode):
+    import config.cluster as clr
+    import config.meta as meta
+    import config.snapshot as snapshot
+    import remote.util.state as state
+    import supplier.spark as spk
+    from util.executor import Executor
     print('Connected! Using cluster configuration "{}"'.format(config_filename))
     cluster_cfg = clr.load_cluster_config(config_filename)
 
+    warm = state.live_state()
+    if warm != None:
+        if state.matches(warm, config_filename, cluster_cfg): # Reuse the cluster which is still running
+            printc('Cluster (config "{}", reservation {}) is still running on {}'.format(warm['config'], warm['reservation'], warm['master_url']), Color.PRP)
+            print('Deployments use it automatically. Use "--stop" to stop it.')
+            return True
+        printw('Running cluster (config "{}") does not match requested config "{}". Stopping it...'.format(warm['config'], config_filename))
+        if not _stop_cluster(warm):
+            return False
+
+    # Clusters may run any Spark version side by side. Install the selected one if needed
+    if not spk.install(cluster_cfg.spark_version, cluster_cfg.spark_build):
+        printe('Spark {} ({}) is not available'.format(cluster_cfg.spark_version, cluster_cfg.spark_build))
+        return False
+
 #     time_to_reserve = time if time != '' else ui.ask_time('''
 # How much time to reserve for Spark cluster with {} nodes?
 # Note: Prefer reserving more time over the reservation system
@@ -65,10 +85,11 @@ def exec(time_to_reserve, config_filename, debug_mode):
     command = 'prun -np {} -{} -t {} python3 {} --exec_internal {} {}'.format(nodes, affinity, time_to_reserve, fs.join(fs.abspath(), 'main.py'), config_filename, '-d' if debug_mode else '')
 
     print('Booting network...')
-    executor = Executor(command, shell=True)
+    env = snapshot.env_with_meta(meta.load_meta_config(), snapshot.env_with_cluster(cluster_cfg)) # Nodes get our parsed configs, instead of parsing them themselves
+    executor = Executor(command, shell=True, env=env)
 
     # Remove old logs
-    fs.rm(loc.get_spark_logs_dir(), ignore_errors=True)
+    fs.rm(loc.get_spark_logs_dir(cluster_cfg.spark_version, cluster_cfg.spark_build), ignore_errors=True)
 
     try:
         executor.run()
@@ -81,6 +102,7 @@ def exec(time_to_reserve, config_filename, debug_mode):
     #     printw('Unexpected error found (cleaning up):')
     #     print(e)
     #     status = executor.stop() == 0
+    state.clear_state()
 
 
     if status:
@@ -89,52 +111,105 @@ def exec(time_to_reserve, config_filename, debug_mode):
         printe('Cluster execution shutdown with errors!')
     return status
 
-# Handles export commandline argument
-def export(full_exp=False):
+# Stops given running cluster (see remote.util.state) by cancelling its reservation,
+# and waits at most timeout seconds for its master to go down. Returns True on success, False otherwise
+def _stop_cluster(warm, timeout=60):
+    import remote.reservation as reservation
+    import remote.util.state as state
+    import time
+    if warm['reservation'] == None:
+        printe('Cluster at {} has no known reservation, cannot stop it'.format(warm['master_url']))
+        return False
+    if not reservation.cancel_reservation(warm['reservation']):
+        printe('Could not cancel reservation {}'.format(warm['reservation']))
+        return False
+    end = time.monotonic() + timeout
+    while state.live_state() != None:
+        if time.monotonic() > end:
+            printe('Cluster at {} still runs {} seconds after cancelling its reservation'.format(warm['master_url'], timeout))
+            return False
+        time.sleep(1)
+    state.clear_state()
+    prints('Stopped cluster (config "{}", reservation {})'.format(warm['config'], warm['reservation']))
+    return True
+
+# Handles stop commandline argument on the remote main node
+def _stop_internal():
+    import remote.util.state as state
+    warm = state.live_state()
+    if warm == None:
+        print('No cluster is running')
+        state.clear_state()
+        return True
+    return _stop_cluster(warm)
+
+# Handles stop commandline argument: Stops the cluster running on the remote
+def stop():
+    import util.connection as connection
+    print('Connecting using key "{0}"...'.format(metacfg.ssh.ssh_key_name))
+    return connection.get(metacfg.ssh).run('python3 {}/main.py --stop_internal'.format(loc.get_remote_metaspark_dir())) == 0
+
+
+# Handles export commandline argument.
+# We only send files which changed since the last export to the same remote.
+# With fresh=True, we send all files again
+def export(full_exp=False, fresh=False):
+    import util.connection as connection
+    import util.exporter as exporter
     print('Copying files using "{}" strategy, using key "{}"...'.format('full' if full_exp else 'fast', metacfg.ssh.ssh_key_name))
-    command = 'rsync -az {} {}:{}'.format(fs.abspath(),metacfg.ssh.ssh_key_name,loc.get_remote_metaspark_parent_dir())
+    excludes = [
+        '.git',
+        '__pycache__',
+        'results',
+        'graphs',
+        fs.basename(loc.get_metaspark_export_manifest_file()),
+        fs.basename(loc.get_metaspark_cluster_state_file())]
     if full_exp:
-        command+= ' --exclude '+' --exclude '.join([
-            '.git',
-            '__pycache__',
-            'results',
-            'graphs'])
         if not clean():
             printe('Cleaning failed')
             return False
     else:
         print('[NOTE] This means we skip dep files.')
-        command+= ' --exclude '+' --exclude '.join([
-            '.git',
-            '__pycache__',
-            'results', 
-            'graphs',
-            'deps'])
-    if os.system(command) == 0:
-        prints('Export success!')
-        return True
-    else:
-        printe('Export failure!')
+        excludes.append('deps')
+    target = '{}:{}'.format(metacfg.ssh.ssh_key_name, loc.get_remote_metaspark_dir())
+    conn = connection.get(metacfg.ssh)
+    try:
+        report = exporter.export(fs.abspath(), target, loc.get_metaspark_export_manifest_file(), excludes=excludes, fresh=fresh, rsh=conn.ssh_command())
+    except RuntimeError as e:
+        printe('Export failure! ({})'.format(e))
         return False
+    conn.record('export ({} files)'.format(report.sent), report.seconds)
+    prints('Export success!')
+    print(report)
+    return True
 
 
-def _init_internal():
+# Installs the default Spark version, and every version our cluster configs use
+def _init_internal(mirrors):
+    import config.cluster as clr
+    import supplier.java as jv
+    import supplier.spark as spk
     if (not jv.check_version()):
         print('Java not ready on remote!')
         exit(1)
-    elif not spk.install():
-        exit(1)
-    else:
-        exit(0)
+    versions = set(clr.get_spark_versions())
+    versions.add((loc.default_spark_version, loc.default_spark_build))
+    for version, build in sorted(versions):
+        if not spk.install(version, build, mirrors=mirrors):
+            exit(1)
+    exit(0)
 
 
-# Handles init commandline argument
-def init():
+# Handles init commandline argument.
+# Optionally, mirrors is a list of paths or urls to try before the official Spark download servers
+def init(mirrors=[]):
+    import util.connection as connection
     print('Initializing MetaSpark...')
-    if not export(full_exp=True):
+    if not export(full_exp=True, fresh=True): # The remote may be new or wiped, so we send everything
         printe('Unable to export to DAS5 remote using user/ssh-key "{}"'.format(metacfg.ssh_key_name))
         return False
-    if os.system('ssh {} "python3 {}/main.py --init_internal"'.format(metacfg.ssh.ssh_key_name, loc.get_remote_metaspark_dir())) == 0:
+    mirror_args = ''.join(' --mirror {}'.format(x) for x in mirrors)
+    if connection.get(metacfg.ssh).run('python3 {}/main.py --init_internal{}'.format(loc.get_remote_metaspark_dir(), mirror_args)) == 0:
         prints('Completed MetaSpark initialization. Use "{} --remote" to start execution on the remote host'.format(sys.argv[0]))
     else:
         printe('Something went wrong with MetaSpark initialization (see above). Please fix the problems and try again!')
@@ -142,7 +217,9 @@ def init():
 
 # Handles remote commandline argument
 def remote(time_to_reserve, config_filename, debug_mode, force_exp):
-    if force_exp and not export(full_exp=True):
+    import config.cluster as clr
+    import util.connection as connection
+    if force_exp and not export(full_exp=True, fresh=True):
         printe('Could not export data')
         return False
 
@@ -158,23 +235,32 @@ def remote(time_to_reserve, config_filename, debug_mode, force_exp):
 
     program = '--exec {} -t {}'.format(config_filename, time_to_reserve) + (' -d' if debug_mode else '')
 
-    command = 'ssh {0} "python3 {1}/main.py {2}"'.format(
-        metacfg.ssh.ssh_key_name,
-        loc.get_remote_metaspark_dir(),
-        program)
     print('Connecting using key "{0}"...'.format(metacfg.ssh.ssh_key_name))
-    return os.system(command) == 0
+    return connection.get(metacfg.ssh).run('python3 {}/main.py {}'.format(loc.get_remote_metaspark_dir(), program)) == 0
 
 # Redirects execution to settings.py, where user can change settings
 def settings():
-    metacfg.change_settings()
+    import config.meta as meta
+    meta.change_settings()
+
+
+# Print how long every command on a remote took.
+# If no command imported util.connection, there were no remote commands
+def _print_connection_stats():
+    connection = sys.modules.get('util.connection')
+    if connection == None:
+        return
+    for conn in connection.connections():
+        if len(conn.stats()) > 0:
+            print(conn.summary())
 
 
 # The main function of MetaSpark
 def main():
+    import deploy.args as deployargs # Not deploy.deploy: Only deployments need that (slow to import) module
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
     subparsers = parser.add_subparsers(help='Subcommands', dest='command')
-    deploy.subparser(subparsers)
+    deployargs.subparser(subparsers)
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--check', help='check whether environment has correct tools', action='store_true')
@@ -185,13 +271,20 @@ def main():
     group.add_argument('--init', help='Initialize MetaSpark to run code on the DAS5', action='store_true')
     group.add_argument('--remote', nargs='?', metavar='cluster_config', const='.', default='.', type=str, help='execute code on the DAS5 from your local machine')
     group.add_argument('--settings', help='Change settings', action='store_true')
+    group.add_argument('--stop_internal', help=argparse.SUPPRESS, action='store_true')
+    group.add_argument('--stop', help='Stop the cluster running on the DAS5', action='store_true')
     parser.add_argument('-d', '--debug-mode', dest='debug_mode', help='Run remote in debug mode', action='store_true')
     parser.add_argument('-e', '--force-export', dest='force_exp', help='Forces to re-do the export phase', action='store_true')
+    parser.add_argument('--fresh-export', dest='fresh_exp', help='With --export, send all files again instead of only changed files', action='store_true')
+    parser.add_argument('--mirror', action='append', default=[], metavar='path_or_url', help='With --init, fetch Spark from this mirror first (may be given multiple times).\nA mirror is a directory or url containing the Spark archive and its .sha512 file')
     parser.add_argument('-t', '--time', dest='time_alloc', nargs='?', metavar='[[hh:]mm:]ss', const='15:00', default='15:00', type=str, help='Amount of time to allocate on clusters during a run')
     args = parser.parse_args()
 
-    if deploy.deploy_args_set(args):
-        return deploy.deploy(parser, args)
+    if deployargs.deploy_args_set(args):
+        import deploy.deploy as deploy
+        status = deploy.deploy(parser, args)
+        _print_connection_stats()
+        return status
     if args.check:
         check()
     elif args.exec_internal:
@@ -199,19 +292,24 @@ def main():
     elif args.exec:
         exec(args.time_alloc, args.exec[0], args.debug_mode)
     elif args.export:
-        export(full_exp=True)
+        export(full_exp=True, fresh=args.fresh_exp)
     elif args.init_internal:
-        _init_internal()
+        _init_internal(args.mirror)
     elif args.init:
-        init()
+        init(args.mirror)
     elif args.remote:
         if args.remote == '.': args.remote = ''
         remote(args.time_alloc, args.remote, args.debug_mode, args.force_exp)
+    elif args.stop_internal:
+        _stop_internal()
+    elif args.stop:
+        stop()
     elif args.settings:
         settings()
 
     if len(sys.argv) == 1:
         parser.print_help()
+    _print_connection_stats()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -3,7 +3,10 @@
 
 
 import configparser
+import re
 
+import config.profile as prf
+import config.snapshot as snapshot
 import util.fs as fs
 import util.location as loc
 from util.printer import *
@@ -23,31 +26,90 @@ def ask_affinity(nodes):
 def ask_infiniband():
     return ui.ask_bool('Use infiniband connection between the servers for communication?')
 
+def ask_worker_cores():
+    while True:
+        ans = ui.ask_string('How many cores to give each worker? ("auto" divides the cores of a node over its processes)')
+        if ans == 'auto' or (ans.isnumeric() and int(ans) > 0):
+            return ans
+        printe('"{}" is no positive number, nor "auto"'.format(ans))
+
+def ask_worker_memory():
+    while True:
+        ans = ui.ask_string('How much memory to give each worker (e.g. "1024M", "4G")? ("auto" divides the memory of a node over its processes)')
+        if ans == 'auto' or valid_memory(ans):
+            return ans
+        printe('"{}" is no amount of memory like "1024M" or "4G", nor "auto"'.format(ans))
+
+def ask_spark_version():
+    while True:
+        ans = ui.ask_string('Which Spark version to use? (leave empty for default {})'.format(loc.default_spark_version), empty_ok=True)
+        if ans == '' or valid_spark_version(ans):
+            return ans if ans != '' else loc.default_spark_version
+        printe('Invalid version "{}", expected e.g. "3.0.1"'.format(ans))
+
+def ask_spark_build():
+    while True:
+        ans = ui.ask_string('Which Spark build to use? (e.g. "hadoop3.2", leave empty for default {})'.format(loc.default_spark_build), empty_ok=True)
+        if ans == '' or valid_spark_build(ans):
+            return ans if ans != '' else loc.default_spark_build
+        printe('Invalid build "{}", expected e.g. "hadoop2.7" or "without-hadoop"'.format(ans))
+
+def ask_stage_local():
+    return ui.ask_bool('Copy Spark and deployed jars to node-local disk, and run from there? (faster booting on many nodes)')
+
+def ask_profile():
+    names = prf.profile_names()
+    return names[ui.ask_pick('Which performance profile to render into the Spark configuration? ("stock" uses Spark defaults)', names)]
+
+# Returns True if given string is a Spark release version (e.g. "3.0.1"), False otherwise
+def valid_spark_version(string):
+    return re.fullmatch(r'[0-9]+\.[0-9]+\.[0-9]+', string) != None
+
+# Returns True if given string looks like a Spark build name (e.g. "hadoop2.7", "without-hadoop"), False otherwise
+def valid_spark_build(string):
+    return re.fullmatch(r'[A-Za-z0-9][A-Za-z0-9.\-]*', string) != None
+
+# Returns True if given string is an amount of memory Spark understands (e.g. "1024M", "4G"), False otherwise
+def valid_memory(string):
+    return len(string) > 1 and string[:-1].isnumeric() and string[-1].upper() in ('M', 'G')
+
 
 # Generate a config by asking the user relevant questions
 def gen_config():
     nodes = ask_nodes()
     affinity = ask_affinity(nodes)
     infiniband = ask_infiniband()
+    worker_cores = ask_worker_cores()
+    worker_memory = ask_worker_memory()
+    profile = ask_profile()
+    spark_version = ask_spark_version()
+    spark_build = ask_spark_build()
+    stage_local = ask_stage_local()
     while True:
         configloc = fs.join(loc.get_metaspark_cluster_conf_dir(), fs.basename(ui.ask_string('Please give a name to this configuration')))
         if not configloc.endswith('.cfg'):
             configloc += '.cfg'
         if (not fs.isfile(configloc)) or ui.ask_bool('Config "{}" already exists, override?').format(configloc):
-            write_config(configloc, nodes, affinity, infiniband)
+            write_config(configloc, nodes, affinity, infiniband, worker_cores, worker_memory, profile, spark_version, spark_build, stage_local)
             return configloc
         else:
             printw('Pick another configname.')
 
 
 # Persist a configuration to file using given variables
-def write_config(configloc, nodes, coallocation_affinity, infiniband):
+def write_config(configloc, nodes, coallocation_affinity, infiniband, worker_cores='1', worker_memory='1024M', profile='stock', spark_version=loc.default_spark_version, spark_build=loc.default_spark_build, stage_local=False):
     fs.mkdir(loc.get_metaspark_cluster_conf_dir(), exist_ok=True)
     parser = configparser.ConfigParser()
     parser['Cluster'] = {
         'nodes': nodes,
         'coallocation_affinity': coallocation_affinity,
-        'infiniband': infiniband
+        'infiniband': infiniband,
+        'worker_cores': worker_cores,
+        'worker_memory': worker_memory,
+        'profile': profile,
+        'spark_version': spark_version,
+        'spark_build': spark_build,
+        'stage_local': stage_local
     }
     with open(configloc, 'w') as file:
         parser.write(file)
@@ -55,11 +117,15 @@ def write_config(configloc, nodes, coallocation_affinity, infiniband):
 
 # Check if all required data is present in the config
 def validate_settings(config_loc):
-    d = dict()
-    d['Cluster'] = {'nodes', 'coallocation_affinity', 'infiniband'}
-    
     parser = configparser.ConfigParser()
     parser.read(config_loc)
+    _validate_parser(parser)
+
+# Check if all required data is present in given parsed config
+def _validate_parser(parser):
+    d = dict()
+    d['Cluster'] = {'nodes', 'coallocation_affinity', 'infiniband'}
+
     for key in d:
         if not key in parser:
             raise RuntimeError('Missing section "{}"'.format(key))
@@ -68,6 +134,47 @@ def validate_settings(config_loc):
                 if not subkey in parser[key]:
                     raise RuntimeError('Missing key "{}" in section "{}"'.format(subkey, key))
 
+    # Optional keys, added later on
+    cores = parser['Cluster'].get('worker_cores', '1')
+    if cores != 'auto' and not (cores.isnumeric() and int(cores) > 0):
+        raise RuntimeError('Invalid worker_cores "{}" (expected a positive number or "auto")'.format(cores))
+    memory = parser['Cluster'].get('worker_memory', '1024M')
+    if memory != 'auto' and not valid_memory(memory):
+        raise RuntimeError('Invalid worker_memory "{}" (expected e.g. "1024M", "4G" or "auto")'.format(memory))
+    profile = parser['Cluster'].get('profile', 'stock')
+    if not profile in prf.profile_names():
+        raise RuntimeError('Unknown profile "{}" (expected one of {})'.format(profile, ', '.join(prf.profile_names())))
+    version = parser['Cluster'].get('spark_version', loc.default_spark_version)
+    if not valid_spark_version(version):
+        raise RuntimeError('Invalid spark_version "{}" (expected e.g. "3.0.1")'.format(version))
+    build = parser['Cluster'].get('spark_build', loc.default_spark_build)
+    if not valid_spark_build(build):
+        raise RuntimeError('Invalid spark_build "{}" (expected e.g. "hadoop2.7")'.format(build))
+    stage_local = parser['Cluster'].get('stage_local', 'False')
+    if not stage_local in ('True', 'False'):
+        raise RuntimeError('Invalid stage_local "{}" (expected "True" or "False")'.format(stage_local))
+
+
+# Parse and validate the cluster config at given path, once.
+# Returns a config.snapshot.ClusterSnapshot with all settings converted
+def _snapshot_of(path):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    _validate_parser(parser)
+    section = parser['Cluster']
+    cores = section.get('worker_cores', '1')
+    return snapshot.ClusterSnapshot(
+        path=path,
+        nodes=int(section['nodes']),
+        coallocation_affinity=int(section['coallocation_affinity']),
+        infiniband=section['infiniband'] == 'True',
+        worker_cores=cores if cores == 'auto' else int(cores),
+        worker_memory=section.get('worker_memory', '1024M'),
+        profile=section.get('profile', 'stock'),
+        spark_version=section.get('spark_version', loc.default_spark_version),
+        spark_build=section.get('spark_build', loc.default_spark_build),
+        stage_local=section.get('stage_local', 'False') == 'True')
+
 
 class ClusterConfig(object):    
     '''
@@ -76,25 +183,54 @@ class ClusterConfig(object):
     size they want.
     '''
     def __init__(self, path):
-        validate_settings(path)
-        self.parser = configparser.ConfigParser()
-        self.parser.read(path)
+        self._snapshot = snapshot.cached(path, _snapshot_of) # Parsed and validated once, until the file changes
         self._path = path
 
     # Size of our cluster (in nodes, each node has coallocation_affinity processes)
     @property
     def nodes(self):
-        return int(self.parser['Cluster']['nodes'])
+        return self._snapshot.nodes
 
     # Amount of processes per node
     @property
     def coallocation_affinity(self):
-        return int(self.parser['Cluster']['coallocation_affinity'])
+        return self._snapshot.coallocation_affinity
 
     # True if nodes use infiniband communication, False otherwise
     @property
     def infiniband(self):
-        return self.parser['Cluster']['infiniband'] == 'True'
+        return self._snapshot.infiniband
+
+    # Cores per worker, as a number or 'auto'. Configs without this setting use 1 core
+    @property
+    def worker_cores(self):
+        return self._snapshot.worker_cores
+
+    # Memory per worker, as a string like '1024M' or 'auto'. Configs without this setting use 1024M
+    @property
+    def worker_memory(self):
+        return self._snapshot.worker_memory
+
+    # Performance profile to render into the Spark configuration. Configs without this setting use 'stock'
+    @property
+    def profile(self):
+        return self._snapshot.profile
+
+    # Spark version to run. Configs without this setting use the default version
+    @property
+    def spark_version(self):
+        return self._snapshot.spark_version
+
+    # Spark build (e.g. 'hadoop2.7') to run. Configs without this setting use the default build
+    @property
+    def spark_build(self):
+        return self._snapshot.spark_build
+
+    # True if nodes copy Spark and deployed jars to node-local disk and run from there, False otherwise.
+    # Configs without this setting run from the shared filesystem
+    @property
+    def stage_local(self):
+        return self._snapshot.stage_local
 
     @property
     def path(self):
@@ -107,6 +243,22 @@ class ClusterConfig(object):
             parser.write(file)
 
 
+# Returns a sorted list of all (spark_version, spark_build) pairs used by our cluster configs
+def get_spark_versions():
+    fs.mkdir(loc.get_metaspark_cluster_conf_dir(), exist_ok=True)
+    versions = set()
+    for path in fs.ls(loc.get_metaspark_cluster_conf_dir(), only_files=True, full_paths=True):
+        if not path.endswith('.cfg'):
+            continue
+        try:
+            cfg = ClusterConfig(path)
+        except RuntimeError as e:
+            printw('Skipping invalid cluster config "{}": {}'.format(fs.basename(path), e))
+            continue
+        versions.add((cfg.spark_version, cfg.spark_build))
+    return sorted(versions)
+
+
 # Gets a cluster config to use. Asks user if multiple candidates exist
 # Returns cluster config, and a boolean describing whether we should export conf data or not
 def get_cluster_config():
@@ -123,6 +275,7 @@ def get_cluster_config():
             return ClusterConfig(path), True
         return ClusterConfig(cfg_paths[idx-1]), False
 
-# Load a cluster config with given filename from disk and return it
+# Load a cluster config with given filename from disk and return it, as a config.snapshot.ClusterSnapshot.
+# We parse every file only once, until it changes
 def load_cluster_config(config_filename):
-    return ClusterConfig(fs.join(loc.get_metaspark_cluster_conf_dir(), config_filename))
\ No newline at end of file
+    return snapshot.cached(fs.join(loc.get_metaspark_cluster_conf_dir(), config_filename), _snapshot_of)
\ No newline at end of file
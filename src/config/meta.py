@@ -7,6 +7,7 @@
 
 import configparser
 
+import config.snapshot as snapshot
 import util.fs as fs
 from util.printer import *
 import util.ui as ui
@@ -68,11 +69,15 @@ def change_settings():
 
 # Check if all required data is present in the config
 def validate_settings(configloc):
-    d = dict()
-    d['Meta'] = {'ssh_config_name'}
-    
     parser = configparser.ConfigParser()
     parser.read(configloc)
+    _validate_parser(parser)
+
+# Check if all required data is present in given parsed config
+def _validate_parser(parser):
+    d = dict()
+    d['Meta'] = {'ssh_config_name'}
+
     for key in d:
         if not key in parser:
             raise RuntimeError('Missing section "{}"'.format(key))
@@ -82,6 +87,22 @@ def validate_settings(configloc):
                     raise RuntimeError('Missing key "{}" in section "{}"'.format(subkey, key))
 
 
+# Parse and validate the meta config at given path, once.
+# Returns a config.snapshot.MetaSnapshot, without the snapshot of the SSH config it names
+def _snapshot_of(path):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    _validate_parser(parser)
+    return snapshot.MetaSnapshot(path=path, ssh_config_name=parser['Meta']['ssh_config_name'], ssh=None)
+
+
+# Load the meta config and return it, as a config.snapshot.MetaSnapshot, holding a snapshot of the SSH config it names.
+# The meta and SSH config are cached separately, so we parse each only once, until it changes
+def load_meta_config():
+    meta = snapshot.cached(get_metaspark_metaconf_file(), _snapshot_of)
+    return meta._replace(ssh=ssh.load_ssh_config(meta.ssh_config_name))
+
+
 class MetaConfig(object):    
     '''
     Persist project-level stateful information to disk,
@@ -89,20 +110,18 @@ class MetaConfig(object):
     every time they use MetaSpark.
     '''
     def __init__(self):
-        loc = get_metaspark_metaconf_file()
-        if not fs.exists(loc):
-            gen_config(loc)
-        else:
-            validate_settings(loc)
-        self.parser = configparser.ConfigParser()
-        self.parser.read(loc)
-
-        self._ssh = ssh.SSHConfig(self.ssh_config_name)
+        self._snapshot = snapshot.meta_from_env() # Passed along by --exec, so nodes do not parse config files
+        if self._snapshot == None:
+            loc = get_metaspark_metaconf_file()
+            if not fs.exists(loc):
+                gen_config(loc)
+            self._snapshot = load_meta_config()
+        self._ssh = self._snapshot.ssh
 
     # SSH config to load
     @property
     def ssh_config_name(self):
-        return self.parser['Meta']['ssh_config_name']
+        return self._snapshot.ssh_config_name
 
     @ssh_config_name.setter
     def set_ssh_config_name(self, val):
@@ -118,8 +137,23 @@ class MetaConfig(object):
             parser.write(file)
 
 
+class _LazyMetaConfig(object):
+    '''
+    Stand-in for the MetaConfig instance, which creates it on first use.
+    This way, importing a module which reads meta settings does not read config files,
+    or ask the user anything. Only code actually reading settings does.
+    '''
+    def __init__(self):
+        self._instance = None
+
+    def __getattr__(self, name):
+        if self._instance == None:
+            self._instance = MetaConfig()
+        return getattr(self._instance, name)
+
+
 # Import settings_instance if you wish to read Meta settings
-cfg_meta_instance = MetaConfig()
+cfg_meta_instance = _LazyMetaConfig()
 
 # Import settings_instance if you wish to read SSH settings
 # cfg_ssh_instance = ssh.SSHConfig(cfg_meta_instance.ssh_config_name)
\ No newline at end of file
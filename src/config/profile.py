@@ -0,0 +1,101 @@
+# This file contains performance profiles for Spark clusters.
+# A profile is a named set of Spark settings, which we render into
+# spark-defaults.conf and spark-env.sh before the daemons boot.
+#
+# Profile 'stock' renders nothing, so Spark uses its own defaults.
+
+import util.fs as fs
+import util.location as loc
+
+# Marks files we generated, so we never remove files written by the user
+_header = '# Generated by MetaSpark'
+
+# Settings of each profile. Values may contain {parallelism_1x} and {parallelism_3x}
+# (1 or 3 tasks per worker core) and {local_dir}, which are filled in when rendering.
+profiles = {
+    'throughput': {
+        'spark.serializer': 'org.apache.spark.serializer.KryoSerializer',
+        'spark.kryoserializer.buffer.max': '512m',
+        'spark.default.parallelism': '{parallelism_3x}',
+        'spark.sql.shuffle.partitions': '{parallelism_3x}',
+        'spark.local.dir': '{local_dir}',
+        'spark.shuffle.file.buffer': '1m',
+        'spark.reducer.maxSizeInFlight': '96m',
+    },
+    'low-latency': {
+        'spark.serializer': 'org.apache.spark.serializer.KryoSerializer',
+        'spark.default.parallelism': '{parallelism_1x}',
+        'spark.sql.shuffle.partitions': '{parallelism_1x}',
+        'spark.local.dir': '{local_dir}',
+        'spark.locality.wait': '0s',
+        'spark.scheduler.mode': 'FAIR',
+    },
+}
+
+# Returns names of all available profiles
+def profile_names():
+    return ['stock']+sorted(profiles)
+
+
+# Returns contents of spark-defaults.conf for given profile
+def render_defaults(profile, config_name, total_cores):
+    values = {
+        'parallelism_1x': max(1, total_cores),
+        'parallelism_3x': max(1, 3*total_cores),
+        'local_dir': fs.join(loc.get_node_local_dir(), 'spark'),
+    }
+    lines = ['{} for cluster config "{}" with profile "{}"'.format(_header, config_name, profile)]
+    for key, val in sorted(profiles[profile].items()):
+        lines.append('{} {}'.format(key, val.format(**values)))
+    return '\n'.join(lines)+'\n'
+
+
+# Returns contents of spark-env.sh for given profile.
+# spark-env.sh is sourced on every node, so node-specific values are computed there
+def render_env(profile, config_name, infiniband):
+    lines = [
+        '#!/usr/bin/env bash',
+        '{} for cluster config "{}" with profile "{}"'.format(_header, config_name, profile),
+        'export SPARK_LOCAL_DIRS="{}"'.format(fs.join(loc.get_node_local_dir(), 'spark')),
+    ]
+    if infiniband: # Bind to the infiniband address of this node (see remote.util.ip.node_to_infiniband_ip)
+        lines += [
+            'METASPARK_NODE_NR=$(hostname | sed -n \'s/^node\\([0-9]\\+\\).*/\\1/p\')',
+            'if [ -n "$METASPARK_NODE_NR" ]; then',
+            '    METASPARK_NODE_NR=$(printf \'%03d\' $((10#$METASPARK_NODE_NR)))',
+            '    export SPARK_LOCAL_IP="10.149.${METASPARK_NODE_NR:0:1}.$((10#${METASPARK_NODE_NR:1}))"',
+            'fi',
+        ]
+    return '\n'.join(lines)+'\n'
+
+
+# Returns True if file at given path was generated by us, False otherwise
+def _generated(path):
+    if not fs.isfile(path):
+        return False
+    with open(path, 'r') as file:
+        return any(line.startswith(_header) for line in file.readlines()[:2])
+
+
+# Render spark-defaults.conf and spark-env.sh for the profile of given cluster config into given directory.
+# With profile 'stock', we remove files we generated earlier instead.
+# total_cores is the amount of cores of all workers together
+def write_spark_conf(cluster_cfg, conf_dir, total_cores):
+    defaults = fs.join(conf_dir, 'spark-defaults.conf')
+    env = fs.join(conf_dir, 'spark-env.sh')
+    profile = cluster_cfg.profile
+    if profile == 'stock':
+        for path in (defaults, env):
+            if _generated(path):
+                fs.rm(path)
+        return
+
+    for path in (defaults, env):
+        if fs.isfile(path) and not _generated(path):
+            fs.mv(path, path+'.bak') # Keep whatever the user had there
+    config_name = fs.basename(cluster_cfg.path)
+    fs.mkdir(conf_dir, exist_ok=True)
+    with open(defaults, 'w') as file:
+        file.write(render_defaults(profile, config_name, total_cores))
+    with open(env, 'w') as file:
+        file.write(render_env(profile, config_name, cluster_cfg.infiniband))
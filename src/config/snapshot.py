@@ -0,0 +1,100 @@
+# In this file, we provide immutable snapshots of our configuration files.
+# A snapshot is parsed and validated once, and holds converted values,
+# so reading a setting is a plain attribute lookup instead of a configparser lookup and conversion.
+# Snapshots are cached per file, and reloaded only when the file changes (by mtime and size).
+#
+# Snapshots are picklable, and cluster and meta snapshots can be passed to processes we spawn
+# (e.g. with prun) through the environment, so those processes do not parse INI files at all.
+
+import collections
+import json
+import os
+import threading
+
+
+class ClusterSnapshot(collections.namedtuple('ClusterSnapshot', [
+        'path', 'nodes', 'coallocation_affinity', 'infiniband', 'worker_cores', 'worker_memory',
+        'profile', 'spark_version', 'spark_build', 'stage_local'])):
+    '''Immutable settings of a cluster config. Has the same attributes as config.cluster.ClusterConfig'''
+    __slots__ = ()
+
+
+class SSHSnapshot(collections.namedtuple('SSHSnapshot', ['path', 'ssh_key_name', 'ssh_user_name', 'remote_metaspark_dir'])):
+    '''Immutable settings of a SSH config. Has the same attributes as config.ssh.SSHConfig'''
+    __slots__ = ()
+
+
+class MetaSnapshot(collections.namedtuple('MetaSnapshot', ['path', 'ssh_config_name', 'ssh'])):
+    '''Immutable settings of the meta config. ssh is the SSHSnapshot of the SSH config it names'''
+    __slots__ = ()
+
+
+# Cached snapshots, by absolute path: path -> ((mtime, size), snapshot)
+_cache = dict()
+_cache_lock = threading.Lock()
+
+# Returns snapshot of file at given path. If we built one before and the file did not change since,
+# we return that one. Otherwise, we build a new one by calling build(path)
+def cached(path, build):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        found = _cache.get(path)
+        if found != None and found[0] == key:
+            return found[1]
+    snapshot = build(path)
+    with _cache_lock:
+        _cache[path] = (key, snapshot)
+    return snapshot
+
+
+# Forget all cached snapshots
+def clear():
+    with _cache_lock:
+        _cache.clear()
+
+
+# Environment variable holding a cluster snapshot for processes we spawn
+_env_cluster = 'METASPARK_CLUSTER_CONFIG'
+
+# Returns a copy of given environment (default: ours), with given cluster snapshot added
+def env_with_cluster(snapshot, env=None):
+    env = dict(os.environ if env == None else env)
+    env[_env_cluster] = json.dumps(snapshot._asdict())
+    return env
+
+# Returns cluster snapshot passed to us through the environment, or None if there is none.
+# If given, the snapshot must be of the config file with given name
+def cluster_from_env(config_filename=None):
+    data = os.environ.get(_env_cluster)
+    if data == None:
+        return None
+    try:
+        snapshot = ClusterSnapshot(**json.loads(data))
+    except (ValueError, TypeError) as e:
+        return None
+    if config_filename != None and os.path.basename(snapshot.path) != config_filename:
+        return None
+    return snapshot
+
+
+# Environment variable holding a meta snapshot, including its SSH snapshot, for processes we spawn
+_env_meta = 'METASPARK_META_CONFIG'
+
+# Returns a copy of given environment (default: ours), with given meta snapshot added
+def env_with_meta(snapshot, env=None):
+    env = dict(os.environ if env == None else env)
+    env[_env_meta] = json.dumps(dict(snapshot._asdict(), ssh=snapshot.ssh._asdict()))
+    return env
+
+# Returns meta snapshot passed to us through the environment, or None if there is none
+def meta_from_env():
+    data = os.environ.get(_env_meta)
+    if data == None:
+        return None
+    try:
+        data = json.loads(data)
+        return MetaSnapshot(**dict(data, ssh=SSHSnapshot(**data['ssh'])))
+    except (ValueError, TypeError, KeyError) as e:
+        return None
@@ -4,6 +4,7 @@
 
 import configparser
 
+import config.snapshot as snapshot
 import util.fs as fs
 from util.printer import *
 import util.ui as ui
@@ -93,11 +94,15 @@ def change_settings():
 
 # Check if all required data is present in the config
 def validate_settings(configloc):
+    parser = configparser.ConfigParser()
+    parser.read(configloc)
+    _validate_parser(parser)
+
+# Check if all required data is present in given parsed config
+def _validate_parser(parser):
     d = dict()
     d['SSH'] = {'key_name', 'user', 'metaspark_dir'}
 
-    parser = configparser.ConfigParser()
-    parser.read(configloc)
     for key in d:
         if not key in parser:
             raise RuntimeError('Missing section "{}"'.format(key))
@@ -107,6 +112,24 @@ def validate_settings(configloc):
                     raise RuntimeError('Missing key "{}" in section "{}"'.format(subkey, key))
 
 
+# Parse and validate the SSH config at given path, once. Returns a config.snapshot.SSHSnapshot
+def _snapshot_of(path):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    _validate_parser(parser)
+    return snapshot.SSHSnapshot(
+        path=path,
+        ssh_key_name=parser['SSH']['key_name'],
+        ssh_user_name=parser['SSH']['user'],
+        remote_metaspark_dir=parser['SSH']['metaspark_dir'])
+
+
+# Load the SSH config with given name (without '.cfg') and return it, as a config.snapshot.SSHSnapshot.
+# We parse every file only once, until it changes
+def load_ssh_config(name):
+    return snapshot.cached(fs.join(get_metaspark_ssh_conf_dir(), name+'.cfg'), _snapshot_of)
+
+
 class SSHConfig(object):    
     '''
     Simple object to quickly interact with stored SSH settings.
@@ -116,25 +139,23 @@ class SSHConfig(object):
     '''
     def __init__(self, name):
         self.picked = fs.join(get_metaspark_ssh_conf_dir(), name+'.cfg')
-        validate_settings(self.picked)
-        self.parser = configparser.ConfigParser()
-        self.parser.read(self.picked)
+        self._snapshot = load_ssh_config(name)
 
 
     # SSH key to use when communicating with remote
     @property
     def ssh_key_name(self):
-        return self.parser['SSH']['key_name']
+        return self._snapshot.ssh_key_name
 
     # Username on remote
     @property
     def ssh_user_name(self):
-        return self.parser['SSH']['user']
+        return self._snapshot.ssh_user_name
 
     # Path to the desired location to store metaspark on the remote
     @property
     def remote_metaspark_dir(self):
-        return self.parser['SSH']['metaspark_dir']
+        return self._snapshot.remote_metaspark_dir
 
     # Path to this config
     @property
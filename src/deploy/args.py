@@ -0,0 +1,22 @@
+# This file registers the commandline arguments for deployments.
+# main.py builds its parser on every start, also on every node of a cluster,
+# so this file imports nothing more than argparse. Deployments themselves happen in deploy.deploy
+
+import argparse
+
+
+# Register 'deploy' subparser modules
+def subparser(subparsers):
+    deployparser = subparsers.add_parser('deploy', help='Deploy applications (use deploy -h to see more...)')
+    deployparser.add_argument('jarfile', nargs='?', help='Jarfile to deploy')
+    deployparser.add_argument('mainclass', nargs='?', help='Main class of jarfile')
+    deployparser.add_argument('master_url', nargs='?', help='Master url for cluster (default: url of the running cluster)')
+    deployparser.add_argument('--args', nargs='*', help='Arguments to pass on to your jarfile')
+    deployparser.add_argument('--queue', type=str, default=None, help='File with jobs to run back to back on the same cluster, one "jarfile mainclass [args...]" per line. Use as "deploy --queue FILE [master_url]"')
+    deployparser.add_argument('--deploy_internal', help=argparse.SUPPRESS, action='store_true')
+
+
+# Return True if we found arguments used from this subparser, False otherwise
+# We use this to redirect command parse output to this file, deploy() function 
+def deploy_args_set(args):
+    return args.command == 'deploy'
@@ -0,0 +1,99 @@
+# In this file, we collect Spark driver logs from all nodes of a cluster.
+# The driver of a deployment may run on any worker, in its work directory
+# (<node local dir>/<lid>/driver-*). We fetch the driver directories of every node
+# concurrently, as a gzipped tar archive over ssh, and unpack them locally.
+
+import os
+import shlex
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import remote.reservation as reservation
+import remote.util.state as state
+from util.executor import ExecutorPool
+import util.fs as fs
+import util.location as loc
+from util.printer import *
+
+
+# Returns names of the nodes of the running cluster.
+# We look at the cluster state file first, then at HOSTS (set by prun), and finally ask the reservation system
+def discover_nodes():
+    warm = state.read_state()
+    if warm != None and len(warm.get('nodes', [])) > 0:
+        return warm['nodes']
+    if 'HOSTS' in os.environ:
+        return sorted(set(os.environ['HOSTS'].split()))
+    try:
+        return reservation.get_reserved_nodes()
+    except (subprocess.CalledProcessError, OSError) as e:
+        return []
+
+
+# Returns shell command fetching driver directories modified after given time (time.time()) from given node,
+# as a gzipped tar archive in archive, with ssh errors in errfile. We exec ssh, so stopping the command stops ssh
+def _collect_command(node, since, archive, errfile):
+    remote_command = 'cd {} && find . -mindepth 2 -maxdepth 2 -type d -name "driver-*" -newermt @{} -print0 | tar -czf - --null -T -'.format(
+        loc.get_node_local_dir(), int(since))
+    return 'exec ssh -o BatchMode=yes {} {} > {} 2> {}'.format(shlex.quote(node), shlex.quote(remote_command), shlex.quote(archive), shlex.quote(errfile))
+
+
+# Unpack driver directories in given archive into given directory.
+# Returns amount of driver directories and bytes unpacked.
+# Raises RuntimeError if the archive is bad
+def _unpack(archive, destination):
+    drivers = set()
+    received = 0
+    try:
+        with tarfile.open(archive, mode='r:gz') as tar:
+            for member in tar:
+                parts = os.path.normpath(member.name).split(os.sep)
+                if len(parts) < 2 or not parts[1].startswith('driver-') or '..' in parts or member.issym() or member.islnk():
+                    continue # Only accept regular content of driver directories
+                drivers.add((parts[0], parts[1]))
+                received += member.size
+                tar.extract(member, path=destination)
+    except (tarfile.TarError, OSError, EOFError) as e:
+        raise RuntimeError('bad archive ({})'.format(e))
+    return len(drivers), received
+
+
+# Collect driver logs of all given nodes into <logs dir>/<timestamp>/<node>/<lid>/driver-*,
+# with at most max_workers nodes at a time. Only driver directories modified after since are collected.
+# Nodes which take longer than timeout seconds are stopped, and count as failed.
+# Returns True if we got logs from every node, False otherwise
+def collect(nodes, timestamp, since, max_workers=16, timeout=300):
+    if len(nodes) == 0:
+        printw('Could not find any nodes to collect logs from')
+        return False
+    start = time.time()
+    base = fs.join(loc.get_metaspark_logs_dir(), timestamp)
+    status = True
+    total = 0
+    # Archives go to files, so a node sending a lot of output never blocks, and we hold no open files per node
+    with tempfile.TemporaryDirectory(prefix='metaspark-collect-') as tmp:
+        pool = ExecutorPool(max_concurrent=max_workers, stop_on_error=False)
+        for idx, node in enumerate(nodes):
+            pool.submit(_collect_command(node, since, fs.join(tmp, '{}.tgz'.format(idx)), fs.join(tmp, '{}.err'.format(idx))), timeout=timeout, shell=True)
+        for count, task in enumerate(pool.as_completed()):
+            node = nodes[task.index]
+            archive = fs.join(tmp, '{}.tgz'.format(task.index))
+            try:
+                if task.timed_out:
+                    raise RuntimeError('timed out after {} seconds'.format(timeout))
+                if task.returncode != 0:
+                    with open(fs.join(tmp, '{}.err'.format(task.index)), 'r', errors='replace') as file:
+                        stderr = file.read().strip()
+                    raise RuntimeError(stderr if len(stderr) > 0 else 'ssh exited with status {}'.format(task.returncode))
+                drivers, received = _unpack(archive, fs.join(base, node))
+                total += received
+                print('[{}/{}] {}: {} driver director{} ({} bytes)'.format(count+1, len(nodes), node, drivers, 'y' if drivers == 1 else 'ies', received))
+            except Exception as e: # A failing node must not stop us from collecting the others
+                status = False
+                printw('[{}/{}] {}: failed to collect logs: {}'.format(count+1, len(nodes), node, e))
+            finally:
+                fs.rm(archive, ignore_errors=True)
+    print('Collected {} bytes from {} nodes in {:.2f} seconds'.format(total, len(nodes), time.time()-start))
+    return status
@@ -1,33 +1,93 @@
-# This file handles argument parsing for deployments,
-# as well as actual deployment.
+# This file handles deployments.
+# Their commandline arguments are registered in deploy.args
 
-import argparse
 import os
-import socket
+import sys
+import tempfile
+import time
 
 from config.meta import cfg_meta_instance as metacfg
 import remote.util.ip as ip
-from util.executor import Executor
+import remote.util.staging as staging
+import remote.util.state as state
+import util.connection as connection
 import util.location as loc
 import util.fs as fs
 from util.printer import *
 import util.time as tm
 import util.ui as ui
 
-# Post-deployment gathering of logs
-def _deploy_collect(timestamp):
-    for lid in (x for x in fs.ls(loc.get_node_local_dir(), only_dirs=True) if x.isnumeric()):
-        tmp = fs.join(loc.get_node_local_dir(), lid)
-        options = [x for x in fs.ls(tmp) if x.startswith('driver-')]
-        needed = sorted(options, key=lambda x: int(x.split('-')[1]))[0]
-        fs.mv(fs.join(tmp, needed), fs.join(loc.get_metaspark_logs_dir(), timestamp, socket.gethostname()+'_'+lid))
-    return True
-
-# Deployment execution on remote
-def _deploy_internal(jarfile, mainclass, master_url, args):
+# Returns given master url, or the url of the running cluster if none is given.
+# Returns None if no master url is given and no cluster is running
+def _resolve_master_url(master_url):
+    if master_url != None:
+        return master_url
+    warm = state.live_state()
+    if warm == None:
+        printe('No master url given, and found no running cluster. Start one using "--remote", or provide a master url.')
+        return None
+    print('Using running cluster (config "{}", reservation {}) at {}'.format(warm['config'], warm['reservation'], warm['master_url']))
+    return warm['master_url']
+
+# Returns the Spark bin directory to submit to given master url with.
+# For the running cluster, this is the Spark version it runs. Otherwise, we use the default version
+def _spark_bin_dir(master_url):
+    warm = state.read_state()
+    if warm != None and warm['master_url'] == master_url and warm.get('spark_version') != None:
+        return loc.get_spark_bin_dir(warm['spark_version'], warm['spark_build'])
+    return loc.get_spark_bin_dir()
+
+# Returns location of given jarfile to submit to given master url.
+# If the running cluster runs from node-local disk, we stage the jar on all its nodes and submit that copy
+def _jar_location(master_url, jarfile):
+    jarpath = fs.join(loc.get_metaspark_jar_dir(), jarfile)
+    warm = state.read_state()
+    if warm == None or warm['master_url'] != master_url or not warm.get('stage_local', False):
+        return jarpath
+    staged = staging.stage_jar(warm['nodes'], jarpath)
+    if staged == None:
+        printw('Could not stage {} on all nodes, submitting it from {}'.format(jarfile, jarpath))
+        return jarpath
+    return 'local:'+staged
+
+# Read a queue of jobs from given file object. Every line holds "jarfile mainclass [args...]".
+# Empty lines and lines starting with '#' are skipped. Returns a list of (jarfile, mainclass, args)
+def _read_queue(file):
+    jobs = []
+    for line in file:
+        parts = line.strip().split(maxsplit=2)
+        if len(parts) == 0 or parts[0].startswith('#'):
+            continue
+        if len(parts) < 2:
+            raise ValueError('Queue line "{}" has no mainclass'.format(line.strip()))
+        jobs.append((parts[0], parts[1], parts[2] if len(parts) > 2 else ''))
+    return jobs
+
+# Deployment execution on remote of a queue of jobs, back to back on the same cluster
+def _deploy_internal_queue(jobs, master_url):
     print('Connected!')
-    scriptloc = fs.join(loc.get_spark_bin_dir(), 'spark-submit')
+    master_url = _resolve_master_url(master_url)
+    if master_url == None:
+        return False
+    status = True
+    for idx, (jarfile, mainclass, args) in enumerate(jobs):
+        printc('[{}/{}] Deploying {} ({})'.format(idx+1, len(jobs), jarfile, mainclass), Color.CAN)
+        start = time.time()
+        job_status = _deploy_internal(jarfile, mainclass, master_url, args, wait=True)
+        print('[{}/{}] Finished in {:.2f} seconds'.format(idx+1, len(jobs), time.time()-start))
+        status = status and job_status
+    return status
+
+# Deployment execution on remote.
+# If wait is True, we return only after the application completed
+def _deploy_internal(jarfile, mainclass, master_url, args, wait=False):
+    print('Connected!')
+    master_url = _resolve_master_url(master_url)
+    if master_url == None:
+        return False
+    scriptloc = fs.join(_spark_bin_dir(master_url), 'spark-submit')
 
+    start = time.time()
     timestamp = tm.timestamp('%Y-%m-%d_%H:%M:%S.%f')
     fs.mkdir(loc.get_metaspark_logs_dir(), timestamp)
 
@@ -41,12 +101,14 @@ def _deploy_internal(jarfile, mainclass, master_url, args):
     --driver-java-options "{}"\
     --class {}\
     --master {}\
+    --conf spark.standalone.submit.waitAppCompletion={}\
     --deploy-mode cluster {} {}'.format(
         scriptloc,
         driver_opts,
         mainclass,
         master_url,
-        fs.join(loc.get_metaspark_jar_dir(), jarfile),
+        'true' if wait else 'false',
+        _jar_location(master_url, jarfile),
         args)
     status = os.system(command) == 0
     if status:
@@ -55,66 +117,60 @@ def _deploy_internal(jarfile, mainclass, master_url, args):
         printe('There were errors during deployment.')
     print('')
     print('Gathering log results')
-    # TODO: Gather node ips
-    executors = [Executor('ssh {} "python3 {}/main.py deploy . . . --deploy_collect {}"'.format(node, locfs.abspath(), timestamp)) for node in nodes]
-
-    Executor.run_all(executors)
-    status2 = Executor.wait_all(executors, stop_on_error=False)
+    import deploy.collector as collector # Imports concurrent.futures and tarfile, which are slow to import
+    status2 = collector.collect(collector.discover_nodes(), timestamp, start-60) # Margin for clock differences between nodes
     if status2:
         print('Exported logs to {}!'.format(fs.join(loc.get_metaspark_logs_dir(), timestamp)))
     else:
         print('Export failures detected, got as many logs as possible!')
-    # '/local/hpcl1910/1/driver-20201031183111-0000/stdout'
     return status and status2
 
-def _deploy(jarfile, mainclass, master_url, args):
+# Returns name of given jarfile if it exists in the local jar directory.
+# Otherwise, asks user to pick one of the jarfiles there
+def _pick_jarfile(jarfile):
+    if fs.isfile(loc.get_metaspark_jar_dir(), jarfile):
+        return jarfile
+    printw('Provided jarfile "{}" not found at "{}"'.format(jarfile, loc.get_metaspark_jar_dir()))
+    while True:
+        options = [fs.basename(x) for x in fs.ls(loc.get_metaspark_jar_dir(), only_files=True, full_paths=True) if x.endswith('.jar')]
+        if len(options)== 0: print('Note: {} seems to be an empty directory...'.format(loc.get_metaspark_jar_dir()))
+        idx = ui.ask_pick('Pick a jarfile: ', ['Rescan {}'.format(loc.get_metaspark_jar_dir())]+options)
+        if idx == 0:
+            continue
+        else:
+            return options[idx-1]
+
+# Deploy given jobs (list of (jarfile, mainclass, args)).
+# A single job is submitted as-is, multiple jobs are sent to remote as a queue,
+# which runs them back to back on the same cluster
+def _deploy(jobs, master_url):
     fs.mkdir(loc.get_metaspark_jar_dir(), exist_ok=True)
-    if not fs.isfile(loc.get_metaspark_jar_dir(), jarfile):
-        printw('Provided jarfile "{}" not found at "{}"'.format(jarfile, loc.get_metaspark_jar_dir()))
-        while True:
-            options = [fs.basename(x) for x in fs.ls(loc.get_metaspark_jar_dir(), only_files=True, full_paths=True) if x.endswith('.jar')]
-            if len(options)== 0: print('Note: {} seems to be an empty directory...'.format(loc.get_metaspark_jar_dir()))
-            idx = ui.ask_pick('Pick a jarfile: ', ['Rescan {}'.format(loc.get_metaspark_jar_dir())]+options)
-            if idx == 0:
-                continue
-            else:
-                jarfile = options[idx-1]
-                break
-    command = 'rsync -az {} {}:{}'.format(loc.get_metaspark_jar_dir(), metacfg.ssh.ssh_key_name, fs.join(loc.get_remote_metaspark_dir(), 'jars'))
-    command+= ' --exclude '+' --exclude '.join([
+    jobs = [(_pick_jarfile(jarfile), mainclass, args) for (jarfile, mainclass, args) in jobs]
+    conn = connection.get(metacfg.ssh)
+    rsync_args = '-az --exclude '+' --exclude '.join([
         '.git',
         '__pycache__'])
-    if os.system(command) == 0:
+    if conn.rsync(loc.get_metaspark_jar_dir()+'/', fs.join(loc.get_remote_metaspark_dir(), 'jars'), args=rsync_args) == 0:
         prints('Export success!')
     else:
         printe('Export failure!')
         return False
 
-    program = '{} {} {} --deploy_internal --args {}'.format(jarfile, mainclass, master_url, args)
-
-    command = 'ssh {} "python3 {}/main.py deploy {}"'.format(
-    metacfg.ssh.ssh_key_name,
-    loc.get_remote_metaspark_dir(),
-    program)
+    master_arg = master_url if master_url != None else ''
     print('Connecting using key "{}"...'.format(metacfg.ssh.ssh_key_name))
-    return os.system(command) == 0
-
-
-# Register 'deploy' subparser modules
-def subparser(subparsers):
-    deployparser = subparsers.add_parser('deploy', help='Deploy applications (use deploy -h to see more...)')
-    deployparser.add_argument('jarfile', help='Jarfile to deploy')
-    deployparser.add_argument('mainclass', help='Main class of jarfile')
-    deployparser.add_argument('master_url', help='Master url for cluster')
-    deployparser.add_argument('--args', nargs='*', help='Arguments to pass on to your jarfile')
-    deployparser.add_argument('--deploy_internal', help=argparse.SUPPRESS, action='store_true')
-    deployparser.add_argument('--deploy_collect', nargs=1, help=argparse.SUPPRESS)
-    
+    if len(jobs) == 1:
+        jarfile, mainclass, args = jobs[0]
+        program = '{} {} {} --deploy_internal --args {}'.format(jarfile, mainclass, master_arg, args)
+        return conn.run('python3 {}/main.py deploy {}'.format(loc.get_remote_metaspark_dir(), program)) == 0
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.queue') as queue:
+        for (jarfile, mainclass, args) in jobs:
+            queue.write('{} {} {}\n'.format(jarfile, mainclass, args))
+        queue.flush()
+        program = '{} --deploy_internal --queue -'.format(master_arg)
+        return conn.run('python3 {}/main.py deploy {}'.format(loc.get_remote_metaspark_dir(), program), stdin_file=queue.name) == 0
+
 
-# Return True if we found arguments used from this subparser, False otherwise
-# We use this to redirect command parse output to this file, deploy() function 
-def deploy_args_set(args):
-    return args.command == 'deploy'
 # Processing of deploy commandline args occurs here
 def deploy(parser, args):
     jarfile = args.jarfile
@@ -122,9 +178,26 @@ def deploy(parser, args):
     master_url = args.master_url
     jargs = ' '.join(args.args) if args.args != None else ''
 
-    if args.deploy_collect:
-        return _deploy_collect(args.deploy_collect[0])
-    elif args.deploy_internal:
+    if args.queue != None:
+        if mainclass != None:
+            parser.error('deploy --queue takes no jarfile or mainclass, only an optional master_url')
+        master_url = jarfile # With --queue, the only positional argument is the master url
+        if args.queue == '-':
+            jobs = _read_queue(sys.stdin)
+        else:
+            with open(args.queue, 'r') as file:
+                jobs = _read_queue(file)
+        if len(jobs) == 0:
+            printe('Queue "{}" contains no jobs'.format(args.queue))
+            return False
+    elif jarfile == None or mainclass == None:
+        parser.error('deploy requires a jarfile and mainclass, or --queue')
+    else:
+        jobs = [(jarfile, mainclass, jargs)]
+
+    if args.deploy_internal:
+        if args.queue != None:
+            return _deploy_internal_queue(jobs, master_url)
         return _deploy_internal(jarfile, mainclass, master_url, jargs)
     else:
-        return _deploy(jarfile, mainclass, master_url, jargs)
\ No newline at end of file
+        return _deploy(jobs, master_url)
@@ -3,40 +3,101 @@
 # Goal of this file is to guide data processing on server and client nodes.
 
 
+import os
 import socket
 import time
 
 import config.cluster as clr
+import config.profile as prf
+import config.snapshot as snapshot
 import remote.util.identifier as idr
 import remote.util.ip as ip
+import remote.util.probe as probe
+import remote.util.staging as staging
+import remote.util.state as state
+import remote.util.timeline as tl
 import util.fs as fs
 import util.location as loc
-from util.executor import Executor
+from util.executor import Executor, print_stream
 from util.printer import *
 
-# Boots master. Spark works with Daemons, so expect to return quickly from this function
-def boot_master(cluster_cfg, port, debug_mode):
-    lid = idr.identifier_local()
-    spark_conf_dir = loc.get_spark_conf_dir() #"${SPARK_CONF_DIR:-"${SPARK_HOME}/conf"}"
-
+# Returns command to run given daemon script of the Spark installation in given directory.
+# Staged copies (see remote.util.staging) keep using the configuration and log directories
+# of the shared installation, so we render configuration and collect logs in one place
+def _spark_script(cluster_cfg, spark_dir, script):
+    scriptloc = fs.join(spark_dir, 'sbin', script)
+    if spark_dir == loc.get_spark_dir(cluster_cfg.spark_version, cluster_cfg.spark_build):
+        return scriptloc
+    return 'SPARK_CONF_DIR={} SPARK_LOG_DIR={} {}'.format(
+        loc.get_spark_conf_dir(cluster_cfg.spark_version, cluster_cfg.spark_build),
+        loc.get_spark_logs_dir(cluster_cfg.spark_version, cluster_cfg.spark_build),
+        scriptloc)
+
+
+# Returns directory of the Spark installation to boot daemons from.
+# If the cluster config wants it, we stage Spark on node-local disk first, and record that in the boot timeline
+def _spark_dir(cluster_cfg, timeline, debug_mode):
+    spark_dir = loc.get_spark_dir(cluster_cfg.spark_version, cluster_cfg.spark_build)
+    if not cluster_cfg.stage_local:
+        return spark_dir
+    try:
+        result = staging.stage_dist(spark_dir)
+    except OSError as e:
+        printw('Could not stage Spark on node-local disk, running from {} ({})'.format(spark_dir, e))
+        return spark_dir
+    timeline.record('staged', hit=result.hit, seconds=result.seconds, saved=result.saved, size=result.size)
+    if debug_mode: print('{} Spark in {} ({:.2f} seconds)'.format('Reusing' if result.hit else 'Staged', result.path, result.seconds))
+    return result.path
 
-    scriptloc = fs.join(loc.get_spark_sbin_dir(), 'start-master.sh')
 
-    spark_webui_port = 2205
+# Boots master. Spark works with Daemons, so expect to return quickly from this function
+def boot_master(cluster_cfg, port, webui_port, debug_mode, spark_dir=None):
+    lid = idr.identifier_local()
+    spark_dir = spark_dir if spark_dir != None else loc.get_spark_dir(cluster_cfg.spark_version, cluster_cfg.spark_build)
+    scriptloc = _spark_script(cluster_cfg, spark_dir, 'start-master.sh')
 
-    cmd = '{} --host {} --port {} --webui-port {}'.format(scriptloc, ip.master_address(cluster_cfg.infiniband), port, spark_webui_port)
-    cmd += '2>&1 > devnull' if not debug_mode else ''
-    executor = Executor(cmd, shell=True)
+    cmd = '{} --host {} --port {} --webui-port {}'.format(scriptloc, ip.master_address(cluster_cfg.infiniband), port, webui_port)
+    executor = Executor(cmd, shell=True, stream=print_stream if debug_mode else None, tag='master', capture_kb=64)
     retval = executor.run_direct() == 0
+    if not retval:
+        printe('MASTER failed to start. Last output:\n{}'.format(executor.tail()))
+    if retval and not probe.wait_port(ip.master_address(cluster_cfg.infiniband), port):
+        printe('MASTER did not start listening on port {}'.format(port))
+        return False
     printc('MASTER ready on spark://{}:{}'.format(ip.master_address(cluster_cfg.infiniband), port), Color.CAN)
     return retval
 
 
+# Returns amount of cores on this node available to us
+def _node_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+# Returns amount of physical memory of this node in MB
+def _node_memory_mb():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024*1024)
+
+# Returns (cores, memory) to give a worker on this node.
+# With 'auto' settings, we divide the cores and memory of this node over all processes on it,
+# keeping 1GB of memory aside for the OS and Spark daemons
+def worker_resources(cluster_cfg):
+    procs_per_node = cluster_cfg.coallocation_affinity
+    cores = cluster_cfg.worker_cores
+    if cores == 'auto':
+        cores = max(1, _node_cores() // procs_per_node)
+    memory = cluster_cfg.worker_memory
+    if memory == 'auto':
+        memory = '{}M'.format(max(512, (_node_memory_mb()-1024) // procs_per_node))
+    return cores, memory
+
+
 # Boots a slave. Spark works with Daemons, so expect to return quickly from this function
-def boot_slave(cluster_cfg, master_port, debug_mode):
+def boot_slave(cluster_cfg, master_port, debug_mode, spark_dir=None):
     gid = idr.identifier_global()
     lid = idr.identifier_local()
-    scriptloc = fs.join(loc.get_spark_sbin_dir(), 'start-slave.sh')
+    spark_dir = spark_dir if spark_dir != None else loc.get_spark_dir(cluster_cfg.spark_version, cluster_cfg.spark_build)
+    scriptloc = _spark_script(cluster_cfg, spark_dir, 'start-slave.sh')
     master_url = 'spark://{}:{}'.format(ip.master_address(cluster_cfg.infiniband), master_port)
 
     workdir = fs.join(loc.get_node_local_dir(), lid)
@@ -46,27 +107,90 @@ def boot_slave(cluster_cfg, master_port, debug_mode):
     port = master_port+lid #Adding lid ensures we use different ports when sharing a node
     webui_port = 8080+lid
 
-    time.sleep(5)
+    # Start as soon as master accepts connections
+    if not probe.wait_port(ip.master_address(cluster_cfg.infiniband), master_port):
+        printw('Slave {}:{} cannot reach master at {}. Starting anyway...'.format(gid, lid, master_url))
     if debug_mode: print('Slave {}:{} connecting to {}, standing by on port {}'.format(gid, lid, master_url, port))
     fqdn = socket.getfqdn()
+    cores, memory = worker_resources(cluster_cfg)
+    if debug_mode: print('Slave {}:{} using {} cores and {} memory'.format(gid, lid, cores, memory))
     
-    cmd = '{} {} --cores 1 --memory 1024M --work-dir {} --host {} --port {} --webui-port {}'.format(scriptloc, master_url, workdir, fqdn, port, webui_port)
-    cmd += '2>&1 > devnull' if not debug_mode else ''
-    
-    executor = Executor(cmd, shell=True)
-    return executor.run_direct() == 0
+    cmd = '{} {} --cores {} --memory {} --work-dir {} --host {} --port {} --webui-port {}'.format(scriptloc, master_url, cores, memory, workdir, fqdn, port, webui_port)
+    executor = Executor(cmd, shell=True, stream=print_stream if debug_mode else None, tag='slave {}:{}'.format(gid, lid), capture_kb=64)
+    retval = executor.run_direct() == 0
+    if not retval:
+        printe('Slave {}:{} failed to start. Last output:\n{}'.format(gid, lid, executor.tail()))
+    return retval
+
+
+# Wait until all expected workers registered with master, and report how long booting the cluster took.
+# Registrations are added to the boot timeline, which we merge and summarize afterwards
+def await_cluster(cluster_cfg, webui_port, boot_start, timeline):
+    expected = cluster_cfg.nodes*cluster_cfg.coallocation_affinity - 1 # Every process except master runs a worker
+    seen = probe.wait_workers(ip.master_address(cluster_cfg.infiniband), webui_port, expected)
+    boot_time = time.time() - boot_start
+
+    # Workers are known to master by host and port, which slaves recorded in the timeline
+    slaves = {(x['host'], x['port']): x for x in tl.read_events(timeline.directory) if x['event'] == 'daemon' and 'port' in x}
+    for (host, port), registered in seen.items():
+        slave = slaves.get((host, port))
+        if slave != None:
+            timeline.record('registered', gid=slave['gid'], lid=slave['lid'], host=host, port=port, time=registered)
+        else:
+            timeline.record('registered', gid='{}:{}'.format(host, port), lid=None, host=host, port=port, time=registered)
+    events = tl.merge(timeline.directory)
+    table = tl.summary(events)
+    staged = staging.summary(events)
+    if staged != None:
+        table += '\n'+staged
+    with open(fs.join(timeline.directory, 'summary.txt'), 'w') as file:
+        file.write(table+'\n')
+    print(table)
+    print('Boot timeline written to {}'.format(timeline.directory))
+
+    if len(seen) < expected:
+        printw('Only {}/{} workers registered with master after {:.2f} seconds'.format(len(seen), expected, boot_time))
+        return False
+    printc('CLUSTER ready ({} workers) in {:.2f} seconds'.format(len(seen), boot_time), Color.CAN)
+    return True
 
 
 # Run with debug_mode (True/False) and the name of the clusterconfig to load
 def run(configname, debug_mode):
-    cluster_cfg = clr.load_cluster_config(configname)
+    boot_start = time.time()
+    cluster_cfg = snapshot.cluster_from_env(configname) # Passed along by --exec, so hundreds of nodes do not parse the config
+    if cluster_cfg == None:
+        cluster_cfg = clr.load_cluster_config(configname)
     port = 7077
+    webui_port = 2205
     gid = idr.identifier_global()
     lid = idr.identifier_local()
-
-    status = boot_master(cluster_cfg, port, debug_mode) if gid == 0 else boot_slave(cluster_cfg, port, debug_mode)
+    timeline = tl.BootTimeline(fs.join(loc.get_metaspark_boot_logs_dir(), os.environ.get('SLURM_JOB_ID', 'unknown')), gid, lid)
+    timeline.record('enter', time=boot_start)
+
+    if gid == 0: # Slaves wait for master to be reachable, so they boot after we render the configuration
+        print('Using Spark {} ({}) from {}'.format(cluster_cfg.spark_version, cluster_cfg.spark_build, loc.get_spark_dir(cluster_cfg.spark_version, cluster_cfg.spark_build)))
+        total_cores = (cluster_cfg.nodes*cluster_cfg.coallocation_affinity - 1) * worker_resources(cluster_cfg)[0]
+        prf.write_spark_conf(cluster_cfg, loc.get_spark_conf_dir(cluster_cfg.spark_version, cluster_cfg.spark_build), total_cores)
+    spark_dir = _spark_dir(cluster_cfg, timeline, debug_mode)
+    status = boot_master(cluster_cfg, port, webui_port, debug_mode, spark_dir) if gid == 0 else boot_slave(cluster_cfg, port, debug_mode, spark_dir)
+    timeline.record('daemon', status=status, port=port if gid == 0 else port+lid)
     if not status:
         printe('Error booting {}'.format('Master' if gid==0 else 'slave {}:{}'.format(gid, lid)))
+    elif gid == 0:
+        await_cluster(cluster_cfg, webui_port, boot_start, timeline)
+        # Remember this cluster, so deployments can find it
+        master_address = ip.master_address(cluster_cfg.infiniband)
+        state.write_state(
+            'spark://{}:{}'.format(master_address, port),
+            os.environ.get('SLURM_JOB_ID'),
+            sorted(set(os.environ['HOSTS'].split())),
+            fs.basename(cluster_cfg.path),
+            'http://{}:{}'.format(master_address, webui_port),
+            cluster_cfg.spark_version,
+            cluster_cfg.spark_build,
+            cluster_cfg.stage_local,
+            state.settings_of(cluster_cfg))
 
     try:
         while True: # Sleep forever, 1 minute at a time
@@ -74,4 +198,5 @@ def run(configname, debug_mode):
     except KeyboardInterrupt as e:
         if gid == 0:
             printw('Shutting down')
+            state.clear_state()
             exit(0 if status else 1)
\ No newline at end of file
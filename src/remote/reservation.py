@@ -1,5 +1,13 @@
+import subprocess
+
 from config.meta import cfg_meta_instance as metacfg
+import remote.util.ip as ip
+
+# Cancel reservation with given id. Returns True on success, False otherwise
+def cancel_reservation(reservation):
+    return subprocess.call(['preserve', '-c', str(reservation)]) == 0
 
+# Returns names (e.g. node042) of the nodes in our latest reservation, or their infiniband ips
 def get_reserved_nodes(infiniband=False):
-    nodes = subprocess.check_output("preserve -llist | grep "+metacfg.ssh.ssh_user_name+" | awk -F'\\t' '{ print $NF }'").check_output('utf-8').strip().split('\n')[-1].split()
-    return [ip.node_to_infiniband_ip(int(x[4:])) for x in nodes] if infiniband else nodes
\ No newline at end of file
+    nodes = subprocess.check_output("preserve -llist | grep "+metacfg.ssh.ssh_user_name+" | awk -F'\\t' '{ print $NF }'", shell=True).decode('utf-8').strip().split('\n')[-1].split()
+    return [ip.node_to_infiniband_ip(int(x[4:])) for x in nodes] if infiniband else nodes
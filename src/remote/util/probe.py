@@ -0,0 +1,64 @@
+# In this file, we provide functions to actively probe
+# whether parts of a Spark cluster are up and running.
+
+import json
+import socket
+import time
+
+
+# Returns True if given address accepts connections, False otherwise
+def port_open(host, port, timeout=1.0):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError as e:
+        return False
+
+
+# Wait until given address accepts connections, probing with exponential backoff.
+# Returns True if it accepted a connection before timeout seconds passed, False otherwise
+def wait_port(host, port, timeout=120, delay=0.05, max_delay=1.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        if port_open(host, port):
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay*2, max_delay)
+
+
+# Returns status of the Spark master with webui on given address as a dict (see http://<master>:<webui_port>/json/),
+# or None if we cannot get it
+def master_status(host, webui_port, timeout=2.0):
+    import urllib.request # Only master needs this (slow to import) module, so slaves do not import it
+    try:
+        with urllib.request.urlopen('http://{}:{}/json/'.format(host, webui_port), timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError) as e:
+        return None
+
+
+# Returns (host, port) of all workers registered as alive with the Spark master with webui on given address
+def alive_workers(host, webui_port):
+    status = master_status(host, webui_port)
+    if status == None:
+        return []
+    return [(x.get('host'), x.get('port')) for x in status.get('workers', []) if x.get('state') == 'ALIVE']
+
+
+# Wait until given amount of workers registered with the Spark master with webui on given address,
+# probing with exponential backoff.
+# Returns a dict mapping (host, port) of every alive worker found to the time (time.time()) we first saw it
+def wait_workers(host, webui_port, expected, timeout=300, delay=0.1, max_delay=2.0):
+    deadline = time.monotonic() + timeout
+    seen = dict()
+    while True:
+        now = time.time()
+        for worker in alive_workers(host, webui_port):
+            if not worker in seen:
+                seen[worker] = now
+        if len(seen) >= expected or time.monotonic() + delay > deadline:
+            return seen
+        time.sleep(delay)
+        delay = min(delay*2, max_delay)
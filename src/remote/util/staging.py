@@ -0,0 +1,169 @@
+# In this file, we stage the Spark distribution and deployed jars on node-local disk.
+# Without staging, every JVM on every node loads its classes from the shared filesystem,
+# which becomes a stampede when many nodes boot at once.
+#
+# Staged copies live in <node local dir>/stage/<kind>/<digest>/, keyed by a content hash,
+# so a node copies a given Spark build or jar only once, and reuses it in later boots.
+# Every staged directory holds a small metadata file, remembering how long copying took.
+# Booting from a cached copy saves that time, which we report in the boot summary.
+
+import fcntl
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import tempfile
+import time
+
+import supplier.spark as spk
+import util.fs as fs
+from util.executor import ExecutorPool
+import util.location as loc
+from util.printer import *
+
+# Name of the metadata file in staged directories
+_meta_file = '.metaspark_staged.json'
+
+# Top-level directories of a Spark distribution we do not stage:
+# Staged copies use the configuration and logs of the shared installation, and workers get their own work directory
+_unstaged = ('conf', 'logs', 'work')
+
+# Ignore function for shutil.copytree, skipping _unstaged directories at the top level of given directory
+def _ignore_unstaged(directory):
+    directory = os.path.abspath(directory)
+    return lambda path, names: [x for x in names if x in _unstaged] if os.path.abspath(path) == directory else []
+
+
+# Returns the content hash of the Spark distribution in given directory.
+# Installs remember the SHA-512 of the archive they came from. For older installs,
+# we hash the names, sizes and modification times of all files instead
+def dist_digest(directory):
+    if fs.isfile(directory, spk.digest_file):
+        with open(fs.join(directory, spk.digest_file), 'r') as file:
+            return file.read().strip()
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(directory):
+        if root == directory: # Logs and work files change all the time, and we do not stage them anyway
+            dirs[:] = [x for x in dirs if not x in _unstaged]
+        dirs.sort()
+        for name in sorted(files):
+            path = fs.join(root, name)
+            stat = os.lstat(path)
+            digest.update('{}\0{}\0{}\n'.format(os.path.relpath(path, directory), stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Returns total size in bytes of all files in given directory
+def _tree_size(directory):
+    return sum(os.lstat(fs.join(root, x)).st_size for root, dirs, files in os.walk(directory) for x in files)
+
+
+class StageResult(object):
+    '''Outcome of staging a directory on this node'''
+    def __init__(self, path, hit, seconds, copy_seconds, size):
+        self.path = path                 # Path to the staged copy
+        self.hit = hit                   # True if we reused a cached copy
+        self.seconds = seconds           # Time staging took now, including waiting for other processes on this node
+        self.copy_seconds = copy_seconds # Time copying took when the copy was made
+        self.size = size                 # Size of the staged copy in bytes
+
+    # Returns seconds saved by reusing a cached copy, instead of copying again
+    @property
+    def saved(self):
+        return max(0.0, self.copy_seconds - self.seconds) if self.hit else 0.0
+
+
+# Stage given Spark distribution directory on this node. Processes sharing a node
+# wait for each other, so only one of them copies. Copies appear atomically,
+# so a crashed copy is never mistaken for a complete one.
+# Returns a StageResult
+def stage_dist(directory):
+    start = time.time()
+    key = dist_digest(directory)
+    base = fs.join(loc.get_node_stage_dir(), 'spark')
+    fs.mkdir(base, exist_ok=True)
+    destination = fs.join(base, key)
+    with open(fs.join(base, '.{}.lock'.format(key)), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if fs.isfile(destination, _meta_file):
+            with open(fs.join(destination, _meta_file), 'r') as file:
+                meta = json.load(file)
+            return StageResult(destination, True, time.time()-start, meta['seconds'], meta['size'])
+
+        tmp = '{}.tmp-{}'.format(destination, os.getpid())
+        fs.rm(tmp, ignore_errors=True)
+        fs.rm(destination, ignore_errors=True) # Leftover of a copy without metadata
+        copy_start = time.time()
+        shutil.copytree(directory, tmp, symlinks=True, ignore=_ignore_unstaged(directory))
+        meta = {'source': directory, 'seconds': time.time()-copy_start, 'size': _tree_size(tmp)}
+        with open(fs.join(tmp, _meta_file), 'w') as file:
+            json.dump(meta, file)
+        os.rename(tmp, destination)
+        return StageResult(destination, False, time.time()-start, meta['seconds'], meta['size'])
+
+
+# Returns path of given jar on node-local disk, once it is staged there
+def staged_jar_path(jarpath, digest):
+    return fs.join(loc.get_node_stage_dir(), 'jars', digest, fs.basename(jarpath))
+
+
+# Returns shell command copying given jar to given destination on the node-local disk of given node, over ssh,
+# unless it is there already. The command writes 'hit' to outfile if the node had it already, and ssh errors to errfile.
+# We exec ssh, so stopping the command stops ssh
+def _stage_jar_command(node, jarpath, destination, outfile, errfile):
+    remote_command = 'test -f {0} && echo hit || (mkdir -p {1} && cat > {0}.$$ && mv {0}.$$ {0})'.format(destination, fs.dirname(destination))
+    return 'exec ssh -o BatchMode=yes {} {} < {} > {} 2> {}'.format(
+        shlex.quote(node), shlex.quote(remote_command), shlex.quote(jarpath), shlex.quote(outfile), shlex.quote(errfile))
+
+
+# Returns contents of given text file, stripped
+def _read(path):
+    with open(path, 'r', errors='replace') as file:
+        return file.read().strip()
+
+
+# Stage given jar on node-local disk of all given nodes, with at most max_workers nodes at a time.
+# Nodes which take longer than timeout seconds are stopped, and count as failed.
+# Returns path of the staged jar on every node, or None if any node failed
+def stage_jar(nodes, jarpath, max_workers=16, timeout=300):
+    if len(nodes) == 0:
+        return None
+    start = time.time()
+    destination = staged_jar_path(jarpath, fs.digest(jarpath))
+    hits = 0
+    status = True
+    with tempfile.TemporaryDirectory(prefix='metaspark-stage-') as tmp:
+        pool = ExecutorPool(max_concurrent=max_workers, stop_on_error=False)
+        for idx, node in enumerate(nodes):
+            pool.submit(_stage_jar_command(node, jarpath, destination, fs.join(tmp, '{}.out'.format(idx)), fs.join(tmp, '{}.err'.format(idx))), timeout=timeout, shell=True)
+        for task in pool.as_completed():
+            if task.success():
+                hits += 1 if _read(fs.join(tmp, '{}.out'.format(task.index))) == 'hit' else 0
+                continue
+            status = False
+            if task.timed_out:
+                reason = 'timed out after {} seconds'.format(timeout)
+            else:
+                reason = _read(fs.join(tmp, '{}.err'.format(task.index))) or 'ssh exited with status {}'.format(task.returncode)
+            printw('{}: could not stage {}: {}'.format(nodes[task.index], fs.basename(jarpath), reason))
+    print('Staged {} on {} nodes in {:.2f} seconds ({} had it already)'.format(fs.basename(jarpath), len(nodes), time.time()-start, hits))
+    return destination if status else None
+
+
+# Summarize staging in given boot events (see remote.util.timeline).
+# Returns a line describing how many nodes copied and reused the Spark distribution,
+# and how much time reusing saved, or None if no node staged anything
+def summary(events):
+    staged = [x for x in events if x['event'] == 'staged']
+    if len(staged) == 0:
+        return None
+    hosts = dict()
+    for event in staged: # Processes on a node share its copy: A node hit the cache only if none of them copied
+        hosts.setdefault(event['host'], []).append(event)
+    copied = [x for x in hosts.values() if any(not y['hit'] for y in x)]
+    reused = [x for x in hosts.values() if all(y['hit'] for y in x)]
+    copy_time = max((y['seconds'] for x in copied for y in x if not y['hit']), default=0.0)
+    saved = max((y['saved'] for x in reused for y in x), default=0.0) # Nodes copy in parallel, so the slowest copy delays the boot
+    return 'Staging: {} node(s) copied Spark to local disk (slowest {:.2f} seconds), {} node(s) reused a cached copy, saving up to {:.2f} seconds of boot time'.format(
+        len(copied), copy_time, len(reused), saved)
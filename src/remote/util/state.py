@@ -0,0 +1,72 @@
+# In this file, we provide functions to remember a running ("warm") cluster.
+# Master writes the state of the cluster to a file once it is ready,
+# so deployments and new runs can find and reuse it
+# instead of booting a new cluster every time.
+
+import json
+import time
+
+import remote.util.probe as probe
+import util.fs as fs
+import util.location as loc
+
+
+# Settings of a cluster config which make a running cluster differ from another
+_settings = ('nodes', 'coallocation_affinity', 'infiniband', 'worker_cores', 'worker_memory', 'profile', 'spark_version', 'spark_build', 'stage_local')
+
+# Returns settings of given cluster config as a dict, as we store them in the state
+def settings_of(cluster_cfg):
+    return {x: getattr(cluster_cfg, x) for x in _settings}
+
+
+# Persist state of the running cluster. settings holds the settings of its cluster config (see settings_of())
+def write_state(master_url, reservation, nodes, config_name, webui_url, spark_version=None, spark_build=None, stage_local=False, settings=None):
+    state = {
+        'master_url': master_url,
+        'reservation': reservation,
+        'nodes': nodes,
+        'config': config_name,
+        'webui_url': webui_url,
+        'spark_version': spark_version,
+        'spark_build': spark_build,
+        'stage_local': stage_local,
+        'settings': settings,
+        'started': time.time()
+    }
+    tmp = loc.get_metaspark_cluster_state_file()+'.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(state, file, indent=4)
+    fs.mv(tmp, loc.get_metaspark_cluster_state_file())
+
+
+# Returns state of the last cluster that was running as a dict, or None if there is none
+def read_state():
+    if not fs.isfile(loc.get_metaspark_cluster_state_file()):
+        return None
+    try:
+        with open(loc.get_metaspark_cluster_state_file(), 'r') as file:
+            return json.load(file)
+    except ValueError as e:
+        return None
+
+
+# Returns True if given state is of a cluster booted with given cluster config name and settings, False otherwise.
+# States of clusters booted before we stored settings only compare the config name
+def matches(state, config_name, cluster_cfg):
+    if state['config'] != config_name:
+        return False
+    return state.get('settings') == None or state['settings'] == settings_of(cluster_cfg)
+
+
+# Forget about the running cluster
+def clear_state():
+    fs.rm(loc.get_metaspark_cluster_state_file(), ignore_errors=True)
+
+
+# Returns state of the running cluster if its master is still reachable, None otherwise
+def live_state():
+    state = read_state()
+    if state == None:
+        return None
+    host, port = state['master_url'][len('spark://'):].rsplit(':', 1)
+    return state if probe.port_open(host, int(port)) else None
@@ -1,12 +1,22 @@
+import os
+import selectors
 import socket
+import struct
 import time
+import zlib
 
 import util.fs as fs
-import util.location as loc
 
 from util.printer import *
 
 
+# Returns setting with given name of given experiment: The result of calling it for hooks of
+# experiments.interface.ExperimentInterface, its value for plain attributes, or default if it has neither
+def _experiment_setting(experiment, name, default):
+    value = getattr(experiment, name, default)
+    return value() if callable(value) else value
+
+
 class Syncer(object):
     '''
     Object to  handle synchronisation of all nodes between runs.
@@ -21,17 +31,144 @@ class Syncer(object):
 
     Initial measurements show this synchronisation strategy can sync
     all nodes to microsecond-length windows
+
+    experiment may be an experiments.interface.ExperimentInterface.
+    Without explicit mode and fanout, we use its sync_mode() and sync_fanout() hooks,
+    and sync() without explicit timeout uses its sync_timeout() hook.
+
+    With mode='flat' (default), all nodes connect directly to prime.
+    Prime handles every arrival and release itself, so barrier time grows
+    linearly with the amount of nodes.
+    With mode='tree', nodes form a k-ary tree (k=fanout) rooted at prime.
+    Every node waits for its children, notifies its parent, waits for the
+    release of its parent and releases its children. This way,
+    barrier time grows with the height of the tree instead.
+
+    Nodes with children handle connecting and arriving children
+    in whatever order they come, using a selector.
+    After every sync, arrivals maps the rank of every node in our subtree
+    to the time (time.time()) it arrived at the barrier (called sync()). Every node sends its own
+    arrival and those of its subtree to its parent as seconds before sending, and the parent
+    converts them to its own clock when it receives them, so we need no synchronised clocks.
+    On prime, this covers all nodes, in both modes. Use stragglers()
+    to find the nodes that kept the barrier waiting.
+
+    With rendezvous='announce' (default), prime listens on a port derived
+    from the reservation (SLURM_JOB_ID unless given), and all other nodes
+    connect to it, retrying with sub-second backoff. Prime doubles as
+    directory, telling every node where its parent is hosting.
+    With rendezvous='file', or when prime cannot bind the derived port,
+    nodes publish their port in experiments/.port.txt instead.
+
+    The barrier is reusable: Every sync() is a new generation, and
+    all messages carry their generation number. Give sync() a timeout
+    to drop nodes that do not arrive in time (or disconnect) from
+    the barrier, so the others continue with a reduced quorum.
+    sync() returns the nodes that went missing, missing holds all of them.
+
+    estimate_offsets() measures the clock offset of every node relative
+    to prime, NTP-style, over the connections the barrier holds open.
+    Afterwards, sync(lead=...) releases all nodes at the same moment
+    on the clock of prime, instead of as soon as the release arrives.
+    Use to_prime_time() to make timestamps of different nodes comparable.
     '''
-    def __init__(self, config, experiment, designation, debug_mode=False):
+    def __init__(self, config, experiment, designation, debug_mode=False, mode=None, fanout=None, sync_dir=None, rendezvous='announce', reservation=None):
         retries = 5 # Number of retries before we blame the network
         self.gid = config.gid
         self.designation = designation
         self.debug_mode = debug_mode
 
+        if mode == None:
+            mode = _experiment_setting(experiment, 'sync_mode', 'flat')
+        if fanout == None:
+            fanout = _experiment_setting(experiment, 'sync_fanout', 2)
+        if not mode in ('flat', 'tree'):
+            raise ValueError('Unknown sync mode "{}" (expected "flat" or "tree")'.format(mode))
+        if mode == 'tree' and fanout < 1:
+            raise ValueError('Fanout must be at least 1, got {}'.format(fanout))
+        if not rendezvous in ('announce', 'file'):
+            raise ValueError('Unknown rendezvous "{}" (expected "announce" or "file")'.format(rendezvous))
+        self.mode = mode
+        self.timeout = _experiment_setting(experiment, 'sync_timeout', None) # Default timeout of sync()
+
+        if sync_dir == None:
+            import util.location as loc
+            sync_dir = loc.get_metaspark_experiment_dir()
+        self.sync_dir = sync_dir
+
+        # Without a reservation to derive a port from, we cannot announce
+        if reservation == None:
+            reservation = os.environ.get('SLURM_JOB_ID')
+        self.rendezvous = rendezvous if reservation != None else 'file'
+        self.rendezvous_port = Syncer._derive_port(reservation)
+
+        # Servers get ranks [0, num_servers), clients get ranks [num_servers, num_servers+num_clients)
+        num_servers = _experiment_setting(experiment, 'num_servers', 0)
+        self.size = num_servers+_experiment_setting(experiment, 'num_clients', 0)
+        self.rank = self.gid if self.designation == 'server' else num_servers+self.gid
         self.prime = self.gid == 0 and self.designation == 'server'
-        # Server 0 opens socket to listen
-        if self.prime:
-            self.serversock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.fanout = max(1, self.size-1) if mode == 'flat' else fanout # Flat barrier is a tree of height 1
+        self.parent = self._parent_of(self.rank)
+        self.children = list(range(self.rank*self.fanout+1, min(self.size, (self.rank+1)*self.fanout+1)))
+
+        # Nodes with children open socket to listen
+        if len(self.children) > 0:
+            self._host(retries)
+        # Nodes other than prime open a socket to their parent
+        if not self.prime:
+            self._connect(config, retries)
+        # Wait until all children are connected
+        self.connections = dict() # Maps rank of child to its connection
+        self.arrivals = dict()
+        self.generation = 0
+        self.missing = set() # Ranks of nodes dropped from the barrier
+        self.height = self._depth(self.size-1)
+        self.subtree_height = self._height_of(self.rank)
+        self._unreported = [] # Ranks of nodes dropped outside of sync, reported with the next sync
+        self.release_time = 0.0
+        self.offset = 0.0 # Prime clock - our clock, as estimated by estimate_offsets()
+        self.offsets = dict()
+        if len(self.children) > 0:
+            if self.debug_mode: print('{}.{} stage 0! Port in use: {}'.format(self.designation, self.gid, self.port), flush=True)
+            self._accept_children()
+            if self.debug_mode: print('{}.{} Got all {} connections'.format(self.designation, self.gid, len(self.children)), flush=True)
+
+
+    # Returns a port in [10000, 20000) derived from given reservation identifier, the same for every node
+    @staticmethod
+    def _derive_port(reservation):
+        return 10000 + zlib.crc32(str(reservation).encode('utf-8')) % 10000
+
+    # Returns rank of the parent of given rank, or None for prime
+    def _parent_of(self, rank):
+        return None if rank == 0 else (rank-1) // self.fanout
+
+    # Returns path to the file where node with given rank publishes its address
+    def _port_file(self, rank):
+        return fs.join(self.sync_dir, '.port.txt' if rank == 0 else '.port.{}.txt'.format(rank))
+
+    # Returns address of prime when it is hosting on given port
+    def _prime_addr(self, config, port):
+        if self.designation == 'client':
+            return (config.hosts[0].split(':')[0], port)
+        return ('node{:03d}'.format(config.nodes[0]), port)
+
+    # Bind a socket to listen on.
+    # When announcing, prime binds to the port derived from the reservation.
+    # Otherwise (or when that port is taken), we pick the first free port starting at 2000,
+    # and prime tells the others about it using a file
+    def _host(self, retries):
+        self.serversock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.prime and self.rendezvous == 'announce':
+            try:
+                self.serversock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Lingering connections of earlier runs must not block us
+                self.serversock.bind((socket.gethostname(), self.rendezvous_port))
+                self.port = self.rendezvous_port
+                fs.rm(self._port_file(0), ignore_errors=True) # Prevent others from using a port file of an earlier run
+            except OSError as e:
+                printw('[SYNC] PRIME cannot announce on port {} ({}). Falling back to file rendezvous'.format(self.rendezvous_port, e))
+                self.rendezvous = 'file'
+        if not (self.prime and self.rendezvous == 'announce'):
             self.port = 2000
             connected = False
             while not connected:
@@ -46,85 +183,438 @@ class Syncer(object):
                             self.port += 1
                             break
                         if x == 0:
-                            printw('[SYNC] PRIME {}.{} cannot host from address {} (connection refused). Retrying...'.format(designation.upper(), self.gid, serveraddr))
+                            printw('[SYNC] {}.{} cannot host from address {} (connection refused). Retrying...'.format(self.designation.upper(), self.gid, serveraddr))
                         elif x == retries-1:
                             raise e
+        if self.prime:
             prints('Prime hosting from {}:{}'.format(socket.gethostname(), self.port))
-            with open(fs.join(loc.get_metaspark_experiment_dir(), '.port.txt'), 'w') as file:
-                file.write(str(self.port))
-            self.serversock.listen(1070) #Get up to 1070 connections before refusing them
-            self.expected_connections = experiment.num_servers-1+experiment.num_clients
-            self.connections = []
-            if self.debug_mode: print('PRIME stage 0! Address in use: {}'.format(serveraddr), flush=True)
-            for x in range(self.expected_connections):
-                connection, address = self.serversock.accept()
-                self.connections.append(connection)
-            if self.debug_mode: print('PRIME Got all {} connections'.format(self.expected_connections), flush=True)
-        else: #Others open a socket to prime
-            while not fs.isfile(loc.get_metaspark_experiment_dir(), '.port.txt'): # Wait until prime tells us which port to use
-                time.sleep(5)
-            with open(fs.join(loc.get_metaspark_experiment_dir(), '.port.txt'), 'r') as file:
-                while True:
-                    try:
-                        self.port = int(file.readlines()[0])
-                        break
-                    except Exception as e:
-                        time.sleep(1)
-                        pass
-            if self.designation == 'client':
-                addr = (config.hosts[0].split(':')[0], self.port)
-            else:
-                addr = ('node{:03d}'.format(config.nodes[0]), self.port)
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            if self.debug_mode: print('{}.{} CONNECTING TO addr: {}'.format(self.designation, self.gid, addr), flush=True)
-            for x in range(retries):
+            self.serversock.listen(max(1, self.size-1)) # When announcing, every node registers with prime
+            if self.rendezvous == 'file':
+                self._publish()
+        else:
+            self.serversock.listen(len(self.children))
+
+    # Tell our children where we are hosting, using a file
+    def _publish(self):
+        tmp = self._port_file(self.rank)+'.tmp'
+        with open(tmp, 'w') as file:
+            file.write(str(self.port) if self.prime else '{}:{}'.format(socket.gethostname(), self.port))
+        fs.mv(tmp, self._port_file(self.rank))
+
+    # Wait until node with given rank publishes its address in a file, and return it.
+    # We poll with exponential backoff, to keep pressure on the shared filesystem low
+    def _read_published(self, config, rank):
+        delay = 0.05
+        while True:
+            try:
+                with open(self._port_file(rank), 'r') as file:
+                    published = file.readlines()[0]
+                if rank == 0:
+                    return self._prime_addr(config, int(published))
+                host, port = published.rsplit(':', 1)
+                return (host, int(port))
+            except (OSError, IndexError, ValueError) as e:
+                time.sleep(delay)
+                delay = min(delay*2, 2.0)
+
+    # Try to connect to given address once. Returns connected socket, or None if nobody listens there
+    def _try_connect(self, addr):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect(addr)
+            return sock
+        except (ConnectionError, socket.timeout) as e:
+            sock.close()
+            return None
+
+    # Find prime by connecting to the port derived from the reservation.
+    # We retry with sub-second exponential backoff. Every few seconds, we also check whether prime
+    # fell back to file rendezvous. Returns a socket connected to prime,
+    # or None if prime uses file rendezvous instead
+    def _discover_prime(self, config):
+        addr = self._prime_addr(config, self.rendezvous_port)
+        delay = 0.01
+        next_file_check = time.monotonic() + 2.0
+        while True:
+            sock = self._try_connect(addr)
+            if sock != None:
                 try:
-                    self.sock.connect(addr)
-                    break
-                except ConnectionRefusedError as e:
-                    if x == 0:
-                        printw('[SYNC] {}.{} cannot connect to address {} (connection refused). Retrying...'.format(designation.upper(), self.gid, addr))
-                    elif x == retries-1:
-                        raise e
-                    time.sleep(1)
-
-    # Handle syncinc if we are prime server
-    def _handle_sync_prime(self):
+                    sock.settimeout(5.0)
+                    if Syncer._recv_exact(sock, 2) == b'ms': # Make sure we reached prime and not some other service
+                        sock.settimeout(None)
+                        return sock
+                except (ConnectionError, socket.timeout) as e:
+                    pass
+                sock.close()
+            if time.monotonic() >= next_file_check:
+                if fs.isfile(self._port_file(0)):
+                    return None
+                next_file_check = time.monotonic() + 2.0
+            time.sleep(delay)
+            delay = min(delay*2, 0.5)
+
+    # Send our rank and the address we host on (port 0 if we have no children) over given socket
+    def _register(self, sock):
+        host = socket.gethostname().encode('utf-8') if len(self.children) > 0 else b''
+        port = self.port if len(self.children) > 0 else 0
+        sock.sendall(struct.pack('!IHH', self.rank, port, len(host))+host)
+
+    # Connect to our parent, after finding out where it is hosting
+    def _connect(self, config, retries):
+        if self.rendezvous == 'announce':
+            primesock = self._discover_prime(config)
+            if primesock == None:
+                self.rendezvous = 'file'
+            else:
+                self._register(primesock)
+                if self.parent == 0:
+                    self.sock = primesock
+                    return
+                # Prime tells us where our parent is hosting
+                port, hostlen = struct.unpack('!HH', Syncer._recv_exact(primesock, 4))
+                addr = (Syncer._recv_exact(primesock, hostlen).decode('utf-8'), port)
+                primesock.close()
+        if self.rendezvous == 'file':
+            if len(self.children) > 0:
+                self._publish()
+            addr = self._read_published(config, self.parent)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.debug_mode: print('{}.{} CONNECTING TO addr: {}'.format(self.designation, self.gid, addr), flush=True)
+        for x in range(retries):
+            try:
+                self.sock.connect(addr)
+                self._register(self.sock) # Tell parent who we are
+                break
+            except ConnectionRefusedError as e:
+                if x == 0:
+                    printw('[SYNC] {}.{} cannot connect to address {} (connection refused). Retrying...'.format(self.designation.upper(), self.gid, addr))
+                elif x == retries-1:
+                    raise e
+                time.sleep(1)
+
+
+    # Receive exactly size bytes from given connection
+    @staticmethod
+    def _recv_exact(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size-len(data))
+            if len(chunk) == 0:
+                raise ConnectionError('Connection closed during sync')
+            data += chunk
+        return data
+
+    # Accept connections of all children, in the order in which they connect.
+    # Every connecting node registers itself by sending its rank and hosting address.
+    # When announcing, prime also acts as directory: All other nodes register with prime,
+    # and prime replies with the hosting address of their parent once it is known
+    def _accept_children(self):
+        directory = self.prime and self.rendezvous == 'announce'
+        expected = self.size-1 if directory else len(self.children)
+        registered = 0
+        addresses = dict() # Maps rank to hosting address of registered nodes with children
+        waiting = dict() # Maps rank to list of connections waiting for its hosting address
+
+        def answer(conn, addr):
+            host = addr[0].encode('utf-8')
+            conn.sendall(struct.pack('!HH', addr[1], len(host))+host)
+            conn.close()
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.serversock, selectors.EVENT_READ)
+            while registered < expected:
+                for key, events in selector.select():
+                    if key.fileobj == self.serversock:
+                        connection, address = self.serversock.accept()
+                        if directory:
+                            connection.sendall(b'ms')
+                        selector.register(connection, selectors.EVENT_READ)
+                        continue
+
+                    conn = key.fileobj
+                    selector.unregister(conn)
+                    rank, port, hostlen = struct.unpack('!IHH', Syncer._recv_exact(conn, 8))
+                    host = Syncer._recv_exact(conn, hostlen).decode('utf-8')
+                    registered += 1
+                    if rank in self.children:
+                        self.connections[rank] = conn
+                    elif directory:
+                        parent = self._parent_of(rank)
+                        if parent in addresses:
+                            answer(conn, addresses[parent])
+                        else:
+                            waiting.setdefault(parent, []).append(conn)
+                    else:
+                        conn.close()
+                        raise RuntimeError('[SYNC] Node with rank {} connected to {}.{}, which is not its parent'.format(rank, self.designation, self.gid))
+                    if directory and port != 0:
+                        addresses[rank] = (host, port)
+                        for waiter in waiting.pop(rank, []):
+                            answer(waiter, addresses[rank])
+
+    # Returns ranks of given node and all nodes below it in the tree
+    def _subtree(self, rank):
+        ranks = []
+        level = [rank]
+        while len(level) > 0:
+            ranks.extend(level)
+            level = [child for x in level for child in range(x*self.fanout+1, min(self.size, (x+1)*self.fanout+1))]
+        return ranks
+
+    # Returns amount of ancestors of given rank in the tree
+    def _depth(self, rank):
+        depth = 0
+        while rank != 0:
+            rank = self._parent_of(rank)
+            depth += 1
+        return depth
+
+    # Returns amount of levels in the tree below given rank
+    def _height_of(self, rank):
+        height = 0
+        while rank*self.fanout+1 < self.size: # Leftmost path down is the longest
+            rank = rank*self.fanout+1
+            height += 1
+        return height
+
+    # Send a barrier message for given generation, carrying given ranks of missing nodes,
+    # the prime timestamp at which to release (0 to release immediately),
+    # and given arrivals, mapping ranks to seconds they arrived before we sent this message
+    @staticmethod
+    def _send_frame(conn, generation, missing, release_time=0.0, arrivals=dict()):
+        conn.sendall(struct.pack('!2sIdII', b'go', generation, release_time, len(missing), len(arrivals))
+            +b''.join(struct.pack('!I', x) for x in missing)
+            +b''.join(struct.pack('!Id', rank, delay) for rank, delay in arrivals.items()))
+
+    # Receive a barrier message. Returns its generation, ranks of missing nodes, release timestamp and arrivals
+    @staticmethod
+    def _recv_frame(conn):
+        kind, generation, release_time, amount, arrived = struct.unpack('!2sIdII', Syncer._recv_exact(conn, 22))
+        if kind != b'go':
+            raise ConnectionError('Received malformed sync message')
+        missing = [struct.unpack('!I', Syncer._recv_exact(conn, 4))[0] for x in range(amount)]
+        arrivals = dict(struct.unpack('!Id', Syncer._recv_exact(conn, 12)) for x in range(arrived))
+        return generation, missing, release_time, arrivals
+
+    # Wait until all our children (and thereby their subtrees) arrived at the barrier.
+    # Children are handled in the order in which they arrive.
+    # Children which disconnect, send a message of another generation, or do not arrive
+    # before deadline (if not None), are dropped together with their subtree.
+    # Returns ranks of nodes in our subtree which went missing this generation
+    def _handle_sync_children(self, deadline):
         if self.debug_mode: print('SYNC stage 1!', flush=True)
-        for idx, conn in enumerate(self.connections):
-            msg = conn.recv(2)
-    
-        if self.debug_mode: print('SYNC stage 2!', flush=True)
-        # When arriving here, all expected servers and clients are connected and waiting for a reply
-        for conn in self.connections:
-            conn.sendall(b'go')
+        missing = self._unreported
+        self._unreported = []
+        with selectors.DefaultSelector() as selector:
+            for rank, conn in self.connections.items():
+                selector.register(conn, selectors.EVENT_READ, rank)
+            while len(selector.get_map()) > 0:
+                remaining = None if deadline == None else max(0, deadline - time.monotonic())
+                ready = selector.select(remaining)
+                if len(ready) == 0: # Deadline passed
+                    break
+                for key, events in ready:
+                    selector.unregister(key.fileobj)
+                    try:
+                        generation, lost, release_time, arrivals = Syncer._recv_frame(key.fileobj)
+                        if generation != self.generation:
+                            raise ConnectionError('Expected generation {}, got {}'.format(self.generation, generation))
+                        now = time.time()
+                        for rank, delay in arrivals.items(): # This child and the nodes in its subtree
+                            self.arrivals[rank] = now - delay
+                        missing.extend(lost)
+                    except (ConnectionError, struct.error) as e:
+                        if self.debug_mode: print('{}.{} lost child {}: {}'.format(self.designation, self.gid, key.data, e), flush=True)
+                        missing.extend(self._drop_child(key.data))
+        for rank in [x for x in self.connections if not x in self.arrivals]:
+            missing.extend(self._drop_child(rank))
+        return missing
 
-        if self.debug_mode: print('SYNC completed!', flush=True)
+    # Stop waiting for given child in all future generations. Returns ranks of its subtree
+    def _drop_child(self, rank):
+        self.connections.pop(rank).close()
+        return self._subtree(rank)
 
-    # Handle syncing if we are not prime server
-    def _handle_sync_other(self):
+    # Handle a failure of this node: Close the connection to our parent, and those to our children,
+    # so our whole subtree notices right away, instead of when its own deadlines pass
+    def _fail(self):
+        self.sock.close()
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = dict()
+
+    # Release all our children, telling them which nodes are missing and when to continue
+    def _handle_release_children(self):
+        if self.debug_mode: print('SYNC stage 2!', flush=True)
+        # When arriving here, all nodes in our subtree are connected and waiting for a reply
+        missing = sorted(self.missing)
+        for rank, conn in list(self.connections.items()):
+            try:
+                Syncer._send_frame(conn, self.generation, missing, self.release_time)
+            except OSError as e: # Child disappeared after arriving, we notice it next generation
+                pass
+
+    # Notify our parent that our subtree arrived, and wait for its release.
+    # Returns ranks of all missing nodes and the release timestamp, as told by our parent.
+    # On failure, we close all our connections (see _fail()) before raising
+    def _handle_sync_parent(self, missing, timeout):
         try:
-            self.sock.sendall(b'go')
-            msg = self.sock.recv(2)
+            sent = time.time()
+            arrivals = {rank: sent-arrival for rank, arrival in self.arrivals.items()}
+            arrivals[self.rank] = sent-self.arrived # Not when our message arrives: We may have waited for our children
+            Syncer._send_frame(self.sock, self.generation, missing, arrivals=arrivals)
+            # Every level above us may wait at most timeout seconds
+            self.sock.settimeout(None if timeout == None else timeout * (self.height+1))
+            generation, missing, release_time, arrivals = Syncer._recv_frame(self.sock)
+            self.sock.settimeout(None)
+            if generation != self.generation:
+                raise ConnectionError('Expected release of generation {}, got {}'.format(self.generation, generation))
+            return missing, release_time
+        except socket.timeout as e:
+            self._fail()
+            raise TimeoutError('[SYNC] {}.{} got no release from parent for generation {}'.format(self.designation.upper(), self.gid, self.generation))
         except Exception as e:
-            self.sock.close()
-            raise e            
+            self._fail()
+            raise e
 
-    # Synchronise with all other nodes
-    def sync(self):
+    # Synchronise with all other nodes.
+    # Every call is a new generation of the barrier. With a timeout (in seconds), nodes which do not arrive in time
+    # are dropped, and the remaining nodes continue without them in this and future generations.
+    # Without a timeout, we use the sync_timeout() of the experiment. Timeout 0 means wait forever.
+    # In tree mode, every level of the tree gets timeout seconds to arrive.
+    # With a lead (in seconds, only used by prime), prime picks release_time as lead seconds in the future,
+    # and every node busy-waits until that moment on the clock of prime. Call estimate_offsets() first.
+    # Returns sorted ranks of nodes which went missing during this generation.
+    # Raises an error when we are dropped ourselves (e.g. because our parent went missing)
+    def sync(self, timeout=None, lead=None):
+        if timeout == None:
+            timeout = self.timeout
+        elif timeout == 0:
+            timeout = None
+        self.generation += 1
+        deadline = None if timeout == None else time.monotonic() + timeout * self.subtree_height
+        self.arrived = time.time()
+        self.arrivals = dict()
+        missing = self._handle_sync_children(deadline) if len(self.children) > 0 else []
+        known = set(self.missing)
         if self.prime:
-            self._handle_sync_prime()
+            self.missing.update(missing)
+            self.release_time = 0.0 if lead == None else time.time() + lead
+        else:
+            missing, self.release_time = self._handle_sync_parent(missing, timeout)
+            self.missing.update(missing)
+        if len(self.children) > 0:
+            self._handle_release_children()
+        if self.release_time > 0:
+            self._wait_until(self.release_time)
+        lost = sorted(self.missing - known)
+        if self.prime and len(lost) > 0:
+            printw('[SYNC] Generation {} continues without {} missing nodes: {}'.format(self.generation, len(lost), lost))
+        if self.debug_mode and self.prime: print('SYNC completed!', flush=True)
+        return lost
+
+    # Busy-wait until given timestamp (on the clock of prime) passed on our clock
+    def _wait_until(self, release_time):
+        target = self.to_local_time(release_time)
+        remaining = target - time.time()
+        if remaining > 0.002: # Sleep most of the way, spin the final milliseconds
+            time.sleep(remaining - 0.002)
+        while time.time() < target:
+            pass
+
+    # Convert a timestamp (time.time()) of this node to the clock of prime
+    def to_prime_time(self, timestamp):
+        return timestamp + self.offset
+
+    # Convert a timestamp on the clock of prime to the clock of this node
+    def to_local_time(self, timestamp):
+        return timestamp - self.offset
+
+    # Estimate clock offsets of all nodes relative to prime, NTP-style. All nodes must call this together.
+    # Every node exchanges given amount of ping-pongs with its parent over the barrier connection,
+    # and keeps the sample with the lowest round-trip time. Offsets add up along the tree.
+    # Afterwards, offset holds the offset of our clock (prime clock - our clock, in seconds),
+    # and offsets maps ranks of all nodes in our subtree to (offset, rtt). On prime, this covers all nodes
+    def estimate_offsets(self, samples=8):
+        self.offsets = dict()
+        if not self.prime:
+            try:
+                best = None
+                for x in range(samples):
+                    t0 = time.time()
+                    self.sock.sendall(struct.pack('!2sd', b'pi', t0))
+                    kind, t1, t2, parent_offset = struct.unpack('!2sddd', Syncer._recv_exact(self.sock, 26))
+                    t3 = time.time()
+                    if kind != b'po':
+                        raise ConnectionError('Received malformed clock message')
+                    rtt = (t3-t0) - (t2-t1)
+                    if best == None or rtt < best[1]:
+                        best = (((t1-t0) + (t2-t3)) / 2, rtt, parent_offset)
+            except Exception as e:
+                self._fail()
+                raise e
+            self.offset = best[0] + best[2]
+            self.offsets[self.rank] = (self.offset, best[1])
         else:
-            self._handle_sync_other()
+            self.offset = 0.0
+            self.offsets[self.rank] = (0.0, 0.0)
+
+        if len(self.connections) > 0:
+            self._serve_offsets()
+        if not self.prime:
+            entries = b''.join(struct.pack('!Idd', rank, offset, rtt) for rank, (offset, rtt) in self.offsets.items())
+            self.sock.sendall(struct.pack('!2sI', b'dn', len(self.offsets))+entries)
+        if self.debug_mode and self.prime:
+            print('SYNC clock offsets (rank: offset, rtt): {}'.format(self.offsets), flush=True)
+        return self.offsets
+
+    # Answer ping-pongs of our children, until all of them sent the offsets of their subtree
+    def _serve_offsets(self):
+        with selectors.DefaultSelector() as selector:
+            for rank, conn in self.connections.items():
+                selector.register(conn, selectors.EVENT_READ, rank)
+            while len(selector.get_map()) > 0:
+                for key, events in selector.select():
+                    conn = key.fileobj
+                    try:
+                        kind = Syncer._recv_exact(conn, 2)
+                        t1 = time.time()
+                        if kind == b'pi':
+                            Syncer._recv_exact(conn, 8)
+                            conn.sendall(struct.pack('!2sddd', b'po', t1, time.time(), self.offset))
+                        elif kind == b'dn':
+                            selector.unregister(conn)
+                            amount = struct.unpack('!I', Syncer._recv_exact(conn, 4))[0]
+                            for x in range(amount):
+                                rank, offset, rtt = struct.unpack('!Idd', Syncer._recv_exact(conn, 20))
+                                self.offsets[rank] = (offset, rtt)
+                        else:
+                            raise ConnectionError('Received malformed clock message')
+                    except (ConnectionError, struct.error) as e:
+                        if self.debug_mode: print('{}.{} lost child {}: {}'.format(self.designation, self.gid, key.data, e), flush=True)
+                        selector.unregister(conn)
+                        self._unreported.extend(self._drop_child(key.data)) # Reported with the next sync
+
+    # Returns (rank, seconds waited on) of the given amount of nodes in our subtree that arrived last during the last sync.
+    # Seconds waited on is the time between arrival of given node and arrival of the first node.
+    # On prime, this covers all nodes, also in tree mode
+    def stragglers(self, amount=5):
+        if len(self.arrivals) == 0:
+            return []
+        first = min(self.arrivals.values())
+        latest = sorted(self.arrivals.items(), key=lambda x: x[1], reverse=True)[:amount]
+        return [(rank, arrival-first) for rank, arrival in latest]
 
 
     # Close network. Every node should call this to clean up
     def close(self):
-        if self.prime:
+        if len(self.children) > 0:
             self.serversock.close()
             # Quickly close connections and be done with it
-            for conn in self.connections:
+            for conn in self.connections.values():
                 conn.close()
-            fs.rm(loc.get_metaspark_experiment_dir(), '.port.txt')
-        else:
-            self.sock.close()
\ No newline at end of file
+            if self.rendezvous == 'file':
+                fs.rm(self._port_file(self.rank), ignore_errors=True)
+        if not self.prime:
+            self.sock.close()
@@ -0,0 +1,82 @@
+# In this file, we provide a timeline of cluster boot events.
+# Every node writes its own events as JSON lines to its own file,
+# so hundreds of nodes never append to the same file on the shared filesystem.
+# Master merges them into one timeline, and summarizes it in a table.
+
+import json
+import socket
+import time
+
+import util.fs as fs
+
+
+class BootTimeline(object):
+    '''
+    Object to record boot events of a single node.
+    Events are JSON objects with at least the gid, lid and host of the node,
+    the name of the event and the time (time.time()) it happened.
+    We write them to <directory>/node_<gid>.jsonl immediately.
+    '''
+    def __init__(self, directory, gid, lid):
+        self.directory = directory
+        self.gid = gid
+        self.lid = lid
+        self.host = socket.getfqdn()
+        fs.mkdir(directory, exist_ok=True)
+        self.path = fs.join(directory, 'node_{}.jsonl'.format(gid))
+
+    # Record that given event happened just now, with optional extra fields.
+    # Fields override defaults, e.g. to record an event of another node at another time
+    def record(self, event, **fields):
+        entry = {'gid': self.gid, 'lid': self.lid, 'host': self.host, 'event': event, 'time': time.time()}
+        entry.update(fields)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(entry)+'\n')
+
+
+# Returns all events recorded in given timeline directory, sorted by time
+def read_events(directory):
+    events = []
+    for name in fs.ls(directory, only_files=True):
+        if not (name.startswith('node_') and name.endswith('.jsonl')):
+            continue
+        with open(fs.join(directory, name), 'r') as file:
+            for line in file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError as e: # Line still being written
+                    pass
+    return sorted(events, key=lambda x: x['time'])
+
+
+# Merge all events of given timeline directory into <directory>/timeline.jsonl.
+# Returns the merged events
+def merge(directory):
+    events = read_events(directory)
+    with open(fs.join(directory, 'timeline.jsonl'), 'w') as file:
+        for event in events:
+            file.write(json.dumps(event)+'\n')
+    return events
+
+
+# Summarize given events in a table with a row per node.
+# Columns show seconds since the first node entered run() at which
+# the node entered run(), its daemon script returned, and its worker registered with master
+def summary(events):
+    if len(events) == 0:
+        return 'No boot events recorded'
+    start = min(x['time'] for x in events if x['event'] == 'enter') if any(x['event'] == 'enter' for x in events) else events[0]['time']
+    rows = dict()
+    for event in events:
+        row = rows.setdefault(event['gid'], {'host': event['host'], 'lid': event['lid']})
+        row[event['event']] = event['time'] - start
+    fmt = lambda val: '{:.2f}'.format(val) if val != None else '-'
+
+    lines = ['{:>5} {:>30} {:>8} {:>10} {:>12}'.format('gid', 'host', 'enter', 'daemon', 'registered')]
+    for gid in sorted(rows, key=lambda x: (rows[x].get('registered', rows[x].get('daemon', float('inf'))), str(x))):
+        row = rows[gid]
+        lines.append('{:>5} {:>30} {:>8} {:>10} {:>12}'.format(gid, row['host'], fmt(row.get('enter')), fmt(row.get('daemon')), fmt(row.get('registered'))))
+    registered = [x['registered'] for x in rows.values() if 'registered' in x]
+    if len(registered) > 0:
+        lines.append('{} workers registered, last one after {:.2f} seconds'.format(len(registered), max(registered)))
+    return '\n'.join(lines)
@@ -0,0 +1,220 @@
+# In this file, we provide a local cache of downloaded artifacts (e.g. Spark distributions).
+# Artifacts are stored as <cache>/<name>/<version>/<sha512>/<filename>,
+# so a cached artifact is only used if it has the checksum we expect.
+# Next to every artifact, we keep its checksum in <filename>.sha512 (sha512sum format).
+# If no checksum source can be reached (e.g. offline), we use the only cached artifact
+# of the requested version, after verifying it against that file.
+#
+# Note: A checksum only proves an artifact is what its checksum source says it is.
+# A checksum fetched from the same mirror as the artifact detects corruption, not a bad mirror.
+# So callers should list upstream checksum sources first.
+# Downloads are chunked, resumable, and verified while streaming.
+# Sources may be http(s):// urls, file:// urls or plain local paths,
+# so installs can run offline from a local mirror.
+
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import util.fs as fs
+import util.location as loc
+from util.printer import *
+
+
+# Returns True if given source is a local file (file:// url or path), False otherwise
+def _is_local(source):
+    return urllib.parse.urlparse(source).scheme in ('', 'file')
+
+# Returns local path of given file:// url or path
+def _local_path(source):
+    parsed = urllib.parse.urlparse(source)
+    return urllib.request.url2pathname(parsed.path) if parsed.scheme == 'file' else source
+
+
+# Returns contents of given source as a string
+def _read_text(source, timeout=30):
+    if _is_local(source):
+        with open(_local_path(source), 'r') as file:
+            return file.read()
+    with urllib.request.urlopen(source, timeout=timeout) as response:
+        return response.read().decode('utf-8')
+
+
+# Parse a checksum file. Accepts 'sha512sum' output ('<hex>  <filename>')
+# and Apache 'gpg --print-md' output ('<filename>: <HEX IN GROUPS>'). Returns lowercase hex digest
+def parse_checksum(text):
+    if ':' in text:
+        digest = ''.join(text.split(':', 1)[1].split())
+    else:
+        digest = text.split()[0]
+    digest = digest.lower()
+    if len(digest) != 128 or any(not x in '0123456789abcdef' for x in digest):
+        raise ValueError('Could not find a SHA-512 checksum in "{}"'.format(text.strip()[:200]))
+    return digest
+
+
+# Returns SHA-512 checksum of given file, reading it in chunks
+def sha512_of(path, chunk_size=1024*1024):
+    return fs.digest(path, algorithm='sha512', chunk_size=chunk_size)
+
+
+# Move given complete, verified download to given path in the cache, with its checksum next to it
+def _promote(partial, path, sha512):
+    with open(path+'.sha512', 'w') as file:
+        file.write('{}  {}\n'.format(sha512, fs.basename(path)))
+    os.replace(partial, path)
+
+
+# Returns path to the cached artifact with given name, version and filename, verified against the checksum stored next to it.
+# Returns None if there is no such artifact, more than one (we cannot tell which one is right), or it does not verify
+def _cached_fallback(name, version, filename):
+    found = glob.glob(fs.join(glob.escape(fs.join(loc.get_metaspark_artifact_dir(), name, version)), '*', glob.escape(filename)))
+    if len(found) != 1:
+        return None
+    path = found[0]
+    try:
+        with open(path+'.sha512', 'r') as file:
+            sha512 = parse_checksum(file.read())
+    except (OSError, ValueError) as e:
+        return None
+    if sha512 != fs.basename(fs.dirname(path)) or sha512_of(path) != sha512:
+        printw('Cached {} does not match its checksum'.format(path))
+        return None
+    return path
+
+
+class _Restart(Exception):
+    '''Raised when a download cannot be resumed, and must start from the beginning'''
+    pass
+
+
+# Download given source to given path, in chunks, updating given hashlib digest with every chunk.
+# If the file exists already, we resume after its last byte (the digest must contain its contents already).
+# Raises OSError (including urllib errors) on failure
+def _download(source, path, digest, chunk_size, timeout=30):
+    if _is_local(source):
+        with open(_local_path(source), 'rb') as src, open(path, 'ab') as dst:
+            src.seek(dst.tell())
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                dst.write(chunk)
+                digest.update(chunk)
+        return
+
+    offset = fs.sizeof(path) if fs.isfile(path) else 0
+    request = urllib.request.Request(source)
+    if offset > 0:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if offset > 0 and e.code == 416: # We have at least as many bytes as the source, yet not the right ones
+            print('Source has nothing after byte {}, downloading from the start'.format(offset))
+            raise _Restart()
+        raise
+    with response:
+        if offset > 0 and response.status != 206: # Server ignored our range, so we must start over
+            print('Source does not support resuming, downloading from the start')
+            raise _Restart()
+        total = response.headers.get('Content-Length')
+        total = int(total)+offset if total != None else None
+        received = offset
+        last_report = time.monotonic()
+        with open(path, 'ab') as file:
+            for chunk in iter(lambda: response.read(chunk_size), b''):
+                file.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                if time.monotonic() - last_report > 5:
+                    last_report = time.monotonic()
+                    print('Downloaded {} MB{}'.format(received // (1024*1024), ' of {} MB'.format(total // (1024*1024)) if total != None else ''))
+
+
+# Fetch artifact with given name and version from the first source that works, into the cache.
+# sources is a list of urls or paths, checksum_sources a list of urls or paths to its SHA-512 checksum file,
+# or sha512 is the expected checksum itself. checksum_sources are tried in order, so list upstream ones first.
+# If no checksum source answers, we use the cached artifact if there is exactly one (see _cached_fallback()).
+# Returns path to the verified artifact in the cache, or None if we could not get it
+def fetch(name, version, filename, sources, sha512=None, checksum_sources=[], retries=3, chunk_size=1024*1024):
+    if sha512 == None:
+        for source in checksum_sources:
+            try:
+                sha512 = parse_checksum(_read_text(source))
+                break
+            except (OSError, ValueError) as e:
+                printw('Could not get checksum from {}: {}'.format(source, e))
+        if sha512 == None:
+            path = _cached_fallback(name, version, filename)
+            if path != None:
+                printw('Could not get a SHA-512 checksum for {} {}, using cached {}, which matches the checksum stored with it'.format(name, version, path))
+                return path
+            printe('Could not get a SHA-512 checksum for {} {}'.format(name, version))
+            return None
+
+    directory = fs.join(loc.get_metaspark_artifact_dir(), name, version, sha512)
+    path = fs.join(directory, filename)
+    if fs.isfile(path): # Only complete, verified downloads get this name
+        if not fs.isfile(path+'.sha512'): # Cached before we stored checksums next to artifacts
+            with open(path+'.sha512', 'w') as file:
+                file.write('{}  {}\n'.format(sha512, filename))
+        return path
+    fs.mkdir(directory, exist_ok=True)
+    partial = path+'.part'
+
+    for source in sources:
+        for attempt in range(retries):
+            digest = hashlib.sha512()
+            if fs.isfile(partial):
+                with open(partial, 'rb') as file: # Resume: Checksum of what we have already
+                    for chunk in iter(lambda: file.read(chunk_size), b''):
+                        digest.update(chunk)
+                if digest.hexdigest() == sha512: # An earlier attempt got everything, but did not get to promote it
+                    _promote(partial, path, sha512)
+                    return path
+                print('[{}] Resuming {} from {} at {} MB'.format(attempt, filename, source, fs.sizeof(partial) // (1024*1024)))
+            else:
+                print('[{}] Fetching {} from {}'.format(attempt, filename, source))
+            try:
+                _download(source, partial, digest, chunk_size)
+            except _Restart as e:
+                fs.rm(partial, ignore_errors=True)
+                continue
+            except (OSError, urllib.error.URLError) as e:
+                printw('Download interrupted: {}'.format(e))
+                continue
+            if digest.hexdigest() == sha512:
+                _promote(partial, path, sha512)
+                return path
+            printw('Checksum mismatch for {} from {}, discarding download'.format(filename, source))
+            fs.rm(partial, ignore_errors=True)
+    printe('Could not fetch {} {}'.format(name, version))
+    return None
+
+
+# Extract given archive into a temporary directory next to destination,
+# then move the single top-level directory of the archive to destination with one rename.
+# Readers never see a partially extracted destination.
+# Returns True on success, False otherwise
+def extract(archive, destination):
+    parent = fs.dirname(destination)
+    fs.mkdir(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.extract-', dir=parent)
+    try:
+        shutil.unpack_archive(archive, tmp)
+        content = list(fs.ls(tmp))
+        root = fs.join(tmp, content[0]) if len(content) == 1 and fs.isdir(tmp, content[0]) else tmp
+        if fs.exists(destination):
+            printw('Destination {} appeared while extracting, keeping it'.format(destination))
+            return True
+        os.rename(root, destination)
+        return True
+    except (OSError, EOFError, ValueError, shutil.ReadError) as e:
+        printe('Could not extract {}: {}'.format(archive, e))
+        return False
+    finally:
+        fs.rm(tmp, ignore_errors=True)
@@ -67,20 +67,20 @@ def _resolve1(minVersion, maxVersion):
     return None
 
 '''
-Find valid locations for Java home by walking from some path upwards,
-scanning for directories containing the right names.
+Find valid locations for Java home by walking from some path upwards
+(default: path of shell-java), scanning for directories containing the right names.
 
 Yields found paths lazily
 '''
-def resolve2(minVersion, maxVersion, path=_get_shell_java_path()):
-    p = str(path)
+def resolve2(minVersion, maxVersion, path=None):
+    p = str(path if path != None else _get_shell_java_path())
     dirlen = len(p.split(fs.sep()))
     for x in range(dirlen-1):
         p = fs.dirname(p)
         for item in fs.ls(p, only_dirs=True, full_paths=True):
             if fs.basename(item).startswith('java-') or 'openjdk' in fs.basename(item): #candidate found
                 version = _dirname_to_version(fs.basename(item))
-                if version < minVersion or java_version > maxVersion:
+                if version < minVersion or version > maxVersion:
                     continue
                 if (not fs.isdir(item, 'bin')) or (not fs.isfile(item, 'bin', 'java')) or not fs.isfile(item, 'bin', 'javac'):
                     continue
@@ -1,62 +1,52 @@
 # In this fiile, we provide functions to
 # install and interact with Apache Spark
 
-from pathlib import Path
-import urllib.request
-import shutil
-
 import util.fs as fs
 import util.location as loc
 from util.printer import *
 
+# Official sources of Spark releases. Only the latest releases stay on downloads.apache.org
+_apache_sources = [
+    'https://downloads.apache.org/spark/spark-{version}',
+    'https://archive.apache.org/dist/spark/spark-{version}'
+]
 
-# Check if Spark is installed in deps/spark
-def spark_available():
-    return fs.isdir(loc.get_spark_dir()) and fs.isdir(loc.get_spark_sbin())
-
-
-#installs Spark
-def install():
-    if spark_available():
-        return True
-
-    depsloc = loc.get_metaspark_dep_dir()
-    fs.mkdir(depsloc, exist_ok=True)
-    print('Installing Spark in {0}'.format(depsloc))
-
-    archiveloc = fs.join(depsloc, 'spark-3.0.1.tgz')
-
-    if not fs.isfile(archiveloc):
-        for x in range(5):
-            try:
-                fs.rm(archiveloc, ignore_errors=True)
-                url = 'https://downloads.apache.org/spark/spark-3.0.1/spark-3.0.1-bin-hadoop2.7.tgz'
-                print('[{0}] Fetching spark from {1}'.format(x, url))
-                urllib.request.urlretrieve(url, archiveloc)
-                break
-            except Exception as e:
-                if x == 0:
-                    printw('Could not download Spark. Retrying...')
-                elif x == 4:
-                    printe('Could not download Spark: {}'.format(e))
-                    return False
-    for x in range(5):
-        try:
-            shutil.unpack_archive(archiveloc, depsloc)
-            fs.mv(fs.join(depsloc, 'spark-3.0.1-bin-hadoop2.7'), loc.get_spark_dir())
-            print('installing complete')
-            return True
-        except Exception as e:
-            if x == 4:
-                printe('Could not download zip file correctly')
-                return False
-            elif x == 0:
-                print(e)
-                printw('Could not extract archive. Retrying...')
-    return False
-
-
+# Name of the file in a Spark installation remembering the SHA-512 of the archive it came from
+digest_file = '.metaspark_sha512'
 
 
+# Check if given Spark version and build (default if None) is installed
+def spark_available(version=None, build=None):
+    return fs.isdir(loc.get_spark_dir(version, build)) and fs.isdir(loc.get_spark_sbin_dir(version, build))
 
 
+# Installs given Spark version and build (default if None). We try given mirrors first, then the Apache servers.
+# A mirror is a directory (path or file:// url) or http(s) url containing
+# the Spark archive and its .sha512 checksum file
+def install(version=None, build=None, mirrors=[]):
+    version = version if version != None else loc.default_spark_version
+    build = build if build != None else loc.default_spark_build
+    if spark_available(version, build):
+        return True
+    import supplier.artifact as artifact # Imports urllib, which is slow to import. Only installing needs it
+
+    filename = 'spark-{}-bin-{}.tgz'.format(version, build)
+    bases = [x.rstrip('/') for x in mirrors] + [x.format(version=version) for x in _apache_sources]
+    # A checksum from a mirror only proves the archive of that mirror is intact, so we prefer the Apache checksums
+    checksum_bases = [x.format(version=version) for x in _apache_sources] + [x.rstrip('/') for x in mirrors]
+    print('Installing Spark {} ({}) in {}'.format(version, build, loc.get_spark_dir(version, build)))
+
+    archive = artifact.fetch(
+        'spark',
+        '{}-{}'.format(version, build),
+        filename,
+        sources=['{}/{}'.format(x, filename) for x in bases],
+        checksum_sources=['{}/{}.sha512'.format(x, filename) for x in checksum_bases])
+    if archive == None:
+        return False
+    if not artifact.extract(archive, loc.get_spark_dir(version, build)):
+        return False
+    with open(fs.join(loc.get_spark_dir(version, build), digest_file), 'w') as file:
+        file.write(fs.basename(fs.dirname(archive))+'\n') # Cached artifacts live in a directory named after their checksum
+    print('installing complete')
+    return True
@@ -0,0 +1,162 @@
+# In this file, we provide an Executor variant using asyncio subprocesses.
+# All AsyncExecutors share one event loop, running in one background thread,
+# so we can manage thousands of child processes without a thread per child.
+# Stopping a process does not poll: We terminate it and wait for its exit directly.
+
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+# Returns the shared event loop, starting it if needed.
+# Note: On Python < 3.8, the first AsyncExecutor must be created on the main thread,
+# because the child watcher of those versions installs a signal handler
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop == None:
+            loop = asyncio.new_event_loop()
+            watcher = None
+            if sys.version_info < (3, 8):
+                watcher = asyncio.SafeChildWatcher()
+            elif sys.version_info >= (3, 9) and sys.version_info < (3, 12) and hasattr(os, 'pidfd_open'):
+                # Default watcher of these versions uses a thread per child, a pidfd needs none
+                watcher = asyncio.PidfdChildWatcher()
+            if watcher != None:
+                watcher.attach_loop(loop)
+                asyncio.set_child_watcher(watcher)
+            thread = threading.Thread(target=loop.run_forever, name='asyncexecutor', daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+class AsyncExecutor(object):
+    '''
+    Object to run subprocess commands on a shared asyncio event loop.
+    Has the same run/wait/stop/reboot semantics as util.executor.Executor.
+    Accepts the same arguments as Executor: A command string with shell=True,
+    or a list of arguments, and keyword arguments for the subprocess (e.g. stdout, cwd, env).
+    '''
+    def __init__(self, cmd, kill_grace=5, **kwargs):
+        self.cmd = cmd
+        self.kill_grace = kill_grace
+        self.started = False
+        self.stopped = False
+        self.process = None
+        self.kwargs = kwargs
+        self._future = None
+        self._spawned = None
+        self._stop_requested = False
+        self._returncode = None
+
+    async def _spawn(self):
+        kwargs = dict(self.kwargs)
+        if kwargs.pop('shell', False):
+            return await asyncio.create_subprocess_shell(self.cmd, **kwargs)
+        cmd = [self.cmd] if isinstance(self.cmd, str) else self.cmd
+        return await asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+    async def _main(self):
+        self._spawned = asyncio.Event()
+        try:
+            self.process = await self._spawn()
+        except OSError as e: # E.g. command not found
+            self._returncode = 127
+            return self._returncode
+        finally:
+            self._spawned.set()
+            if self._stop_requested and self.process != None:
+                self.process.terminate()
+        self._returncode = await self.process.wait()
+        self.stopped = True
+        return self._returncode
+
+    async def _stop(self):
+        self._stop_requested = True
+        await self._spawned.wait()
+        if self.process != None and self.process.returncode == None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), self.kill_grace)
+            except asyncio.TimeoutError as e:
+                self.process.kill()
+                await self.process.wait()
+        self.stopped = True
+        return self._returncode if self._returncode != None else (self.process.returncode if self.process != None else 1)
+
+    # Run our command. Returns immediately after scheduling it on the event loop
+    def run(self):
+        if self.started:
+            raise RuntimeError('Executor already started. Make a new Executor for a new run')
+        if self.stopped:
+            raise RuntimeError('Executor already stopped. Make a new Executor for a new run')
+        self._stop_requested = False
+        self._future = asyncio.run_coroutine_threadsafe(self._main(), _get_loop())
+        self.started = True
+
+    # Run our command, waiting until it completes.
+    # Note: Some commands never return, be careful with this method!
+    def run_direct(self):
+        self.run()
+        return self.wait()
+
+    # Block until this executor is done. Returns exit status of the command
+    def wait(self):
+        if not self.started:
+            raise RuntimeError('Executor with command "{}" not yet started, cannot wait'.format(self.cmd))
+        return self._future.result()
+
+    # Force-stop executor, wait until done. Returns exit status of the command
+    def stop(self):
+        if self.started and not self.stopped:
+            return asyncio.run_coroutine_threadsafe(self._stop(), _get_loop()).result()
+        return self.process.returncode if self.process != None and self.process.returncode != None else 1
+
+    # Stop and then start wrapped command again
+    def reboot(self):
+        self.stop()
+        if self._future != None:
+            self._future.result()
+        self.started = False
+        self.stopped = False
+        self.process = None
+        self._returncode = None
+        self.run()
+
+    # Returns pid of running process, or -1 if it cannot access current process
+    def get_pid(self):
+        if (not self.started) or self.stopped or self.process == None:
+            return -1
+        return self.process.pid
+
+    # Function to run all given executors
+    @staticmethod
+    def run_all(*executors):
+        for x in executors:
+            x.run()
+
+    # Function to wait for all executors.
+    # If stop_on_error is True, we stop all remaining executors as soon as one fails
+    # Returns True if all processes sucessfully executed, False otherwise
+    @staticmethod
+    def wait_all(*executors, stop_on_error=True):
+        futures = [x._future for x in executors]
+        for future in concurrent.futures.as_completed(futures):
+            if future.result() != 0 and stop_on_error:
+                AsyncExecutor.stop_all(*executors)
+                return False
+        return all(x.result() == 0 for x in futures)
+
+    # Function to stop all given executors at the same time.
+    # Returns list of exit status codes
+    @staticmethod
+    def stop_all(*executors):
+        async def stop_all_internal():
+            return await asyncio.gather(*[x._stop() for x in executors if x.started and not x.stopped])
+        asyncio.run_coroutine_threadsafe(stop_all_internal(), _get_loop()).result()
+        return [x.stop() for x in executors]
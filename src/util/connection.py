@@ -0,0 +1,103 @@
+# In this file, we provide multiplexed SSH connections to remotes.
+# Every ssh/rsync call normally pays a full TCP and authentication handshake.
+# Using OpenSSH ControlMaster, the first call to a remote opens a control connection,
+# which later calls reuse. ControlPersist keeps it open for a while after the last call,
+# so successive MetaSpark invocations reuse it too.
+#
+# Use get(sshconfig) to get the connection for a config.SSHConfig.
+
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+
+import util.fs as fs
+from util.printer import *
+
+
+class Connection(object):
+    '''
+    Object to run commands on a single remote over a multiplexed SSH connection.
+    We remember how long every command took, see stats() and summary().
+    '''
+    def __init__(self, sshconfig, persist='10m'):
+        self.key_name = sshconfig.ssh_key_name
+        self.persist = persist
+        # Unix sockets have short path limits, so we let ssh hash the address (%C)
+        self.control_dir = fs.join(tempfile.gettempdir(), 'metaspark-ssh-{}'.format(os.getuid()))
+        fs.mkdir(self.control_dir, exist_ok=True)
+        os.chmod(self.control_dir, 0o700)
+        self._stats = []
+
+    # Returns ssh options to use the multiplexed connection, as a list
+    def options(self):
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPath={}'.format(fs.join(self.control_dir, '%C')),
+            '-o', 'ControlPersist={}'.format(self.persist)]
+
+    # Returns ssh command (without remote command) using the multiplexed connection, as a string
+    def ssh_command(self):
+        return ' '.join(['ssh']+[shlex.quote(x) for x in self.options()])
+
+    # Returns True if a control connection is open, False otherwise
+    def is_open(self):
+        return subprocess.call(['ssh']+self.options()+['-O', 'check', self.key_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+    # Run given local shell command, recording the time it took under given label.
+    # Returns exit status, like os.system
+    def _timed(self, label, command):
+        start = time.time()
+        status = os.system(command)
+        self._stats.append((label, time.time()-start, status))
+        return status
+
+    # Execute given command on the remote, in a shell on the remote.
+    # Optionally, redirect a local file to its stdin. Returns exit status, like os.system
+    def run(self, remote_command, stdin_file=None):
+        command = '{} {} {}'.format(self.ssh_command(), self.key_name, shlex.quote(remote_command))
+        if stdin_file != None:
+            command += ' < {}'.format(shlex.quote(stdin_file))
+        return self._timed('ssh {}'.format(remote_command), command)
+
+    # Sync given local path to given path on the remote using rsync, with extra rsync arguments.
+    # Returns exit status, like os.system
+    def rsync(self, local_path, remote_path, args=''):
+        command = 'rsync -e {} {} {} {}:{}'.format(shlex.quote(self.ssh_command()), args, local_path, self.key_name, remote_path)
+        return self._timed('rsync {} -> {}'.format(local_path, remote_path), command)
+
+    # Record a command that ran elsewhere, but used this connection (see ssh_command())
+    def record(self, label, seconds, status=0):
+        self._stats.append((label, seconds, status))
+
+    # Close the control connection
+    def close(self):
+        subprocess.call(['ssh']+self.options()+['-O', 'exit', self.key_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Returns list of (label, seconds, exit status) for every command we ran
+    def stats(self):
+        return list(self._stats)
+
+    # Returns a table of timings for every command we ran
+    def summary(self):
+        lines = ['Remote commands for "{}":'.format(self.key_name)]
+        for label, seconds, status in self._stats:
+            lines.append('{:>8.2f}s {:>4} {}'.format(seconds, status, label if len(label) <= 80 else label[:77]+'...'))
+        lines.append('{:>8.2f}s total for {} commands'.format(sum(x[1] for x in self._stats), len(self._stats)))
+        return '\n'.join(lines)
+
+
+_connections = dict()
+
+# Returns the connection for given SSHConfig, creating it if needed.
+# We keep one connection per remote
+def get(sshconfig):
+    if not sshconfig.ssh_key_name in _connections:
+        _connections[sshconfig.ssh_key_name] = Connection(sshconfig)
+    return _connections[sshconfig.ssh_key_name]
+
+
+# Returns all connections we made so far
+def connections():
+    return list(_connections.values())
@@ -1,21 +1,116 @@
+import collections
+import queue
 import subprocess
-import os
+import time
 import threading
-from util.lock import Synchronized
+from util.lock import Synchronized, read_locked, unsynchronized
+
+
+class OutputRing(object):
+    '''
+    Bounded buffer holding the last lines of output of a process.
+    When the total size of stored lines exceeds capacity bytes,
+    we drop the oldest lines.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.lines = collections.deque()
+        self.lock = threading.Lock()
+
+    # Store a line. Lines larger than capacity are cut to their last capacity bytes
+    def append(self, line):
+        line = line[-self.capacity:]
+        with self.lock:
+            self.lines.append(line)
+            self.size += len(line)
+            while self.size > self.capacity:
+                self.size -= len(self.lines.popleft())
+
+    # Returns all stored lines, oldest first
+    def get(self):
+        with self.lock:
+            return list(self.lines)
+
+
+# Returns a stream callback printing every line, prefixed with its tag
+def print_stream(tag, name, line):
+    print('[{}] {}'.format(tag, line) if name == 'stdout' else '[{}:{}] {}'.format(tag, name, line), flush=True)
+
 
 class Executor(Synchronized):
     '''
     Object to run subprocess commands in a separate thread.
     This way, Python can continue operating while interacting 
     with subprocesses.
+
+    Optionally, we read output of the command line by line:
+     - stream: Callable, called as stream(tag, name, line) for every line,
+       with name 'stdout' or 'stderr'. Use stream=True to get lines from lines() instead.
+     - tag: Tag to pass along with every line, e.g. the gid of the node.
+     - capture_kb: Keep the last capture_kb KB of output, which tail() returns.
+    Reading output needs pipes, so stream and capture_kb cannot be combined with a stdout or stderr redirect.
+    stop() kills the command if it does not exit within kill_grace seconds after terminating it.
     '''
-    def __init__(self, cmd, **kwargs):
+    def __init__(self, cmd, stream=None, tag=None, capture_kb=None, kill_grace=5, **kwargs):
         self.cmd = cmd
+        self.kill_grace = kill_grace
         self.started = False
         self.stopped = False
         self.thread = None
         self.process = None
+        self.launched = threading.Event() # Set once we tried to start the process
         self.kwargs = kwargs
+        self.stream = stream
+        self.tag = tag
+        self.ring = OutputRing(capture_kb*1024) if capture_kb != None else None
+        self.queue = queue.Queue() if stream == True else None
+        self.readers = []
+        if stream != None or capture_kb != None:
+            redirected = [x for x in ('stdout', 'stderr') if kwargs.get(x) != None]
+            if len(redirected) > 0:
+                raise ValueError('Executor cannot read output of "{}" which is redirected ({}). Pass stream/capture_kb or a redirect, not both'.format(cmd, ', '.join(redirected)))
+            self.kwargs['stdout'] = subprocess.PIPE
+            self.kwargs['stderr'] = subprocess.PIPE
+
+    # Start a thread for each output pipe of our process, handling its lines
+    def _start_readers(self, process):
+        callback = self.stream if callable(self.stream) else None
+        ring = self.ring
+        lines = self.queue
+        tag = self.tag
+
+        def reader(name, pipe):
+            with pipe:
+                for raw in iter(pipe.readline, b''):
+                    line = raw.decode('utf-8', errors='replace').rstrip('\n')
+                    if ring != None:
+                        ring.append('[{}] {}'.format(name, line))
+                    if callback != None:
+                        callback(tag, name, line)
+                    if lines != None:
+                        lines.put((tag, name, line))
+
+        self.readers = [threading.Thread(target=reader, args=(name, pipe), daemon=True) for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr)) if pipe != None]
+        for x in self.readers:
+            x.start()
+
+    # Run our command, returning after it completed and we handled all of its output
+    def _execute(self):
+        try:
+            self.process = subprocess.Popen(self.cmd, **self.kwargs)
+        finally:
+            self.launched.set()
+        if self.stream != None or self.ring != None:
+            self._start_readers(self.process)
+            self.process.wait()
+            for x in self.readers:
+                x.join()
+        else:
+            self.process.communicate()
+        if self.queue != None:
+            self.queue.put(None) # Marks end of output for lines()
+        self.stopped = True
 
     # Run our command. Returns immediately after booting a thread
     def run(self):
@@ -23,28 +118,20 @@ class Executor(Synchronized):
             raise RuntimeError('Executor already started. Make a new Executor for a new run')
         if self.stopped:
             raise RuntimeError('Executor already stopped. Make a new Executor for a new run')
-        if self.kwargs == None:
-            self.kwargs = kwargs
-
-        def target(**kwargs):
-            self.process = subprocess.Popen(self.cmd, **kwargs)
-            self.process.communicate()
-            self.stopped = True
-
-        self.thread = threading.Thread(target=target, kwargs=self.kwargs)
+        self.thread = threading.Thread(target=self._execute)
         self.thread.start()
         self.started = True
 
     # Run our command on this thread, waiting until it completes.
     # Note: Some commands never return, be careful with this method!
+    @unsynchronized
     def run_direct(self):
-        self.process = subprocess.Popen(self.cmd, **self.kwargs)
         self.started = True
-        self.process.communicate()
-        self.stopped = True
+        self._execute()
         return self.process.returncode
 
     # Block until this executor is done
+    @unsynchronized
     def wait(self):
         if not self.started:
             raise RuntimeError('Executor with command "{}" not yet started, cannot wait'.format(self.cmd))
@@ -53,6 +140,26 @@ class Executor(Synchronized):
         self.thread.join()
         return self.process.returncode
 
+    # Yields (tag, name, line) for every line of output, until the command completes.
+    # Only available when constructed with stream=True
+    @unsynchronized
+    def lines(self):
+        if self.queue == None:
+            raise RuntimeError('Executor with command "{}" does not stream lines. Construct it with stream=True'.format(self.cmd))
+        while True:
+            item = self.queue.get()
+            if item == None:
+                self.queue.put(None) # Let other consumers see the end too
+                return
+            yield item
+
+    # Returns the last output lines we captured (see capture_kb) as a single string
+    @unsynchronized
+    def tail(self):
+        if self.ring == None:
+            return ''
+        return '\n'.join(self.ring.get())
+
     #  Function to run all given executors, with same arguments
     @staticmethod
     def run_all(*executors):
@@ -70,7 +177,7 @@ class Executor(Synchronized):
         for x in executors:
             if x.wait() != 0:
                 if stop_on_error: # We had an error during execution and must stop all now
-                    Executor.stop_all(executors) # Stop all other executors
+                    Executor.stop_all(*executors) # Stop all other executors
                     return False
                 else:
                     status = False
@@ -80,26 +187,27 @@ class Executor(Synchronized):
     # If as_generator is True, we return exit status codes as a generator  
     @staticmethod
     def stop_all(*executors, as_generator=False):
-        for x in executors:
-            if as_generator:
-                yield x.stop()
-            else:
-                x.stop()
+        if as_generator:
+            return (x.stop() for x in executors)
+        return [x.stop() for x in executors]
 
-    # Force-stop executor, wait until done
+    # Force-stop executor, wait until done.
+    # We terminate the process, and kill it if it does not exit within kill_grace seconds.
+    # Waiting takes no lock, so other methods of this executor (e.g. get_pid) do not stall meanwhile
+    @unsynchronized
     def stop(self):
-        if self.started and not self.stopped:
-            if self.thread.is_alive():
-                #If command fails, or when stopping directly after starting
-                for x in range(5):
-                    if self.process == None:
-                        time.sleep(1)
-                    else:
-                        break
-                if self.process != None:
-                    self.process.terminate()
-                self.thread.join()
-                self.stopped = True
+        if self.started and not self.stopped and self.thread != None:
+            self.launched.wait(timeout=self.kill_grace) # When stopping directly after starting, the process may not exist yet
+            process = self.process
+            if process != None and process.poll() == None:
+                process.terminate()
+                try:
+                    process.wait(timeout=self.kill_grace)
+                except subprocess.TimeoutExpired as e:
+                    process.kill()
+                    process.wait()
+            self.thread.join()
+            self.stopped = True
         return self.process.returncode if self.process != None else 1
 
     # Stop and then start wrapped command again
@@ -108,10 +216,171 @@ class Executor(Synchronized):
         self.stop()
         self.started = False
         self.stopped = False
-        self.run(**self.kwargs)
+        self.launched = threading.Event()
+        if self.queue != None:
+            self.queue = queue.Queue()
+        self.run()
 
     # Returns pid of running process, or -1 if it cannot access current process 
+    @read_locked
     def get_pid(self):
         if (not self.started) or self.stopped or self.process == None:
             return -1
-        return self.process.pid
\ No newline at end of file
+        return self.process.pid
+
+class ExecutorTask(object):
+    '''
+    A single command, run by an ExecutorPool.
+    After completion, returncode holds the exit status of the command.
+    timed_out is True if we killed it for running too long,
+    cancelled is True if it never ran or was stopped because another task failed.
+    '''
+    def __init__(self, index, cmd, timeout, kwargs):
+        self.index = index
+        self.cmd = cmd
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.process = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+        self.timed_out = False
+        self.cancelled = False
+
+    # Returns True if this task completed with exit status 0, False otherwise
+    def success(self):
+        return self.returncode == 0 and not (self.timed_out or self.cancelled)
+
+    # Returns amount of seconds this task ran, or None if it never started
+    def duration(self):
+        if self.start_time == None:
+            return None
+        return (self.end_time if self.end_time != None else time.monotonic()) - self.start_time
+
+
+class ExecutorPool(object):
+    '''
+    Object to run many subprocess commands, with at most max_concurrent at a time.
+    All processes are managed from the thread iterating as_completed(),
+    so we need no thread per process. Terminating a process never blocks that thread:
+    the poll loop kills processes which do not exit within kill_grace seconds.
+    Results come in order of completion, so failures are seen as soon as they happen.
+    If stop_on_error is True, the first failing task stops all running tasks,
+    and cancels all tasks that did not start yet.
+    '''
+    def __init__(self, max_concurrent=16, stop_on_error=True, poll_interval=0.01, kill_grace=5):
+        if max_concurrent < 1:
+            raise ValueError('ExecutorPool needs max_concurrent >= 1, got {}'.format(max_concurrent))
+        self.max_concurrent = max_concurrent
+        self.stop_on_error = stop_on_error
+        self.poll_interval = poll_interval
+        self.kill_grace = kill_grace
+        self.tasks = []
+        self._pending = []
+        self._running = []
+        self._stopping = [] # (task, deadline) of terminated tasks, which did not exit yet
+
+    # Add a command to run, with optional timeout in seconds, and arguments for subprocess.Popen.
+    # Returns the ExecutorTask for this command
+    def submit(self, cmd, timeout=None, **kwargs):
+        task = ExecutorTask(len(self.tasks), cmd, timeout, kwargs)
+        self.tasks.append(task)
+        self._pending.append(task)
+        return task
+
+    def _launch(self, task):
+        task.start_time = time.monotonic()
+        try:
+            task.process = subprocess.Popen(task.cmd, **task.kwargs)
+        except OSError as e: # E.g. command not found
+            task.returncode = 127
+            task.end_time = time.monotonic()
+            return False
+        self._running.append(task)
+        return True
+
+    # Ask process of given task to terminate, without waiting for it.
+    # _reap() kills it if it does not exit within kill_grace seconds
+    def _terminate(self, task):
+        if task.process.poll() == None:
+            task.process.terminate()
+        self._stopping.append((task, time.monotonic()+self.kill_grace))
+
+    # Check on terminated tasks, killing the ones exceeding their grace period.
+    # Returns the tasks which exited
+    def _reap(self):
+        now = time.monotonic()
+        exited = []
+        for item in list(self._stopping):
+            task, deadline = item
+            if task.process.poll() != None:
+                task.returncode = task.process.returncode
+                task.end_time = now
+                self._stopping.remove(item)
+                exited.append(task)
+            elif now > deadline:
+                task.process.kill()
+        return exited
+
+    # Stop all running tasks and cancel all pending tasks.
+    # Returns once all processes exited, which takes at most kill_grace seconds
+    def stop(self):
+        for task in self._running:
+            task.cancelled = True
+            self._terminate(task)
+        for task in self._pending:
+            task.cancelled = True
+        self._running = []
+        self._pending = []
+        while len(self._stopping) > 0:
+            if len(self._reap()) == 0:
+                time.sleep(self.poll_interval)
+
+    # Run all submitted tasks, yielding every ExecutorTask when it completes.
+    # Tasks exceeding their timeout complete once their process exited.
+    # With stop_on_error, we stop after yielding the tasks which completed together with the first failed task
+    def as_completed(self):
+        delay = self.poll_interval
+        try:
+            while len(self._pending) > 0 or len(self._running) > 0 or len(self._stopping) > 0:
+                done = self._reap()
+                while len(self._pending) > 0 and len(self._running) < self.max_concurrent:
+                    task = self._pending.pop(0)
+                    if not self._launch(task):
+                        done.append(task)
+
+                now = time.monotonic()
+                for task in list(self._running):
+                    if task.process.poll() != None:
+                        task.returncode = task.process.returncode
+                        task.end_time = now
+                    elif task.timeout != None and now - task.start_time > task.timeout:
+                        task.timed_out = True
+                        self._terminate(task) # _reap() hands it to us once it exited
+                        self._running.remove(task)
+                        continue
+                    else:
+                        continue
+                    self._running.remove(task)
+                    done.append(task)
+
+                for task in done:
+                    yield task
+                if self.stop_on_error and any(not x.success() for x in done):
+                    self.stop()
+                    return
+                if len(done) > 0:
+                    delay = self.poll_interval
+                else: # Nothing happened, so we back off a little to save cpu time
+                    time.sleep(delay)
+                    delay = min(delay*2, 10*self.poll_interval)
+        finally: # Never leave processes behind, also not when our caller stops iterating
+            self.stop()
+
+    # Run all submitted tasks to completion.
+    # Returns True if all tasks succeeded, False otherwise
+    def run_all(self):
+        status = True
+        for task in self.as_completed():
+            status = status and task.success()
+        return status and all(x.success() for x in self.tasks)
@@ -0,0 +1,226 @@
+# In this file, we provide incremental, content-addressed exports of a directory tree.
+# We keep a local manifest with the size, mtime and hash of every file we exported to a target.
+# On the next export, we only send files with different content, all in one batched transfer.
+# Files with an unchanged size and mtime are not hashed again, so exports hardly touch deps/.
+#
+# The manifest only describes what we sent, not what the target still has. So every export
+# leaves a marker file with a random export id in the target, which we also store in the manifest.
+# If the target lost the marker (e.g. it was wiped, or is a new machine behind the same name),
+# we do not trust the manifest, and send everything.
+#
+# A target is either 'host:path' (rsync over ssh) or a local directory path.
+
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+
+import util.fs as fs
+from util.printer import *
+
+# Extensions of files which are compressed already. Compressing them again only costs time
+compressed_extensions = ['tgz', 'gz', 'jar', 'zip', 'bz2', 'xz', 'zst', '7z', 'png', 'jpg', 'pdf']
+
+# Name of the marker file holding the id of the last export in a target
+_marker_file = '.metaspark_export'
+
+
+class ExportReport(object):
+    '''Object summarizing a single export.'''
+    def __init__(self, scanned, sent, payload_bytes, wire_bytes, seconds):
+        self.scanned = scanned             # Amount of files we looked at
+        self.sent = sent                   # Amount of files we sent
+        self.payload_bytes = payload_bytes # Total size of files we sent
+        self.wire_bytes = wire_bytes       # Bytes actually transferred (None if unknown)
+        self.seconds = seconds             # Time taken for the whole export
+
+    def __str__(self):
+        wire = ', {} on the wire'.format(_human(self.wire_bytes)) if self.wire_bytes != None else ''
+        return 'Sent {}/{} files ({}{}) in {:.2f} seconds'.format(self.sent, self.scanned, _human(self.payload_bytes), wire, self.seconds)
+
+
+# Returns a human readable string for given amount of bytes
+def _human(amount):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if amount < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(amount, unit) if unit != 'B' else '{} B'.format(amount)
+        amount /= 1024.0
+
+
+# Returns True if given relative path matches any of given exclude names.
+# Like rsync --exclude NAME, a name matches any path component
+def _excluded(relpath, excludes):
+    return any(part in excludes for part in relpath.split(os.sep))
+
+
+# Walk given source directory, returning relative paths of all files which are not excluded
+def _walk(src, excludes):
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dirs[:] = sorted(x for x in dirs if not x in excludes)
+        for name in sorted(files):
+            relpath = os.path.normpath(fs.join(rel_root, name))
+            if not _excluded(relpath, excludes):
+                yield relpath
+
+
+# Load manifest for given target from given manifest file.
+# Returns the id of the export it describes (None if unknown), and a dict mapping relative path to [size, mtime, hash]
+def _load_manifest(manifest_path, target):
+    if not fs.isfile(manifest_path):
+        return None, dict()
+    try:
+        with open(manifest_path, 'r') as file:
+            entry = json.load(file).get(target, dict())
+    except ValueError as e: # Corrupt manifest, so we export everything again
+        return None, dict()
+    if not 'files' in entry: # Manifest of an older version, without export id
+        return None, dict()
+    return entry['id'], entry['files']
+
+
+# Store manifest with given export id for given target in given manifest file, atomically
+def _store_manifest(manifest_path, target, export_id, manifest):
+    everything = dict()
+    if fs.isfile(manifest_path):
+        try:
+            with open(manifest_path, 'r') as file:
+                everything = json.load(file)
+        except ValueError as e:
+            pass
+    everything[target] = {'id': export_id, 'files': manifest}
+    tmp = manifest_path+'.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(everything, file)
+    fs.mv(tmp, manifest_path)
+
+
+# Compare given source directory with what we last exported to target.
+# Returns the manifest of the source directory as it is now, and a list of relative paths that changed
+def scan(src, manifest_path, target, excludes=[]):
+    previous = _load_manifest(manifest_path, target)[1]
+    current = dict()
+    changed = []
+    for relpath in _walk(src, set(excludes)):
+        stat = os.stat(fs.join(src, relpath))
+        old = previous.get(relpath)
+        if old != None and old[0] == stat.st_size and old[1] == stat.st_mtime:
+            digest = old[2] # Unchanged size and mtime, trust the hash we have
+        else:
+            digest = fs.digest(fs.join(src, relpath))
+        current[relpath] = [stat.st_size, stat.st_mtime, digest]
+        if old == None or old[2] != digest:
+            changed.append(relpath)
+    return current, changed
+
+
+# Copy given relative paths from source directory to local target directory.
+# Returns amount of bytes copied
+def _send_local(src, target, relpaths):
+    total = 0
+    for relpath in relpaths:
+        dst = fs.join(target, relpath)
+        fs.mkdir(fs.dirname(dst), exist_ok=True)
+        shutil.copy2(fs.join(src, relpath), dst)
+        total += fs.sizeof(dst)
+    return total
+
+
+# Send given relative paths from source directory to remote target in one rsync call.
+# rsh optionally is the ssh command for rsync to use (rsync -e).
+# Returns amount of bytes rsync sent over the wire, or None if we could not tell.
+# Raises RuntimeError if rsync fails
+def _send_remote(src, target, relpaths, rsh=None):
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.files') as filelist:
+        filelist.write('\n'.join(relpaths)+'\n')
+        filelist.flush()
+        command = ['rsync', '-az', '--stats', '--skip-compress='+'/'.join(compressed_extensions), '--files-from='+filelist.name, src+'/', target+'/']
+        if rsh != None:
+            command[1:1] = ['-e', rsh]
+        process = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('rsync exited with status {}'.format(process.returncode))
+    for line in process.stdout.splitlines():
+        if line.startswith('Total bytes sent:'):
+            return int(line.split(':', 1)[1].strip().replace(',', ''))
+    return None
+
+
+# Run given shell command in the directory of given remote target ('host:path'), using given ssh command (default: ssh).
+# Returns the completed subprocess, with its stdout
+def _run_remote(target, command, rsh=None):
+    host, path = target.split(':', 1)
+    remote_command = 'mkdir -p {0} && cd {0} && {1}'.format(shlex.quote(path), command)
+    return subprocess.run(shlex.split(rsh if rsh != None else 'ssh')+[host, remote_command], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+
+
+# Returns the export id in the marker file of given target, or None if it has none
+def _read_marker(target, rsh=None):
+    if ':' in target:
+        process = _run_remote(target, 'cat {} 2>/dev/null || true'.format(_marker_file), rsh=rsh)
+        marker = process.stdout.strip() if process.returncode == 0 else ''
+    elif fs.isfile(target, _marker_file):
+        with open(fs.join(target, _marker_file), 'r') as file:
+            marker = file.read().strip()
+    else:
+        marker = ''
+    return marker if len(marker) > 0 else None
+
+
+# Write given export id to the marker file of given target. Returns True on success, False otherwise
+def _write_marker(target, export_id, rsh=None):
+    if ':' in target:
+        return _run_remote(target, 'echo {} > {}'.format(export_id, _marker_file), rsh=rsh).returncode == 0
+    try:
+        fs.mkdir(target, exist_ok=True)
+        with open(fs.join(target, _marker_file), 'w') as file:
+            file.write(export_id+'\n')
+        return True
+    except OSError as e:
+        return False
+
+
+# Export given source directory to given target, sending only files whose content changed since the last export.
+# With fresh=True, we forget what we exported before, and send everything.
+# We do the same if the target does not hold the export our manifest describes.
+# rsh optionally is the ssh command to use for remote targets.
+# Returns an ExportReport. Raises RuntimeError if the transfer fails, in which case we forget the manifest,
+# because we cannot tell which files reached the target
+def export(src, target, manifest_path, excludes=[], fresh=False, rsh=None):
+    start = time.time()
+    export_id = _load_manifest(manifest_path, target)[0]
+    if not fresh and export_id == None: # We never completed an export to this target
+        fresh = True
+    elif not fresh and _read_marker(target, rsh=rsh) != export_id:
+        print('Target {} does not hold our last export, sending all files'.format(target))
+        fresh = True
+    if fresh:
+        _store_manifest(manifest_path, target, None, dict())
+    current, changed = scan(src, manifest_path, target, excludes=excludes)
+    payload = sum(current[x][0] for x in changed)
+    wire = 0
+    try:
+        if len(changed) > 0:
+            if ':' in target:
+                wire = _send_remote(src, target, changed, rsh=rsh)
+            else:
+                wire = _send_local(src, target, changed)
+    except (RuntimeError, OSError) as e:
+        _store_manifest(manifest_path, target, None, dict())
+        raise RuntimeError(str(e))
+    # Keep entries of excluded files, so a fast export does not forget what a full export sent
+    previous = _load_manifest(manifest_path, target)[1]
+    previous.update(current)
+    for relpath in [x for x in previous if not x in current and not _excluded(x, set(excludes))]:
+        del previous[relpath] # File was removed locally
+    if fresh or export_id == None:
+        export_id = uuid.uuid4().hex
+    if not _write_marker(target, export_id, rsh=rsh):
+        printw('Could not write export marker to {}, next export sends all files again'.format(target))
+        export_id = None
+    _store_manifest(manifest_path, target, export_id, previous)
+    return ExportReport(len(current), len(changed), payload, wire, time.time()-start)
@@ -4,6 +4,7 @@
 # This mainly is a wrapper around the system's os libraries.
 # Quite a few handy tricks are stored here.
 
+import hashlib
 import os
 import shutil
 import sys
@@ -33,6 +34,14 @@ def cwd():
 def dirname(path):
     return os.path.dirname(path)
 
+# Returns hex digest of the file at given path, with given hashlib algorithm, reading it in chunks
+def digest(path, algorithm='sha1', chunk_size=1024*1024):
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
 def exists(path, *args):
     return os.path.exists(join(path,*args))
 
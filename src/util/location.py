@@ -9,6 +9,9 @@ from config.meta import cfg_meta_instance as metacfg
 def get_metaspark_dep_dir():
     return fs.join(fs.abspath(), 'deps')
 
+def get_metaspark_artifact_dir():
+    return fs.join(get_metaspark_dep_dir(), 'artifacts')
+
 def get_metaspark_experiment_dir():
     return fs.join(fs.abspath(), 'experiments')
 
@@ -18,6 +21,9 @@ def get_metaspark_results_dir():
 def get_metaspark_logs_dir():
     return fs.join(fs.abspath(), 'logs')
 
+def get_metaspark_boot_logs_dir():
+    return fs.join(get_metaspark_logs_dir(), 'boot')
+
 def get_metaspark_conf_dir():
     return fs.join(fs.abspath(), 'conf')
 
@@ -30,21 +36,38 @@ def get_metaspark_log4j_conf_dir():
 def get_metaspark_jar_dir():
     return fs.join(fs.abspath(), 'jars')
 
+def get_metaspark_cluster_state_file():
+    return fs.join(fs.abspath(), '.cluster_state.json')
+
+def get_metaspark_export_manifest_file():
+    return fs.join(fs.abspath(), '.export_manifest.json')
+
 #################### Spark directories ####################
-def get_spark_dir():
-    return fs.join(get_metaspark_dep_dir(), 'spark')
+# Spark versions are installed side by side, as deps/spark-<version>-bin-<build>.
+# Functions below use the default version and build when none is given
+default_spark_version = '3.0.1'
+default_spark_build = 'hadoop2.7'
+
+def get_spark_dir(version=None, build=None):
+    version = version if version != None else default_spark_version
+    build = build if build != None else default_spark_build
+    versioned = fs.join(get_metaspark_dep_dir(), 'spark-{}-bin-{}'.format(version, build))
+    legacy = fs.join(get_metaspark_dep_dir(), 'spark') # Where we installed the default version before
+    if version == default_spark_version and build == default_spark_build and fs.isdir(legacy) and not fs.isdir(versioned):
+        return legacy
+    return versioned
 
-def get_spark_bin_dir():
-    return fs.join(get_spark_dir(), 'bin')
+def get_spark_bin_dir(version=None, build=None):
+    return fs.join(get_spark_dir(version, build), 'bin')
 
-def get_spark_sbin_dir():
-    return fs.join(get_spark_dir(), 'sbin')
+def get_spark_sbin_dir(version=None, build=None):
+    return fs.join(get_spark_dir(version, build), 'sbin')
 
-def get_spark_conf_dir():
-    return fs.join(get_spark_dir(), 'conf')
+def get_spark_conf_dir(version=None, build=None):
+    return fs.join(get_spark_dir(version, build), 'conf')
 
-def get_spark_logs_dir():
-    return fs.join(get_spark_dir(), 'logs')
+def get_spark_logs_dir(version=None, build=None):
+    return fs.join(get_spark_dir(version, build), 'logs')
 
 #################### Remote directories ####################
 def get_remote_metaspark_parent_dir():
@@ -57,4 +80,8 @@ def get_remote_metaspark_dir():
 #################### Node directories ####################
 # Because we  will use client logging using plan 2, this should change
 def get_node_local_dir():
-    return '/local/{}/'.format(metacfg.ssh.ssh_user_name)
\ No newline at end of file
+    return '/local/{}/'.format(metacfg.ssh.ssh_user_name)
+
+# Staged copies of Spark and jars on node-local disk (see remote.util.staging)
+def get_node_stage_dir():
+    return fs.join(get_node_local_dir(), 'stage')
\ No newline at end of file
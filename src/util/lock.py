@@ -1,6 +1,8 @@
 # File which provides Java-style class locking
 
 
+import threading
+import types
 from functools import wraps
 from threading import Lock
 
@@ -14,13 +16,133 @@ def synchronized(lock):
     return wrapper
 
 
+class RWLock(object):
+    '''
+    Reentrant readers-writer lock.
+    Many threads may hold the read lock at the same time, one thread may hold the write lock.
+    The writer may acquire the write lock and read lock again while holding it.
+    Upgrading a read lock to a write lock would deadlock, so it raises a RuntimeError.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition(Lock())
+        self.readers = dict() # Maps thread ident to amount of read locks held
+        self.writer = None
+        self.writer_depth = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self.condition:
+            while self.writer != None and self.writer != me:
+                self.condition.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self.condition:
+            count = self.readers.get(me, 0)
+            if count == 0:
+                raise RuntimeError('Cannot release a read lock we do not hold')
+            if count == 1:
+                del self.readers[me]
+                self.condition.notify_all()
+            else:
+                self.readers[me] = count - 1
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.writer_depth += 1
+                return
+            if me in self.readers:
+                raise RuntimeError('Cannot upgrade a read lock to a write lock')
+            while self.writer != None or len(self.readers) > 0:
+                self.condition.wait()
+            self.writer = me
+            self.writer_depth = 1
+
+    def release_write(self):
+        with self.condition:
+            if self.writer != threading.get_ident():
+                raise RuntimeError('Cannot release a write lock we do not hold')
+            self.writer_depth -= 1
+            if self.writer_depth == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    # Context manager holding the read lock
+    def read(self):
+        return _Held(self.acquire_read, self.release_read)
+
+    # Context manager holding the write lock
+    def write(self):
+        return _Held(self.acquire_write, self.release_write)
+
+
+class _Held(object):
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+_creation_lock = Lock()
+
+# Returns the RWLock of given object, creating it if needed
+def lock_of(obj):
+    lock = obj.__dict__.get('_rwlock')
+    if lock == None:
+        with _creation_lock:
+            lock = obj.__dict__.setdefault('_rwlock', RWLock())
+    return lock
+
+
+# Decorator for methods which may run concurrently with other read_locked methods of the same object,
+# but never with write_locked methods of it
+def read_locked(f):
+    @wraps(f)
+    def inner_wrapper(self, *args, **kwargs):
+        with lock_of(self).read():
+            return f(self, *args, **kwargs)
+    inner_wrapper._locked = True
+    return inner_wrapper
+
+
+# Decorator for methods which may not run concurrently with any other locked method of the same object
+def write_locked(f):
+    @wraps(f)
+    def inner_wrapper(self, *args, **kwargs):
+        with lock_of(self).write():
+            return f(self, *args, **kwargs)
+    inner_wrapper._locked = True
+    return inner_wrapper
+
+
+# Decorator for methods of Synchronized classes which must not take the lock,
+# e.g. because they block for a long time
+def unsynchronized(f):
+    f._unsynchronized = True
+    return f
+
+
 # Make object-level lock (no 2 functions of object may run concurrently)
+# Every object has its own reentrant lock, so objects never block each other.
+# Public methods are write_locked, unless decorated with read_locked or unsynchronized.
+# Private methods (starting with '_'), static methods and class methods are not locked.
 # Usage:
 #     class <name>(Synchronized):...
 class Synchronized:
     def __init_subclass__(cls, **kwargs):
-        synchronizer = synchronized(Lock())
-        for name in cls.__dict__:
-            attr = getattr(cls, name)
-            if callable(attr):
-                setattr(cls, name, synchronized(attr))
\ No newline at end of file
+        super().__init_subclass__(**kwargs)
+        for name, attr in list(cls.__dict__.items()):
+            if not isinstance(attr, types.FunctionType) or name.startswith('_'):
+                continue
+            if getattr(attr, '_locked', False) or getattr(attr, '_unsynchronized', False):
+                continue
+            setattr(cls, name, write_locked(attr))
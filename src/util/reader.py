@@ -1,39 +1,139 @@
+import mmap
 import os
+import re
 
-'''
-Credits to srohde and Mark Amery: https://stackoverflow.com/a/23646049
-Note: This technically is incorrect for text files,
-but only when using encodings s.t. seek() and read() 
-return different numbers (e.g. utf-16)
-'''
-def reverse_readline(filename, buf_size=8192):
-    """A generator that returns the lines of a file in reverse order"""
-    with open(filename) as fh:
-        segment = None
-        offset = 0
-        fh.seek(0, os.SEEK_END)
-        file_size = remaining_size = fh.tell()
-        while remaining_size > 0:
-            offset = min(file_size, offset + buf_size)
-            fh.seek(file_size - offset)
-            buffer = fh.read(min(remaining_size, buf_size))
-            remaining_size -= buf_size
-            lines = buffer.split('\n')
-            # The first line of the buffer is probably not a complete line so
-            # we'll save it and append it to the last line of the next buffer
-            # we read
-            if segment is not None:
-                # If the previous chunk starts right from the beginning of line
-                # do not concat the segment to the last line of new chunk.
-                # Instead, yield the segment first 
-                if buffer[-1] != '\n':
-                    lines[-1] += segment
-                else:
-                    yield segment
-            segment = lines[0]
-            for index in range(len(lines) - 1, 0, -1):
-                if lines[index]:
-                    yield lines[index]
-        # Don't yield None if the file was empty
-        if segment is not None:
-            yield segment
\ No newline at end of file
+def reverse_readline(filename, buf_size=None, encoding='utf-8'):
+    """
+    A generator that returns the non-empty lines of a file in reverse order.
+    buf_size is deprecated and ignored: We memory-map the file instead of reading buf_size bytes at a time.
+    """
+    for line in reverse_readline_bytes(filename):
+        if line:
+            yield line.decode(encoding, errors='replace')
+
+
+# Yields all lines of given mmap or bytes object in reverse order, as bytes without newline,
+# splitting chunk_size bytes at a time. An empty last line (after the final newline) is not yielded
+def _reverse_lines(data, chunk_size):
+    hi = len(data)
+    if hi == 0:
+        return
+    if data[hi-1:hi] == b'\n':
+        hi -= 1
+    remainder = b'' # Start of the line which continues in the chunk we handled before
+    while hi > 0:
+        lo = max(0, hi - chunk_size)
+        lines = data[lo:hi].split(b'\n')
+        lines[-1] += remainder
+        remainder = lines[0]
+        yield from reversed(lines[1:])
+        hi = lo
+    yield remainder
+
+
+def reverse_readline_bytes(filename, chunk_size=1024*1024):
+    """
+    A generator that returns the lines of a file in reverse order, as bytes without newline.
+    We memory-map the file and split chunk_size bytes at a time, without decoding.
+    Correct for any encoding using a single-byte newline (e.g. utf-8, latin-1), decode lines yourself.
+    """
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from _reverse_lines(mm, chunk_size)
+
+
+def forward_readline_bytes(filename, chunk_size=1024*1024):
+    """
+    A generator that returns the lines of a file in order, as bytes without newline,
+    reading chunk_size bytes at a time.
+    """
+    with open(filename, 'rb', buffering=0) as fh:
+        remainder = b''
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n') if remainder else chunk.split(b'\n')
+            remainder = lines.pop()
+            yield from lines
+        if remainder:
+            yield remainder
+
+
+# Returns paths of a rolled log set (e.g. spark.log, spark.log.1, spark.log.2, ...), newest first.
+# This is how log4j RollingFileAppender names its backups
+def rolled_logs(path):
+    paths = [path] if os.path.isfile(path) else []
+    idx = 1
+    while os.path.isfile('{}.{}'.format(path, idx)):
+        paths.append('{}.{}'.format(path, idx))
+        idx += 1
+    return paths
+
+
+# Returns a compiled bytes regex for given pattern (str, bytes or compiled regex)
+def _compile(pattern):
+    if isinstance(pattern, str):
+        pattern = pattern.encode('utf-8')
+    if isinstance(pattern, bytes):
+        return re.compile(pattern, re.MULTILINE)
+    return pattern
+
+
+# Yields (start, end) of lines with a match of given compiled pattern in data[lo:hi], last line first.
+# Searches chunks of about chunk_size bytes from the end, each with a single regex scan
+def _reverse_matches(data, regex, chunk_size):
+    hi = len(data)
+    while hi > 0:
+        lo = max(0, hi - chunk_size)
+        if lo > 0:
+            lo = data.rfind(b'\n', 0, lo) + 1 # Align to the start of a line
+        chunk = data[lo:hi]
+        found = []
+        last_start = -1
+        for match in regex.finditer(chunk):
+            start = chunk.rfind(b'\n', 0, match.start()) + 1
+            if start == last_start:
+                continue # Another match on the same line
+            end = chunk.find(b'\n', match.end())
+            found.append((lo+start, lo+(end if end != -1 else len(chunk))))
+            last_start = start
+        yield from reversed(found)
+        hi = lo
+
+
+def grep_last(path, pattern, amount=10, chunk_size=4*1024*1024, rolled=True):
+    """
+    Returns the last amount lines matching pattern (str, bytes or compiled bytes regex),
+    across a rolled log set if rolled is True, as a list of (path, line) in chronological order.
+    Patterns match within lines. Lines are decoded as utf-8.
+    """
+    regex = _compile(pattern)
+    found = []
+    for logpath in (rolled_logs(path) if rolled else [path]):
+        with open(logpath, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for start, end in _reverse_matches(mm, regex, chunk_size):
+                    found.append((logpath, mm[start:end].decode('utf-8', errors='replace')))
+                    if len(found) >= amount:
+                        return list(reversed(found))
+    return list(reversed(found))
+
+
+def tail(path, amount=10, rolled=True):
+    """
+    Returns the last amount lines of a log file, continuing into older files
+    of a rolled log set if rolled is True, as a list of (path, line) in chronological order.
+    Lines are decoded as utf-8.
+    """
+    found = []
+    for logpath in (rolled_logs(path) if rolled else [path]):
+        for line in reverse_readline_bytes(logpath, chunk_size=64*1024):
+            found.append((logpath, line.decode('utf-8', errors='replace')))
+            if len(found) >= amount:
+                return list(reversed(found))
+    return list(reversed(found))
@@ -1,20 +1,106 @@
+import random
 import threading
+import time
 
-class Repeater(threading.Thread):
-    '''Simple object to repeat actions on a separate thread, every period seconds'''
-    def __init__(self, func, period):
+class Cadence(object):
+    '''
+    Timing and metrics of an action repeated every period seconds.
+    Shared by Repeater and util.scheduler.ScheduledTask, so both plan runs and count overruns the same way.
+    See Repeater for the meaning of mode, overrun and jitter.
+    '''
+    def __init__(self, period, mode='delay', overrun='skip', jitter=0.0):
+        if not mode in ('delay', 'rate'):
+            raise ValueError('Unknown mode "{}", pick "delay" or "rate"'.format(mode))
+        if not overrun in ('skip', 'catchup'):
+            raise ValueError('Unknown overrun policy "{}", pick "skip" or "catchup"'.format(overrun))
+        self.period = period
+        self.mode = mode
+        self.overrun = overrun
+        self.jitter = jitter
+        self.executions = 0    # Amount of runs of func
+        self.overruns = 0      # Amount of runs which ended after the next run should have started
+        self.skipped = 0       # Amount of runs we skipped because of overruns
+        self.total_runtime = 0.0
+        self.max_runtime = 0.0
+
+    # Update metrics after a run which took given amount of seconds
+    def _record(self, runtime):
+        self.executions += 1
+        self.total_runtime += runtime
+        self.max_runtime = max(self.max_runtime, runtime)
+
+    # Returns given time (time.monotonic()), plus jitter
+    def _jittered(self, moment):
+        return moment + random.uniform(0, self.jitter) if self.jitter > 0 else moment
+
+    # Returns time at which the action is due next, without jitter, after the run planned at given time just completed
+    def _next_time(self, planned):
+        now = time.monotonic()
+        if self.mode == 'delay':
+            return now + self.period
+        planned += self.period
+        if now > planned:
+            self.overruns += 1
+            if self.overrun == 'skip':
+                missed = int((now - planned) // self.period) + 1
+                self.skipped += missed
+                planned += missed*self.period
+        return planned # With overrun 'catchup', the next run is due already
+
+    # Returns average runtime of func in seconds
+    @property
+    def mean_runtime(self):
+        return self.total_runtime / self.executions if self.executions > 0 else 0.0
+
+    # Returns a dict with all metrics
+    def metrics(self):
+        return {
+            'executions': self.executions,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'mean_runtime': self.mean_runtime,
+            'max_runtime': self.max_runtime
+        }
+
+
+class Repeater(threading.Thread, Cadence):
+    '''
+    Simple object to repeat actions on a separate thread, every period seconds.
+
+    With mode='delay' (default), we wait period seconds after every run of func.
+    With mode='rate', we run func at fixed times start+k*period, no matter how long func takes.
+    If a run takes longer than period (an overrun), policy overrun decides what happens
+    with the runs we missed: 'skip' them and continue at the next planned time,
+    or 'catchup' by running them back to back.
+    With jitter > 0, every run (in both modes, including the first) is delayed by a random amount of at most jitter seconds,
+    so many nodes repeating the same action do not run it in lockstep.
+    '''
+    def __init__(self, func, period, mode='delay', overrun='skip', jitter=0.0):
         threading.Thread.__init__(self)
+        Cadence.__init__(self, period, mode, overrun, jitter)
         self.event = threading.Event()
         self.func = func
-        self.period = period
+
+    # Run func once, updating metrics
+    def _execute(self):
+        start = time.monotonic()
+        try:
+            self.func()
+        finally:
+            self._record(time.monotonic() - start)
+
+    # Wait until given time (time.monotonic()), plus jitter. Returns False if we were stopped meanwhile
+    def _wait_until(self, moment):
+        return not self.event.wait(max(0, self._jittered(moment) - time.monotonic()))
 
     # Executed by the parent, do not call this yourself.
     # To start the repeater, use r.start()
     def run(self):
-        while not self.event.is_set():
-            self.func()
-            self.event.wait(self.period)
+        planned = time.monotonic()
+        while self._wait_until(planned): # Every run waits for its jitter, also the first one
+            self._execute()
+            planned = self._next_time(planned)
 
     # Stops the repeater
     def stop(self):
-        self.event.set()
\ No newline at end of file
+        self.event.set()
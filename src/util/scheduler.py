@@ -0,0 +1,191 @@
+# In this file, we provide a scheduler running any amount of periodic and one-shot tasks
+# on a single thread, using a heap ordered by the time tasks are due.
+# Tasks run on the scheduler thread, one at a time, so they should be short.
+#
+# ScheduledRepeater has the same API as util.repeater.Repeater,
+# but runs on a shared scheduler instead of on its own thread.
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from util.printer import *
+from util.repeater import Cadence
+
+
+class ScheduledTask(Cadence):
+    '''
+    A task of a Scheduler. Periodic tasks have a period, one-shot tasks have period None.
+    See util.repeater.Repeater for the meaning of mode, overrun and jitter.
+    Planning runs and metrics come from util.repeater.Cadence, like for a Repeater.
+    '''
+    def __init__(self, func, period, mode, overrun, jitter):
+        Cadence.__init__(self, period, mode, overrun, jitter)
+        self.func = func
+        self.planned = None    # Time (time.monotonic()) this task is due, without jitter
+        self.cancelled = False
+        self.done = threading.Event() # Set when this task will never run again
+
+
+class Scheduler(object):
+    '''
+    Object to run periodic and one-shot tasks on a single thread.
+    The thread starts with the first task, and sleeps until the next task is due.
+    '''
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self.heap = []
+        self.counter = itertools.count() # Breaks ties between tasks due at the same time
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.running = None # Task running right now
+
+    # Add given task to the heap, due at given time plus jitter. Call with condition held
+    def _push(self, task, moment):
+        task.planned = moment
+        heapq.heappush(self.heap, (task._jittered(moment), next(self.counter), task))
+        self.condition.notify()
+
+    def _add(self, task, delay):
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError('Scheduler "{}" is shut down'.format(self.name))
+            self._push(task, time.monotonic() + delay)
+            if self.thread == None:
+                self.thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self.thread.start()
+        return task
+
+    # Run func once, after delay seconds. Returns the ScheduledTask
+    def schedule(self, func, delay=0.0, jitter=0.0):
+        return self._add(ScheduledTask(func, None, 'delay', 'skip', jitter), delay)
+
+    # Run func every period seconds, first after delay seconds. Returns the ScheduledTask.
+    # See util.repeater.Repeater for mode, overrun and jitter
+    def every(self, func, period, mode='delay', overrun='skip', jitter=0.0, delay=0.0):
+        return self._add(ScheduledTask(func, period, mode, overrun, jitter), delay)
+
+    # Cancel given task. If it is running right now, that run completes
+    def cancel(self, task):
+        with self.condition:
+            task.cancelled = True
+            if task != self.running:
+                task.done.set()
+            self.condition.notify()
+
+    # Stop running tasks, and stop the scheduler thread
+    def shutdown(self, wait=True):
+        with self.condition:
+            self.stopped = True
+            for moment, count, task in self.heap:
+                task.cancelled = True
+                task.done.set()
+            self.heap = []
+            self.condition.notify()
+        if wait and self.thread != None and self.thread != threading.current_thread():
+            self.thread.join()
+
+    # Returns amount of tasks waiting to run
+    def pending(self):
+        with self.condition:
+            return sum(1 for x in self.heap if not x[2].cancelled)
+
+    # Run given task once, updating its metrics.
+    # Returns False if it raised an exception, True otherwise
+    def _execute(self, task):
+        start = time.monotonic()
+        try:
+            task.func()
+            return True
+        except Exception as e:
+            printe('Scheduled task {} raised an exception, cancelling it:'.format(getattr(task.func, '__name__', task.func)))
+            traceback.print_exc()
+            return False
+        finally:
+            task._record(time.monotonic() - start)
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    while len(self.heap) > 0 and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)[2].done.set()
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                        continue
+                    wait_time = self.heap[0][0] - time.monotonic()
+                    if wait_time <= 0:
+                        task = heapq.heappop(self.heap)[2]
+                        self.running = task
+                        break
+                    self.condition.wait(wait_time)
+
+            success = self._execute(task)
+
+            with self.condition:
+                self.running = None
+                if task.period == None or task.cancelled or not success or self.stopped:
+                    task.done.set()
+                else:
+                    self._push(task, task._next_time(task.planned))
+
+
+_default = None
+_default_lock = threading.Lock()
+
+# Returns the scheduler shared by everything in this process
+def default_scheduler():
+    global _default
+    with _default_lock:
+        if _default == None:
+            _default = Scheduler(name='default-scheduler')
+        return _default
+
+
+class ScheduledRepeater(object):
+    '''
+    Drop-in replacement for util.repeater.Repeater, running on a shared Scheduler
+    instead of on its own thread. Use start(), stop() and join() like a Repeater.
+    '''
+    def __init__(self, func, period, mode='delay', overrun='skip', jitter=0.0, scheduler=None):
+        self.func = func
+        self.period = period
+        self.mode = mode
+        self.overrun = overrun
+        self.jitter = jitter
+        self.scheduler = scheduler if scheduler != None else default_scheduler()
+        self.task = None
+
+    # Starts the repeater. Like Repeater, func runs right away
+    def start(self):
+        if self.task != None:
+            raise RuntimeError('ScheduledRepeater already started')
+        self.task = self.scheduler.every(self.func, self.period, mode=self.mode, overrun=self.overrun, jitter=self.jitter)
+
+    # Stops the repeater
+    def stop(self):
+        if self.task != None:
+            self.scheduler.cancel(self.task)
+
+    # Wait until the repeater stopped and its last run completed, at most timeout seconds
+    def join(self, timeout=None):
+        if self.task != None:
+            self.task.done.wait(timeout)
+
+    # Returns True if the repeater still runs or will run again, False otherwise
+    def is_alive(self):
+        return self.task != None and not self.task.done.is_set()
+
+    # Returns average runtime of func in seconds
+    @property
+    def mean_runtime(self):
+        return self.task.mean_runtime if self.task != None else 0.0
+
+    # Returns a dict with all metrics of this repeater
+    def metrics(self):
+        return self.task.metrics() if self.task != None else ScheduledTask(self.func, self.period, self.mode, self.overrun, self.jitter).metrics()